@@ -0,0 +1,245 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List
+import numpy as np
+
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from benchmarks.synthetic_catalog import generate_catalog
+from src.database.db_manager import DatabaseManager
+from src.example_inputs import EXAMPLE_INPUTS
+from src.models.song_store import SongStore
+# the tests' fake scenario model: keyword extraction plus random embeddings per text
+from tests.fakes import FakeProcessor
+
+try:
+    import resource
+except ImportError:
+    # windows
+    resource = None
+
+
+class StageTimer:
+    """Wall-clock samples per stage, plus how many items each sample covered"""
+
+    def __init__(self):
+        self.samples = {}
+        self.items = {}
+
+    @contextmanager
+    def time(self, stage: str, items: int = 1):
+        start = time.perf_counter()
+        yield
+        self.samples.setdefault(stage, []).append(time.perf_counter() - start)
+        self.items[stage] = self.items.get(stage, 0) + items
+
+    def summary(self) -> Dict[str, Dict]:
+        return {stage: summarize(samples, self.items[stage]) for stage, samples in self.samples.items()}
+
+
+def summarize(samples: List[float], items: int) -> Dict:
+    seconds = np.asarray(samples) * 1000
+    total = float(np.sum(samples))
+    return {
+        'n': len(samples),
+        'p50_ms': round(float(np.percentile(seconds, 50)), 4),
+        'p99_ms': round(float(np.percentile(seconds, 99)), 4),
+        'mean_ms': round(float(seconds.mean()), 4),
+        'total_s': round(total, 4),
+        # items per second: songs for the catalog stages, queries for the rest
+        'throughput_per_s': round(items / total, 2) if total > 0 else None
+    }
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process so far"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return round(peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024, 1)
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=project_root, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(db_path: str, n_queries: int = 200, warmup: int = 10, top_n: int = 10,
+                   scoring: str = 'count', use_model: bool = True, model_name: str = None,
+                   backend: str = 'torch', use_range_index: bool = True) -> Dict:
+    """
+    Time every stage of a recommendation separately against the catalog in db_path.
+
+    One-off setup stages (loading the catalog, building the index and genre
+    partitions, loading the model and the scenario embeddings) are timed
+    once, their throughput is in songs per second. The per-query stages run
+    for n_queries inputs cycled from EXAMPLE_INPUTS, every other query with a
+    genre, after warmup untimed ones: embedding (with the keyword
+    extraction), feature_ranges (get_feature_ranges), genre_filter
+    (computing a genre's songs from scratch, what the precomputed
+    partitions save), scoring (full score arrays over the catalog),
+    top_k (SongStore.top_k, through the range index when it is built), and
+    recommend (the whole catalog side, SongRecommender.rank_songs).
+    """
+    from src.models.embedding_store import ScenarioEmbeddingStore
+    from src.models.feature_matcher import FeatureMatcher
+    from src.models.song_recommender import SongRecommender
+
+    timer = StageTimer()
+    rss = {}
+
+    db_manager = DatabaseManager(db_path)
+    with timer.time('db_load', items=0):
+        song_store = SongStore.from_database(db_manager)
+    timer.items['db_load'] = len(song_store)
+    rss['db_load'] = peak_rss_mb()
+    if use_range_index:
+        with timer.time('range_index', items=len(song_store)):
+            song_store.build_range_index()
+    with timer.time('genre_partitions', items=len(song_store)):
+        song_store.build_partitions(SongRecommender.GENRE_PROFILES)
+    rss['catalog'] = peak_rss_mb()
+
+    embedding_cache = None
+    if use_model:
+        from src.models.model_registry import get_scenario_processor
+        with timer.time('model_load'):
+            processor = get_scenario_processor(model_name, backend)
+        embedding_store = None
+    else:
+        processor = FakeProcessor(dim=768)
+        # random scenario embeddings don't belong in the real cache
+        embedding_cache = tempfile.TemporaryDirectory()
+        embedding_store = ScenarioEmbeddingStore(embedding_cache.name)
+    with timer.time('scenario_embeddings'):
+        matcher = FeatureMatcher(processor, embedding_store)
+    rss['model'] = peak_rss_mb()
+
+    recommender = SongRecommender(processor, matcher, db_manager, use_range_index=use_range_index, scoring=scoring)
+    recommender._song_store = song_store
+
+    genres = list(SongRecommender.GENRE_PROFILES.keys())
+    discarded = StageTimer()
+    for i in range(warmup + n_queries):
+        # the warmup queries go to a timer that's thrown away
+        stages = timer if i >= warmup else discarded
+        text = EXAMPLE_INPUTS[i % len(EXAMPLE_INPUTS)].lower()
+        genre = genres[(i // 2) % len(genres)] if i % 2 else None
+
+        if use_model:
+            with stages.time('embedding'):
+                scenario_features = processor.process_user_input(text)
+        else:
+            scenario_features = processor.process_user_input(text)
+        with stages.time('feature_ranges'):
+            feature_ranges = matcher.get_feature_ranges(scenario_features)
+
+        if genre:
+            with stages.time('genre_filter'):
+                np.flatnonzero(song_store.range_mask(SongRecommender.GENRE_PROFILES[genre]))
+        with stages.time('scoring'):
+            if scoring == 'graded':
+                song_store.graded_scores(feature_ranges, feature_ranges.weights or None)
+            else:
+                song_store.score_ranges(feature_ranges)
+        # the selection the way production runs it: over the range index when there is one
+        with stages.time('top_k'):
+            if scoring == 'graded':
+                song_store.top_k_graded(feature_ranges, top_n, feature_ranges.weights or None, partition=genre)
+            else:
+                song_store.top_k(feature_ranges, top_n, partition=genre)
+        with stages.time('recommend'):
+            recommender.rank_songs(feature_ranges, genre, top_n)
+
+    db_manager.close()
+    if embedding_cache is not None:
+        embedding_cache.cleanup()
+    rss['end'] = peak_rss_mb()
+
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'created_at': time.time(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'config': {
+            'db': str(Path(db_path).resolve()),
+            'songs': len(song_store),
+            'queries': n_queries,
+            'warmup': warmup,
+            'top_n': top_n,
+            'scoring': scoring,
+            'model': getattr(processor, 'embedding_name', None) if use_model else None,
+            'range_index': use_range_index
+        },
+        'stages': timer.summary(),
+        'peak_rss_mb': rss
+    }
+
+def compare(baseline: Dict, results: Dict) -> List[str]:
+    """One line per stage in both runs: p50 and p99 before -> after, as a ratio"""
+    lines = []
+    for stage, after in results['stages'].items():
+        before = baseline['stages'].get(stage)
+        if before is None:
+            continue
+        parts = []
+        for key in ('p50_ms', 'p99_ms'):
+            ratio = after[key] / before[key] if before[key] else float('nan')
+            parts.append(f"{key[:3]} {before[key]:.3f} -> {after[key]:.3f}ms ({ratio:.2f}x)")
+        lines.append(f"{stage:<20} " + ", ".join(parts))
+    return lines
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time every stage of the recommendation pipeline")
+    parser.add_argument("--db", default=None,
+                        help="catalog to benchmark, generated with --rows songs if it doesn't exist "
+                             "(default: a synthetic catalog in the temp directory)")
+    parser.add_argument("--rows", type=int, default=100000, help="songs in a generated catalog (10k to 10M)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of a generated catalog")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10, help="untimed queries first")
+    parser.add_argument("--top-n", type=int, default=10)
+    parser.add_argument("--scoring", choices=['count', 'graded'], default='count')
+    parser.add_argument("--no-model", action="store_true",
+                        help="random embeddings instead of the scenario model, the embedding stage is skipped")
+    parser.add_argument("--model", default=None, help="model name (default: ScenarioProcessor.MODEL_NAME)")
+    parser.add_argument("--backend", default='torch', help="embedding backend")
+    parser.add_argument("--no-range-index", action="store_true")
+    parser.add_argument("--out", default=None, help="JSON file to write the results to")
+    parser.add_argument("--compare", default=None, help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    db_path = args.db or str(Path(tempfile.gettempdir()) / f"synthetic_catalog_{args.rows}_{args.seed}.db")
+    if not Path(db_path).exists():
+        start = time.time()
+        generate_catalog(db_path, args.rows, args.seed)
+        print(f"Generated {args.rows} songs in {db_path} in {time.time() - start:.1f}s", file=sys.stderr)
+
+    results = run_benchmarks(db_path, args.queries, args.warmup, args.top_n, args.scoring,
+                             use_model=not args.no_model, model_name=args.model, backend=args.backend,
+                             use_range_index=not args.no_range_index)
+    output = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print("\n".join(compare(baseline, results)), file=sys.stderr)
@@ -0,0 +1,119 @@
+import argparse
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from typing import Dict
+import numpy as np
+
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from src.database.db_manager import DatabaseManager
+
+# same layout as the extracted table of the real dataset (only the columns the recommender reads, plus ids)
+CATALOG_SCHEMA = """
+    CREATE TABLE extracted (
+        track_id TEXT,
+        track_name TEXT,
+        artist_name TEXT,
+        danceability REAL,
+        energy REAL,
+        loudness REAL,
+        speechiness REAL,
+        acousticness REAL,
+        instrumentalness REAL,
+        valence REAL,
+        tempo REAL
+    )
+"""
+CATALOG_COLUMNS = ['track_id', 'track_name', 'artist_name', 'danceability', 'energy', 'loudness',
+                   'speechiness', 'acousticness', 'instrumentalness', 'valence', 'tempo']
+
+WORDS = ['love', 'night', 'heart', 'summer', 'dance', 'blue', 'fire', 'rain', 'dream', 'city', 'home',
+         'light', 'road', 'gold', 'wild', 'young', 'river', 'moon', 'song', 'time', 'stay', 'run',
+         'baby', 'world', 'sun', 'lost', 'forever', 'electric', 'paper', 'ocean', 'highway', 'echo']
+
+def synthetic_features(n: int, rng: np.random.Generator) -> Dict[str, np.ndarray]:
+    """
+    Audio features with roughly the shape of real catalogs: energy and
+    loudness go together and against acousticness, acousticness and
+    instrumentalness are bimodal, speechiness is mostly low with a long
+    tail, tempo clusters around 120 bpm. Rounded to 3 decimals like the
+    source data, so plenty of songs share values.
+    """
+    energy = rng.beta(2.5, 1.6, n)
+    acoustic = rng.random(n) < 0.85 - 0.7 * energy
+    features = {
+        'danceability': rng.beta(5.0, 3.5, n),
+        'energy': energy,
+        'loudness': np.clip(-22 + 18 * energy + rng.normal(0, 2.5, n), -60, 0),
+        'speechiness': np.clip(rng.lognormal(np.log(0.05), 0.8, n), 0.02, 0.97),
+        'acousticness': np.where(acoustic, rng.beta(3.0, 0.8, n), rng.beta(0.4, 3.0, n)),
+        'instrumentalness': np.where(rng.random(n) < 0.3, rng.beta(2.0, 0.6, n), rng.exponential(0.002, n)),
+        'valence': rng.beta(2.0, 2.0, n),
+        'tempo': np.clip(rng.normal(120, 28, n), 50, 220)
+    }
+    return {name: np.round(np.clip(values, None, 1.0) if name not in ('loudness', 'tempo') else values, 3)
+            for name, values in features.items()}
+
+def generate_catalog(db_path: str, n_rows: int, seed: int = 0, missing_rate: float = 0.01,
+                     chunk_size: int = 100000) -> int:
+    """
+    Write an extracted table with n_rows synthetic songs to db_path (which
+    must not exist yet) and run the DatabaseManager migrations on it, so it
+    looks like a real catalog with its indices. A missing_rate share of the
+    songs has one NULL feature, like the real data. Returns the number of
+    songs get_song_features keeps.
+    """
+    path = Path(db_path)
+    if path.exists():
+        raise FileExistsError(f"{db_path} already exists")
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    rng = np.random.default_rng(seed)
+    # a few prolific artists and a long tail, like real catalogs
+    n_artists = max(n_rows // 8, 1)
+    feature_names = CATALOG_COLUMNS[3:]
+    conn = sqlite3.connect(str(path))
+    try:
+        # throwaway file, no need for crash safety while filling it
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute(CATALOG_SCHEMA)
+        placeholders = ', '.join('?' * len(CATALOG_COLUMNS))
+        for start in range(0, n_rows, chunk_size):
+            n = min(chunk_size, n_rows - start)
+            features = synthetic_features(n, rng)
+            matrix = np.column_stack([features[name] for name in feature_names]).astype(object)
+            missing = np.flatnonzero(rng.random(n) < missing_rate)
+            matrix[missing, rng.integers(0, len(feature_names), len(missing))] = None
+
+            word_ids = rng.integers(0, len(WORDS), (n, 3))
+            lengths = rng.integers(1, 4, n)
+            artists = (n_artists * rng.random(n) ** 3).astype(np.int64)
+            rows = []
+            for i in range(n):
+                track_name = ' '.join(WORDS[w] for w in word_ids[i, :lengths[i]]).title()
+                rows.append((f"synthetic{start + i:08d}", track_name, f"Artist {artists[i]}", *matrix[i]))
+            conn.executemany(f"INSERT INTO extracted ({', '.join(CATALOG_COLUMNS)}) VALUES ({placeholders})", rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+    db_manager = DatabaseManager(str(path))
+    n_songs = db_manager.count_song_features()['rows']
+    db_manager.close()
+    return n_songs
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic extracted.db for benchmarks")
+    parser.add_argument("out", help="database file to create")
+    parser.add_argument("--rows", type=int, default=100000, help="number of songs (10k to 10M)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--missing-rate", type=float, default=0.01, help="share of songs with a NULL feature")
+    args = parser.parse_args()
+
+    start = time.time()
+    n_songs = generate_catalog(args.out, args.rows, args.seed, args.missing_rate)
+    print(f"Wrote {args.rows} songs ({n_songs} usable) to {args.out} in {time.time() - start:.1f}s")
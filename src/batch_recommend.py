@@ -0,0 +1,90 @@
+import argparse
+import csv
+import json
+import sys
+import time
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterator, List, TextIO
+
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+def read_scenarios(f: TextIO, fmt: str) -> Iterator[Dict]:
+    """
+    Yield {'id', 'input', 'genre'} records. CSV files need an 'input' column,
+    JSONL lines are either objects with an 'input' key or bare strings.
+    'id' and 'genre' are optional, the id defaults to the record number.
+    """
+    if fmt == 'csv':
+        records = csv.DictReader(f)
+    else:
+        records = (json.loads(line) for line in f if line.strip())
+
+    for i, record in enumerate(records):
+        if isinstance(record, str):
+            record = {'input': record}
+        yield {
+            'id': record.get('id', i),
+            'input': record['input'],
+            'genre': record.get('genre') or None
+        }
+
+def recommend_file(recommender, scenarios: Iterator[Dict], out: TextIO, genre: str = None,
+                   top_n: int = 10, chunk_size: int = 10000, batch_size: int = 64) -> int:
+    """Stream scenarios through recommend_batch chunk by chunk, writing one JSON line per scenario"""
+    n = 0
+    while True:
+        chunk = list(islice(scenarios, chunk_size))
+        if not chunk:
+            return n
+
+        # one batch per genre, written back in input order
+        results: List = [None] * len(chunk)
+        by_genre = {}
+        for i, record in enumerate(chunk):
+            by_genre.setdefault(record['genre'] or genre, []).append(i)
+        for chunk_genre, positions in by_genre.items():
+            songs = recommender.recommend_batch([chunk[i]['input'] for i in positions], genre=chunk_genre,
+                                                top_n=top_n, batch_size=batch_size)
+            for i, recommendations in zip(positions, songs):
+                results[i] = recommendations
+
+        for record, recommendations in zip(chunk, results):
+            record['genre'] = record['genre'] or genre
+            record['recommendations'] = recommendations
+            out.write(json.dumps(record) + "\n")
+        n += len(chunk)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recommend songs for every scenario in a JSONL or CSV file")
+    parser.add_argument("input", help="scenarios, .csv or .jsonl ('-' reads JSONL from stdin)")
+    parser.add_argument("--out", default="-", help="JSONL file to write (default: stdout)")
+    parser.add_argument("--format", choices=['jsonl', 'csv'], default=None,
+                        help="input format (default: from the file extension)")
+    parser.add_argument("--genre", default=None, help="genre for scenarios that don't name one")
+    parser.add_argument("--top-n", type=int, default=10)
+    parser.add_argument("--chunk-size", type=int, default=10000, help="scenarios read and scored at a time")
+    parser.add_argument("--batch-size", type=int, default=64, help="scenarios per forward pass")
+    parser.add_argument("--db", default=None, help="path to extracted.db (default: data/extracted.db)")
+    parser.add_argument("--snapshot", default=None, help="catalog snapshot to load instead of the database")
+    args = parser.parse_args()
+
+    from src.database.db_manager import DatabaseManager
+    from src.models.song_recommender import SongRecommender
+
+    fmt = args.format or ('csv' if args.input.lower().endswith('.csv') else 'jsonl')
+    recommender = SongRecommender(db_manager=DatabaseManager(args.db), snapshot_path=args.snapshot)
+
+    start = time.time()
+    src = sys.stdin if args.input == '-' else open(args.input, 'r', encoding='utf-8', newline='')
+    out = sys.stdout if args.out == '-' else open(args.out, 'w', encoding='utf-8')
+    try:
+        n = recommend_file(recommender, read_scenarios(src, fmt), out, args.genre, args.top_n,
+                           args.chunk_size, args.batch_size)
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if out is not sys.stdout:
+            out.close()
+    print(f"Recommended songs for {n} scenarios in {time.time() - start:.1f}s", file=sys.stderr)
@@ -0,0 +1,72 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from src.models.embedding_backends import BACKENDS
+from src.models.feature_matcher import FeatureMatcher
+from src.models.model_registry import get_scenario_processor
+
+def _scenario_id(scenario: Dict) -> tuple:
+    return (scenario['mood'], scenario['activity'], scenario['time'], scenario['social'])
+
+def mapped_scenario_texts(model_name: str = None, backend: str = 'torch') -> List[str]:
+    """The texts of the mapped scenarios, 300 with the current categories"""
+    matcher = FeatureMatcher(get_scenario_processor(model_name, backend))
+    return [mapping['text'] for mapping in matcher.scenario_mappings]
+
+def similar_scenario_ids(backend: str, texts: List[str], model_name: str = None, k: int = 3) -> Dict:
+    """Top-k _similar_scenarios of every text with the given backend, plus how long embedding took"""
+    processor = get_scenario_processor(model_name, backend)
+    matcher = FeatureMatcher(processor)
+
+    start = time.time()
+    scenario_features = processor.process_user_inputs(texts)
+    seconds = time.time() - start
+
+    top = [[_scenario_id(similar['scenario']) for similar in matcher._similar_scenarios(features, k)]
+           for features in scenario_features]
+    return {'top': top, 'seconds': seconds}
+
+def check_parity(backend: str, reference: str = 'torch', model_name: str = None,
+                 texts: List[str] = None, k: int = 3) -> List[Dict]:
+    """
+    Compare the top-k similar scenarios of the backend against the reference
+    backend. By default the texts are the mapped scenarios themselves. Returns
+    the texts whose top-k differ.
+    """
+    if texts is None:
+        texts = mapped_scenario_texts(model_name, reference)
+
+    expected = similar_scenario_ids(reference, texts, model_name, k)
+    actual = similar_scenario_ids(backend, texts, model_name, k)
+    print(f"{reference}: {expected['seconds']:.2f}s, {backend}: {actual['seconds']:.2f}s for {len(texts)} texts")
+
+    return [{'text': text, 'expected': e, 'actual': a}
+            for text, e, a in zip(texts, expected['top'], actual['top']) if e != a]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check that an embedding backend finds the same similar scenarios as the torch model")
+    parser.add_argument("backend", choices=list(BACKENDS), help="backend to check")
+    parser.add_argument("--reference", choices=list(BACKENDS), default='torch')
+    parser.add_argument("--model", default=None, help="model name (default: ScenarioProcessor.MODEL_NAME)")
+    parser.add_argument("--inputs", default=None, help="file with one extra input text per line to compare")
+    parser.add_argument("-k", type=int, default=3)
+    args = parser.parse_args()
+
+    texts = None
+    if args.inputs:
+        texts = mapped_scenario_texts(args.model, args.reference)
+        with open(args.inputs, 'r', encoding='utf-8') as f:
+            texts += [line.strip() for line in f if line.strip()]
+
+    mismatches = check_parity(args.backend, args.reference, args.model, texts, args.k)
+    for mismatch in mismatches:
+        print(f"{mismatch['text']!r}: expected {mismatch['expected']}, got {mismatch['actual']}")
+    print(f"{len(mismatches)} mismatches")
+    sys.exit(1 if mismatches else 0)
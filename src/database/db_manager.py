@@ -1,36 +1,130 @@
+import os
 import sqlite3
+import threading
 import pandas as pd
 import numpy as np
 from pathlib import Path
+from typing import Dict, Iterator, List, Tuple, Union
 
 class DatabaseManager:
-    def __init__(self, db_path: str = None):
+    SONG_COLUMNS = ['track_name', 'artist_name', 'danceability', 'energy', 'valence', 'tempo',
+                    'acousticness', 'instrumentalness', 'speechiness']
+    TEXT_COLUMNS = {'track_name', 'artist_name'}
+    FEATURE_COLUMNS = ['danceability', 'energy', 'valence', 'tempo',
+                       'acousticness', 'instrumentalness', 'speechiness']
+    # returned with every recommendation
+    RESULT_COLUMNS = ['track_name', 'artist_name', 'danceability', 'energy', 'valence', 'tempo',
+                      'acousticness', 'instrumentalness']
+    ROWID_COLUMN = 'rowid'
+    # optional column, when present catalog refreshes also pick up edited rows
+    UPDATED_AT_COLUMN = 'updated_at'
+    # bump when _migrate() learns a new step, tracked in the database's PRAGMA user_version
+    SCHEMA_VERSION = 2
+
+    # applied to every pooled connection
+    CONNECTION_PRAGMAS = [
+        "PRAGMA mmap_size = 268435456",   # 256 MiB of the file mapped instead of read()
+        "PRAGMA cache_size = -65536",     # 64 MiB page cache per connection
+        "PRAGMA temp_store = MEMORY"
+    ]
+
+    # rows get_song_features considers usable: none of these is NULL (tempo may be missing)
+    REQUIRED_COLUMNS = ['danceability', 'energy', 'valence', 'acousticness', 'instrumentalness', 'speechiness']
+    SONG_FILTER = " AND ".join(f"{column} IS NOT NULL" for column in REQUIRED_COLUMNS)
+
+    def __init__(self, db_path: str = None, read_only: bool = True, migrate: bool = True):
         if db_path is None:
             # Get the project root directory
             project_root = Path(__file__).resolve().parent.parent.parent
             db_path = str(project_root / "data" / "extracted.db")
         self.db_path = db_path
-        self._create_indices()
-    
-    def _create_indices(self):
-        """Create indices for frequently queried columns"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            # Create indices for the most commonly filtered columns
-            indices = [
-                "CREATE INDEX IF NOT EXISTS idx_danceability ON extracted(danceability)",
-                "CREATE INDEX IF NOT EXISTS idx_energy ON extracted(energy)",
-                "CREATE INDEX IF NOT EXISTS idx_valence ON extracted(valence)",
-                "CREATE INDEX IF NOT EXISTS idx_acousticness ON extracted(acousticness)",
-                "CREATE INDEX IF NOT EXISTS idx_instrumentalness ON extracted(instrumentalness)",
-                "CREATE INDEX IF NOT EXISTS idx_speechiness ON extracted(speechiness)"
-            ]
-            for index_sql in indices:
-                cursor.execute(index_sql)
+        self.read_only = read_only
+
+        # one connection per thread (and per process, in case we were forked)
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+        if migrate:
+            self.migrate()
+
+    def migrate(self):
+        """Run the one-time schema migrations this database hasn't seen yet"""
+        # checked over the pooled connection, only a pending migration opens the file for writing
+        if self.get_connection().execute("PRAGMA user_version").fetchone()[0] >= self.SCHEMA_VERSION:
+            return
+        self.close()
+        conn = sqlite3.connect(self._uri('rw'), uri=True)
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= self.SCHEMA_VERSION:
+                return
+            self._migrate(conn, version)
+            conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
             conn.commit()
-    
+        finally:
+            conn.close()
+
+    def _migrate(self, conn: sqlite3.Connection, version: int):
+        if version < 1:
+            self._create_indices(conn)
+            # WAL lets the read-only request connections read while a writer appends
+            conn.execute("PRAGMA journal_mode = WAL")
+        if version < 2:
+            # covering index for SQL scoring: a full scan reads the index instead of the wide table
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_song_features ON extracted(
+                    danceability, energy, valence, acousticness, instrumentalness, speechiness,
+                    tempo, track_name, artist_name)
+            """)
+
+    def _create_indices(self, conn: sqlite3.Connection):
+        """Create indices for frequently queried columns"""
+        cursor = conn.cursor()
+        # Create indices for the most commonly filtered columns
+        indices = [
+            "CREATE INDEX IF NOT EXISTS idx_danceability ON extracted(danceability)",
+            "CREATE INDEX IF NOT EXISTS idx_energy ON extracted(energy)",
+            "CREATE INDEX IF NOT EXISTS idx_valence ON extracted(valence)",
+            "CREATE INDEX IF NOT EXISTS idx_acousticness ON extracted(acousticness)",
+            "CREATE INDEX IF NOT EXISTS idx_instrumentalness ON extracted(instrumentalness)",
+            "CREATE INDEX IF NOT EXISTS idx_speechiness ON extracted(speechiness)"
+        ]
+        for index_sql in indices:
+            cursor.execute(index_sql)
+        conn.commit()
+
+    def _uri(self, mode: str) -> str:
+        return f"{Path(self.db_path).resolve().as_uri()}?mode={mode}"
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._uri('ro' if self.read_only else 'rw'), uri=True,
+                               check_same_thread=False, cached_statements=256)
+        for pragma in self.CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
     def get_connection(self):
-        return sqlite3.connect(self.db_path)
+        """
+        This thread's pooled connection. Statements are cached per connection,
+        so reusing the same SQL text reuses the prepared statement.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        """Close every pooled connection, threads reconnect on their next call"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
     
     def get_table_info(self):
         with self.get_connection() as conn:
@@ -46,30 +140,180 @@ class DatabaseManager:
                 table_info[table_name] = [col[1] for col in columns]
         return table_info
     
-    def get_song_features(self, limit:int = None):
+    def _song_features_query(self, columns: List[str] = None, limit: int = None, after_rowid: int = None,
+                             updated_since=None, filtered: bool = True) -> Tuple[str, List[str], list]:
         # Only select the columns we actually use
-        query = """
+        if columns is None:
+            columns = self.SONG_COLUMNS
+        unknown = [c for c in columns if c not in self.SONG_COLUMNS and c != self.ROWID_COLUMN]
+        if unknown:
+            raise ValueError(f"Unknown song columns: {unknown}")
+
+        # incremental loads: rows added after a rowid and/or rows changed at or after an updated_at value
+        changed = []
+        params = []
+        if after_rowid is not None:
+            changed.append("rowid > ?")
+            params.append(int(after_rowid))
+        if updated_since is not None:
+            # rows edited in the same tick as the last load's mark are only caught with >=,
+            # the caller skips the ones it already has
+            changed.append(f"{self.UPDATED_AT_COLUMN} >= ?")
+            params.append(updated_since)
+        # unfiltered loads also return the rows that stopped being usable, so a refresh can drop them
+        conditions = [self.SONG_FILTER] if filtered else []
+        if changed:
+            conditions.append(f"({' OR '.join(changed)})")
+
+        query = f"""
         SELECT 
-            track_name,
-            artist_name,
-            danceability,
-            energy,
-            valence,
-            tempo,
-            acousticness,
-            instrumentalness,
-            speechiness
+            {', '.join(columns)}
         FROM extracted
-        WHERE 
-            danceability IS NOT NULL
-            AND energy IS NOT NULL
-            AND valence IS NOT NULL
-            AND acousticness IS NOT NULL
-            AND instrumentalness IS NOT NULL
-            AND speechiness IS NOT NULL
+        {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+        ORDER BY rowid
         """
         if limit:
-            query += f" LIMIT {limit}"
-            
+            query += f" LIMIT {int(limit)}"
+        return query, list(columns), params
+
+    def get_song_features(self, limit:int = None, columns: List[str] = None):
+        query, _, params = self._song_features_query(columns, limit)
+        with self.get_connection() as conn:
+            return pd.read_sql_query(query, conn, params=params)
+
+    def count_song_features(self, limit: int = None, columns: List[str] = None, after_rowid: int = None,
+                            updated_since=None, filtered: bool = True) -> Dict[str, int]:
+        """
+        Number of rows get_song_features would return, plus the total utf-8 size
+        of each text column so loaders can preallocate their buffers.
+        """
+        query, columns, params = self._song_features_query(columns, limit, after_rowid, updated_since, filtered)
+        text_columns = [c for c in columns if c in self.TEXT_COLUMNS]
+        sizes = ''.join(f", COALESCE(SUM(LENGTH(CAST({c} AS BLOB))), 0)" for c in text_columns)
+
+        with self.get_connection() as conn:
+            row = conn.execute(f"SELECT COUNT(*){sizes} FROM ({query})", params).fetchone()
+        counts = {'rows': row[0]}
+        counts.update(zip(text_columns, row[1:]))
+        return counts
+
+    def iter_song_features(self, columns: List[str] = None, chunk_size: int = 50000, limit: int = None,
+                           after_rowid: int = None, updated_since=None,
+                           filtered: bool = True) -> Iterator[Dict[str, Union[np.ndarray, list]]]:
+        """
+        Stream the song features in chunks of at most chunk_size rows.
+
+        Every chunk maps column name -> values: float32 arrays for the audio
+        features (NULL becomes NaN), int64 for rowid and lists of str for the
+        text columns. Only one chunk of raw sqlite rows is alive at a time.
+        With filtered=False the rows failing SONG_FILTER are returned too.
+        """
+        query, columns, params = self._song_features_query(columns, limit, after_rowid, updated_since, filtered)
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                values = list(zip(*rows))
+                del rows
+                yield {column: self._column_array(column, col) for column, col in zip(columns, values)}
+
+    def _column_array(self, column: str, values: tuple):
+        if column in self.TEXT_COLUMNS:
+            return list(values)
+        if column == self.ROWID_COLUMN:
+            return np.array(values, dtype=np.int64)
+        return np.array(values, dtype=np.float32)
+
+    def get_song_row_ids(self, chunk_size: int = 100000) -> np.ndarray:
+        """Ascending rowids of every usable song, to find the ones deleted since a load"""
+        chunks = []
+        with self.get_connection() as conn:
+            cursor = conn.execute(f"SELECT rowid FROM extracted WHERE {self.SONG_FILTER} ORDER BY rowid")
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                chunks.append(np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows)))
+        return np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64)
+
+    def get_max_row_id(self) -> int:
+        """Highest rowid in the table, usable or not, the high-water mark for added rows"""
+        with self.get_connection() as conn:
+            return conn.execute("SELECT MAX(rowid) FROM extracted").fetchone()[0] or 0
+
+    def has_column(self, column: str, table: str = 'extracted') -> bool:
+        return column in self.get_table_info().get(table, [])
+
+    def get_max_updated_at(self):
+        """Latest updated_at in the table, or None when the table has no such column"""
+        if not self.has_column(self.UPDATED_AT_COLUMN):
+            return None
+        with self.get_connection() as conn:
+            return conn.execute(f"SELECT MAX({self.UPDATED_AT_COLUMN}) FROM extracted").fetchone()[0]
+
+    @staticmethod
+    def _float32_bounds(min_val: float, max_val: float) -> List[float]:
+        """
+        Double bounds that match exactly the doubles whose float32 rounding lies
+        within the float32 rounding of [min_val, max_val]: the catalog is scored
+        in float32 in memory, SQLite compares the stored doubles.
+        """
+        low, high = np.float32(min_val), np.float32(max_val)
+        if not (np.isfinite(low) and np.isfinite(high)):
+            return [float(low), float(high)]
+        # the halfway points to the neighbouring float32 values are exact doubles, and round
+        # to the even one of the two
+        below = (float(low) + float(np.nextafter(low, np.float32(-np.inf)))) / 2
+        if np.float32(below) != low:
+            below = float(np.nextafter(below, np.inf))
+        above = (float(high) + float(np.nextafter(high, np.float32(np.inf)))) / 2
+        if np.float32(above) != high:
+            above = float(np.nextafter(above, -np.inf))
+        return [below, above]
+
+    def get_top_scored_songs(self, feature_ranges: Dict[str, Tuple[float, float]],
+                             filter_ranges: Dict[str, Tuple[float, float]] = None,
+                             top_n: int = 10) -> List[Dict]:
+        """
+        Score songs inside SQLite and return only the top_n rows.
+
+        The score counts how many of feature_ranges a song falls into, the same
+        as the in-memory scoring. filter_ranges (e.g. a genre profile) must all
+        match. Equal scores are returned in rowid order. Bounds are compared
+        like SongStore does, with the values and the bounds rounded to float32
+        (see _float32_bounds), so songs on a bound match the same way.
+        """
+        score_terms = []
+        score_params = []
+        for feature, (min_val, max_val) in feature_ranges.items():
+            # features the table doesn't have never match, like in memory
+            if feature in self.FEATURE_COLUMNS:
+                score_terms.append(f"(CASE WHEN {feature} BETWEEN ? AND ? THEN 1 ELSE 0 END)")
+                score_params.extend(self._float32_bounds(min_val, max_val))
+
+        filter_terms = []
+        filter_params = []
+        for feature, (min_val, max_val) in (filter_ranges or {}).items():
+            if feature not in self.FEATURE_COLUMNS:
+                raise ValueError(f"Unknown feature: {feature}")
+            filter_terms.append(f"AND {feature} BETWEEN ? AND ?")
+            filter_params.extend(self._float32_bounds(min_val, max_val))
+
+        query = f"""
+        SELECT 
+            {', '.join(self.RESULT_COLUMNS)},
+            {' + '.join(score_terms) or '0'} AS score
+        FROM extracted
+        WHERE {self.SONG_FILTER}
+            {' '.join(filter_terms)}
+        ORDER BY score DESC, rowid
+        LIMIT ?
+        """
+        params = score_params + filter_params + [int(top_n)]
+
         with self.get_connection() as conn:
-            return pd.read_sql_query(query, conn)
\ No newline at end of file
+            rows = conn.execute(query, params).fetchall()
+        return [dict(zip(self.RESULT_COLUMNS, row[:-1])) for row in rows]
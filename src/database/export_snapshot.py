@@ -0,0 +1,49 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parent.parent.parent
+sys.path.append(str(project_root))
+
+from src.database.db_manager import DatabaseManager
+from src.models.song_recommender import SongRecommender
+from src.models.song_store import SongStore
+
+def export_snapshot(db_path: str, snapshot_path: str, chunk_size: int = 50000,
+                    use_range_index: bool = True) -> SongStore:
+    """
+    Read the filtered catalog from the database and write it as a binary
+    snapshot, with the range index and the genre partitions so workers
+    loading it don't have to build them.
+    """
+    db_manager = DatabaseManager(db_path)
+    # recorded so a recommender loading the snapshot can fetch later edits
+    updated_at = db_manager.get_max_updated_at()
+    max_row_id = db_manager.get_max_row_id()
+    song_store = SongStore.from_database(db_manager, chunk_size=chunk_size)
+    if use_range_index:
+        song_store.build_range_index()
+    song_store.build_partitions(SongRecommender.GENRE_PROFILES)
+    song_store.save(snapshot_path, metadata={
+        'source': str(Path(db_manager.db_path).resolve()),
+        'created_at': time.time(),
+        'updated_at': updated_at,
+        'max_row_id': max_row_id
+    })
+    db_manager.close()
+    return song_store
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the song catalog to a binary snapshot")
+    parser.add_argument("--db", default=None, help="path to extracted.db (default: data/extracted.db)")
+    parser.add_argument("--out", default=str(project_root / "data" / "catalog_snapshot"),
+                        help="snapshot directory to write")
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    parser.add_argument("--no-range-index", action="store_true",
+                        help="leave out the range index, for workers that run without it")
+    args = parser.parse_args()
+
+    start = time.time()
+    song_store = export_snapshot(args.db, args.out, args.chunk_size, not args.no_range_index)
+    print(f"Wrote {len(song_store)} songs to {args.out} in {time.time() - start:.1f}s")
@@ -0,0 +1,24 @@
+# free text like the users type, none of it among the mapped scenarios. The benchmarks cycle
+# through it and train_range_regressor scores the trained model on it (plus a few more)
+EXAMPLE_INPUTS = [
+    "I'm working out with friends in the late evening",
+    "studying alone at night",
+    "relaxing on a sunday morning with my family",
+    "driving to work in the morning, feeling sad",
+    "party with friends tonight",
+    "cooking dinner in the evening",
+    "feeling happy and energetic this afternoon",
+    "quiet focused coding session",
+    "running in the morning",
+    "chilling by myself after a long day",
+    "road trip with the family",
+    "getting ready to go out on a friday night",
+    "rainy afternoon, reading a book",
+    "morning commute on the train",
+    "late night walk alone, a bit melancholic",
+    "dancing at a friend's birthday",
+    "yoga and stretching in the morning",
+    "focused work in the afternoon",
+    "sad and lonely evening",
+    "barbecue with family and friends"
+]
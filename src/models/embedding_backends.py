@@ -0,0 +1,147 @@
+import warnings
+import numpy as np
+import torch
+from pathlib import Path
+from transformers import AutoConfig, AutoModel
+from src.models.embedding_store import atomic_write, default_cache_dir
+
+class TorchBackend:
+    """The full precision transformer, on GPU when there is one"""
+    name = 'torch'
+
+    def __init__(self, model):
+        self.model = model
+        self.model.eval() # we need to tell the model that we are predicting, not training
+        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.model.to(self.device)
+        self.hidden_size = model.config.hidden_size
+
+    @classmethod
+    def from_pretrained(cls, model_name: str, cache_dir: str = None) -> 'TorchBackend':
+        return cls(AutoModel.from_pretrained(model_name))
+
+    def embed(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        """CLS vectors of one padded batch, as a (batch, hidden_size) float32 array"""
+        inputs = {
+            'input_ids': torch.from_numpy(input_ids).to(self.device),
+            'attention_mask': torch.from_numpy(attention_mask).to(self.device)
+        }
+        with torch.no_grad():
+            outputs = self.model(**inputs)
+        return outputs.last_hidden_state[:, 0, :].float().cpu().numpy()
+
+
+class QuantizedTorchBackend(TorchBackend):
+    """
+    Dynamic int8 quantization of every Linear layer: weights are stored as
+    int8 and activations quantized on the fly. CPU only, roughly a quarter of
+    the weight memory and much faster matmuls than float32.
+
+    torch.ao.quantization is deprecated in newer torch in favour of
+    torchao's quantize_ API; until torchao is a dependency the warnings are
+    silenced here.
+    """
+    name = 'quantized'
+
+    def __init__(self, model):
+        model.eval()
+        with warnings.catch_warnings():
+            # newer torch warns that the quantized tensor types (UserWarning) and
+            # torch.ao.quantization itself (DeprecationWarning) are deprecated
+            warnings.simplefilter("ignore", UserWarning)
+            warnings.simplefilter("ignore", DeprecationWarning)
+            self.model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.device = torch.device('cpu')
+        self.hidden_size = model.config.hidden_size
+
+
+class _ClsOnly(torch.nn.Module):
+    """Wraps the transformer for export so the graph takes plain tensors and only returns CLS vectors"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state[:, 0, :]
+
+
+class OnnxBackend:
+    """
+    ONNX Runtime on CPU. The model is exported to ONNX once and the file is
+    kept in the cache directory, later processes only load the session.
+    """
+    name = 'onnx'
+
+    def __init__(self, model_path: str, hidden_size: int, n_threads: int = None):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("The 'onnx' embedding backend needs onnxruntime (pip install onnxruntime)")
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if n_threads:
+            options.intra_op_num_threads = n_threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.path = model_path
+        self.hidden_size = hidden_size
+
+    @staticmethod
+    def model_path(model_name: str, cache_dir: str = None) -> Path:
+        cache_dir = Path(cache_dir) if cache_dir is not None else default_cache_dir()
+        return cache_dir / "onnx" / f"{model_name.replace('/', '--')}.onnx"
+
+    @classmethod
+    def from_pretrained(cls, model_name: str, cache_dir: str = None) -> 'OnnxBackend':
+        path = cls.model_path(model_name, cache_dir)
+        if not path.exists():
+            # the torch model is only needed for the one-time export, eager attention traces cleanly
+            cls.export(AutoModel.from_pretrained(model_name, attn_implementation="eager"), path)
+        return cls(str(path), AutoConfig.from_pretrained(model_name).hidden_size)
+
+    @staticmethod
+    def export(model, path: Path):
+        """Export the model to path (see atomic_write)"""
+        model.eval()
+        # the second row is padded, otherwise tracing drops the attention mask as a no-op
+        input_ids = torch.ones((2, 8), dtype=torch.long)
+        attention_mask = torch.ones((2, 8), dtype=torch.long)
+        attention_mask[1, 4:] = 0
+        with atomic_write(path) as tmp_path, warnings.catch_warnings():
+            # the tracer warns about python control flow in the model that doesn't depend on the inputs
+            warnings.simplefilter("ignore")
+            torch.onnx.export(
+                _ClsOnly(model),
+                (input_ids, attention_mask),
+                str(tmp_path),
+                input_names=['input_ids', 'attention_mask'],
+                output_names=['cls'],
+                dynamic_axes={
+                    'input_ids': {0: 'batch', 1: 'sequence'},
+                    'attention_mask': {0: 'batch', 1: 'sequence'},
+                    'cls': {0: 'batch'}
+                },
+                opset_version=17,
+                dynamo=False
+            )
+
+    def embed(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        cls, = self.session.run(['cls'], {
+            'input_ids': input_ids.astype(np.int64, copy=False),
+            'attention_mask': attention_mask.astype(np.int64, copy=False)
+        })
+        return np.ascontiguousarray(cls, dtype=np.float32)
+
+
+BACKENDS = {
+    'torch': TorchBackend,
+    'quantized': QuantizedTorchBackend,
+    'onnx': OnnxBackend
+}
+
+def load_backend(name: str, model_name: str, cache_dir: str = None):
+    """Load model_name behind the named embedding backend"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {name} (expected one of {', '.join(BACKENDS)})")
+    return BACKENDS[name].from_pretrained(model_name, cache_dir)
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import threading
+import warnings
+import numpy as np
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+def default_cache_dir() -> Path:
+    """data/cache under the project root, where the on-disk caches go unless told otherwise"""
+    return Path(__file__).resolve().parent.parent.parent / "data" / "cache"
+
+@contextmanager
+def atomic_write(path) -> Iterator[Path]:
+    """
+    Yields a temp path next to path to write the file to, which then replaces
+    path in one step: other workers see the old file or the new one, never
+    half of it. The temp file is removed when writing fails.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # keeps the suffix, np.save and friends add theirs otherwise
+    tmp_path = path.with_name(f"{path.stem}.{os.getpid()}-{threading.get_ident()}.tmp{path.suffix}")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+class ScenarioEmbeddingStore:
+    """
+    On-disk cache for the precomputed scenario embeddings used by FeatureMatcher.
+
+    Embeddings are saved as a plain .npy matrix (loaded memory-mapped) next to a
+    small json file with the key and scenario texts they were computed from.
+    """
+    VERSION = 1
+
+    def __init__(self, cache_dir: str = None):
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else default_cache_dir()
+
+    @classmethod
+    def make_key(cls, model_name: str, categories: Dict[str, List[str]], template: str) -> str:
+        """Hash everything the scenario embeddings depend on"""
+        payload = json.dumps({
+            'version': cls.VERSION,
+            'model': model_name,
+            'categories': categories,
+            'template': template
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _paths(self, key: str):
+        stem = f"scenario_embeddings_{key[:16]}"
+        return self.cache_dir / f"{stem}.npy", self.cache_dir / f"{stem}.json"
+
+    def load(self, key: str, texts: List[str]) -> Optional[np.ndarray]:
+        """Return the cached (n_scenarios, dim) matrix, or None if missing or stale"""
+        matrix_path, meta_path = self._paths(key)
+        if not matrix_path.exists() or not meta_path.exists():
+            return None
+
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('key') != key or meta.get('texts') != list(texts):
+                return None
+
+            embeddings = np.load(matrix_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+
+        if embeddings.ndim != 2 or embeddings.shape[0] != len(texts):
+            return None
+        return embeddings
+
+    def save(self, key: str, embeddings: np.ndarray, texts: List[str], model_name: str):
+        matrix_path, meta_path = self._paths(key)
+        meta = {
+            'key': key,
+            'version': self.VERSION,
+            'model': model_name,
+            'shape': list(embeddings.shape),
+            'texts': list(texts)
+        }
+
+        try:
+            # the matrix goes first, a new meta file never points at an old matrix
+            with atomic_write(matrix_path) as tmp_matrix:
+                np.save(tmp_matrix, np.ascontiguousarray(embeddings, dtype=np.float32))
+            with atomic_write(meta_path) as tmp_meta:
+                with open(tmp_meta, 'w', encoding='utf-8') as f:
+                    json.dump(meta, f)
+        except OSError as e:
+            warnings.warn(f"Could not write scenario embedding cache to {self.cache_dir}: {e}")
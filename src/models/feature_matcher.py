@@ -1,17 +1,57 @@
+import itertools
 import numpy as np
 import pandas as pd
 from typing import Dict, List, Tuple
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import MinMaxScaler
 from src.models.scenario_processor import ScenarioProcessor
+from src.models.embedding_store import ScenarioEmbeddingStore
+from src.models.scenario_index import ScenarioIndex
+from src.models.model_registry import get_scenario_processor
+
+class FeatureRanges(dict):
+    """feature -> (min, max), plus feature -> weight in .weights (empty means all equal)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.weights = {}
+
+    def copy(self) -> 'FeatureRanges':
+        feature_ranges = FeatureRanges(self)
+        feature_ranges.weights = dict(self.weights)
+        return feature_ranges
+
 
 class FeatureMatcher:
-    def __init__(self):
+    # every mapped scenario is described with this text before being embedded
+    SCENARIO_TEMPLATE = "{activity} in the {time}, feeling {mood}, {social}"
+
+    def __init__(self, scenario_processor: ScenarioProcessor = None, embedding_store: ScenarioEmbeddingStore = None):
+        # only needed when the scenario embeddings are not cached yet, so it's resolved lazily
+        self._scenario_processor = scenario_processor
+        self.embedding_store = embedding_store if embedding_store is not None else ScenarioEmbeddingStore()
         self.feature_mappings()
+        from sklearn.preprocessing import MinMaxScaler # deferred, sklearn is slow to import
         self.feature_scaler = MinMaxScaler
         self.feature_names = ['danceability', 'energy', 'loudness', 'speechiness',
             'acousticness', 'instrumentalness', 'valence', 'tempo']
         self.init_scenario_mappings()
+        # optional learned shortcut for the similarity blending, see use_range_regressor
+        self.range_regressor = None
+
+    def use_range_regressor(self, regressor):
+        """
+        Resolve ranges with a trained RangeRegressor instead of the similarity
+        search and blending (None goes back to blending).
+        """
+        if regressor is not None:
+            if regressor.feature_names != self.feature_names:
+                raise ValueError("The range regressor was trained for different features")
+            if regressor.categories != self._scenario_categories():
+                raise ValueError("The range regressor was trained for different scenario categories")
+            embedding_name = getattr(self._scenario_processor, 'embedding_name', None)
+            if regressor.use_embedding and embedding_name and regressor.embedding_name != embedding_name:
+                raise ValueError(f"The range regressor was trained on {regressor.embedding_name} embeddings, "
+                                 f"not {embedding_name}")
+        self.range_regressor = regressor
 
     def feature_mappings(self):
         self.mood_features = {
@@ -114,40 +154,125 @@ class FeatureMatcher:
     def init_scenario_mappings(self):
 
         self.scenario_mappings = []
-        scenario_processor = ScenarioProcessor()
+        scenarios = []
 
         for mood in self.mood_features.keys():
             for activity in self.activity_features.keys():
                 for time in self.time_features.keys():
                     for social in self.social_features.keys():
                         # Create scenario description
-                        scenario_text = f"{activity} in the {time}, feeling {mood}"
-                        if social != "unspecified":
-                            scenario_text += f", {social}"
-                        
-                        # Process scenario to get embedding
-                        features = scenario_processor.process_user_input(scenario_text)
-                        
-                        # Combine feature ranges
-                        combined_features = {}
-                        if mood in self.mood_features:
-                            combined_features.update(self.mood_features[mood])
-                        if activity in self.activity_features:
-                            self._merge_ranges(combined_features, self.activity_features[activity])
-                        if time in self.time_features:
-                            self._merge_ranges(combined_features, self.time_features[time])
-                        if social in self.social_features:
-                            self._merge_ranges(combined_features, self.social_features[social])
-
-                        self.scenario_mappings.append({
-                            'mood': mood,
-                            'activity': activity,
-                            'time': time, 
-                            'social': social,
-                            'features': combined_features,
-                            'embedding': features['embedding'],
-                            'text': scenario_text
-                        })
+                        scenario_text = self.SCENARIO_TEMPLATE.format(
+                            activity=activity, time=time, mood=mood, social=social)
+                        scenarios.append((mood, activity, time, social, scenario_text))
+
+        # Embeddings come from the on-disk store unless the model or scenarios changed
+        embeddings = self._load_scenario_embeddings([s[-1] for s in scenarios])
+        # normalized once here, so lookups don't rebuild the embedding matrix per request
+        self.scenario_index = ScenarioIndex(embeddings)
+
+        for (mood, activity, time, social, scenario_text), embedding in zip(scenarios, embeddings):
+            # Combine feature ranges
+            combined_features = {}
+            if mood in self.mood_features:
+                combined_features.update(self.mood_features[mood])
+            if activity in self.activity_features:
+                self._merge_ranges(combined_features, self.activity_features[activity])
+            if time in self.time_features:
+                self._merge_ranges(combined_features, self.time_features[time])
+            if social in self.social_features:
+                self._merge_ranges(combined_features, self.social_features[social])
+
+            self.scenario_mappings.append({
+                'mood': mood,
+                'activity': activity,
+                'time': time, 
+                'social': social,
+                'features': combined_features,
+                'embedding': embedding,
+                'text': scenario_text
+            })
+
+        self._build_range_tables()
+
+    def _build_range_tables(self):
+        """
+        Dense [n, n_features, 2] (min, max) tables, NaN where a feature has no range:
+        - base_range_table: the base ranges of every (mood, activity, time, social)
+          tuple, 'unspecified' included (6 * 6 * 5 * 4 = 720 rows)
+        - scenario_range_table: the combined ranges of every mapped scenario
+        Feature columns follow self.feature_names.
+        """
+        self._feature_column = {feature: j for j, feature in enumerate(self.feature_names)}
+        # category -> position per dimension, 'unspecified' (and unknown categories) last
+        self._category_index = {
+            dimension: {category: i for i, category in enumerate(categories)}
+            for dimension, categories in self._scenario_categories().items()
+        }
+
+        dimensions = list(self._category_index.keys())
+        choices = [list(self._category_index[d].keys()) + ['unspecified'] for d in dimensions]
+        self.base_range_table = np.stack([
+            self.ranges_to_array(self._get_base_ranges(dict(zip(dimensions, combo))))
+            for combo in itertools.product(*choices)
+        ])
+        self.scenario_range_table = np.stack([
+            self.ranges_to_array(mapping['features']) for mapping in self.scenario_mappings
+        ])
+
+    def ranges_to_array(self, feature_ranges: Dict[str, Tuple[float, float]]) -> np.ndarray:
+        """The [n_features, 2] array for a feature_ranges dict, NaN where there's no range"""
+        ranges = np.full((len(self.feature_names), 2), np.nan)
+        for feature, bounds in feature_ranges.items():
+            if feature in self._feature_column:
+                ranges[self._feature_column[feature]] = bounds
+        return ranges
+
+    def range_array_to_dict(self, ranges: np.ndarray, weights: np.ndarray = None) -> 'FeatureRanges':
+        """The feature_ranges dict for one row of a range array, with the row's weights if given"""
+        feature_ranges = FeatureRanges(
+            (feature, (float(ranges[j, 0]), float(ranges[j, 1])))
+            for j, feature in enumerate(self.feature_names) if not np.isnan(ranges[j, 0])
+        )
+        if weights is not None:
+            feature_ranges.weights = {feature: float(weights[self._feature_column[feature]])
+                                      for feature in feature_ranges}
+        return feature_ranges
+
+    def _combo_index(self, scenario_features: Dict) -> int:
+        """Row of base_range_table for the scenario's categories"""
+        index = 0
+        for dimension, categories in self._category_index.items():
+            unspecified = len(categories)
+            index = index * (unspecified + 1) + categories.get(scenario_features[dimension], unspecified)
+        return index
+
+    def _scenario_categories(self) -> Dict[str, List[str]]:
+        return {
+            'mood': list(self.mood_features.keys()),
+            'activity': list(self.activity_features.keys()),
+            'time': list(self.time_features.keys()),
+            'social': list(self.social_features.keys())
+        }
+
+    def _load_scenario_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Load the scenario embeddings from the store, computing and saving them on a miss"""
+        if self._scenario_processor is not None:
+            model_name = self._scenario_processor.model_name
+            backend = self._scenario_processor.backend_name
+            embedding_name = self._scenario_processor.embedding_name
+        else:
+            model_name, backend = ScenarioProcessor.MODEL_NAME, ScenarioProcessor.BACKEND
+            embedding_name = ScenarioProcessor.embedding_id(model_name, backend)
+        # quantized/onnx embeddings differ slightly from the torch ones, so each backend gets its own cache
+        key = self.embedding_store.make_key(embedding_name, self._scenario_categories(), self.SCENARIO_TEMPLATE)
+
+        embeddings = self.embedding_store.load(key, texts)
+        if embeddings is None:
+            if self._scenario_processor is None:
+                self._scenario_processor = get_scenario_processor(model_name, backend)
+            embeddings = self._scenario_processor.generate_embeddings([text.lower() for text in texts])
+            self.embedding_store.save(key, embeddings, texts, embedding_name)
+        return embeddings
 
     def _merge_ranges(self, ranges:Dict, new_ranges: Dict):
         for feature, (min_val, max_val) in new_ranges.items():
@@ -158,59 +283,75 @@ class FeatureMatcher:
                 ranges[feature] = (min_val, max_val)
 
 
-    def get_feature_ranges(self, scenario_features: Dict) -> Dict[str, Tuple[float, float]]:
-        feature_ranges = self._get_base_ranges(scenario_features)
-        similar_scenarios = self._similar_scenarios(scenario_features)
-
-        if not similar_scenarios:
-            similar_scenarios = [{'scenario': self.default_scenario, 'similarity': 1.0}]
-
-        if similar_scenarios: 
-            for feature in self.feature_names: 
-                similar_mins = []
-                similar_maxs = []
-
-                for similar in similar_scenarios: 
-                    if feature in similar['scenario']['features']:
-                        min_val, max_val = similar['scenario']['features'][feature]
-                        similar_mins.append(min_val)
-                        similar_maxs.append(max_val)
-
-                    if similar_mins and similar_maxs:
-                        if feature in feature_ranges:
-                            current_min, current_max = feature_ranges[feature]
-                            feature_ranges[feature] = (
-                                (current_min + np.mean(similar_mins)) / 2,
-                                (current_max + np.mean(similar_maxs)) / 2
-                            )
-                        else: 
-                            feature_ranges[feature] = (np.mean(similar_mins), np.mean(similar_maxs))
-                    
-        return feature_ranges
+    def get_feature_ranges(self, scenario_features: Dict) -> 'FeatureRanges':
+        """Feature ranges of the scenario, with their weights for graded scoring"""
+        ranges, weights = self.get_weighted_range_arrays([scenario_features])
+        return self.range_array_to_dict(ranges[0], weights[0])
+
+    def get_feature_range_array(self, scenario_features: Dict) -> np.ndarray:
+        """Feature ranges as an [n_features, 2] array over self.feature_names, NaN for no range"""
+        return self.get_feature_range_arrays([scenario_features])[0]
+
+    def get_feature_range_arrays(self, scenario_features_list: List[Dict], k: int = 3) -> np.ndarray:
+        """Feature ranges of many scenarios as an [n, n_features, 2] array"""
+        return self.get_weighted_range_arrays(scenario_features_list, k)[0]
+
+    def get_weighted_range_arrays(self, scenario_features_list: List[Dict], k: int = 3) -> Tuple[np.ndarray, np.ndarray]:
+        """Feature ranges [n, n_features, 2] and feature weights [n, n_features] of many scenarios"""
+        if self.range_regressor is not None:
+            return self.range_regressor.predict(scenario_features_list)
+        return self.blend_range_arrays(scenario_features_list, k)
+
+    def blend_range_arrays(self, scenario_features_list: List[Dict], k: int = 3) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Feature ranges and weights of many scenarios from their categories and similar scenarios.
+
+        Starts from the precomputed base ranges of each scenario's categories
+        and blends in the k most similar mapped scenarios one after another:
+        after the j-th similar scenario a feature becomes the average of its
+        current range and the mean range of the similar scenarios so far that
+        have it (or just that mean if it had no range yet).
+
+        A feature's weight is half for being in the base ranges and half the
+        similarity weighted share of the similar scenarios that have it, so
+        features everything agrees on count the most in graded scoring.
+        """
+        n = len(scenario_features_list)
+        ranges = self.base_range_table[[self._combo_index(f) for f in scenario_features_list]]
+        base_present = ~np.isnan(ranges[..., 0])
+        if n == 0 or len(self.scenario_mappings) == 0:
+            return ranges, base_present.astype(np.float32)
 
+        embeddings = np.stack([np.asarray(f['embedding'], dtype=np.float32).ravel() for f in scenario_features_list])
+        indices, similarities = self.scenario_index.search(embeddings, k)
+        similar = self.scenario_range_table[indices.reshape(n, -1)]  # [n, k, n_features, 2]
 
-    def _similar_scenarios(self, scenario_features: Dict) -> List[Dict]:
+        present = ~np.isnan(similar[..., 0])
+        counts = np.cumsum(present, axis=1)[..., None]
+        sums = np.cumsum(np.nan_to_num(similar, nan=0.0), axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts  # running mean over the similar scenarios that have the feature
+
+        for j in range(similar.shape[1]):
+            blended = np.where(np.isnan(ranges), means[:, j], (ranges + means[:, j]) / 2)
+            ranges = np.where(counts[:, j] > 0, blended, ranges)
+
+        # negative similarities don't vote, all zero falls back to a plain share
+        sims = np.clip(similarities.reshape(n, -1), 0, None).astype(np.float32)
+        sims[sims.sum(axis=1) == 0] = 1
+        agreement = np.einsum('nk,nkf->nf', sims, present.astype(np.float32)) / sims.sum(axis=1, keepdims=True)
+        weights = 0.5 * base_present + 0.5 * agreement
+        weights[np.isnan(ranges[..., 0])] = 0
+        return ranges, weights.astype(np.float32)
+
+    def _similar_scenarios(self, scenario_features: Dict, k: int = 3) -> List[Dict]:
         """Find similar scenarios using cosine similarity"""
-        # Reshape current embedding to 2D array (1, n_features)
-        current_embedding = scenario_features['embedding'].reshape(1, -1)
-        
-        # Create 2D array of scenario embeddings (n_scenarios, n_features)
-        scenario_embeddings = np.array([s['embedding'] for s in self.scenario_mappings])
-        
-        # Calculate similarities
-        similarities = cosine_similarity(current_embedding, scenario_embeddings).flatten()
-        
-        # Create list of scenarios with their similarity scores
-        similar_scenarios = []
-        for i, similarity in enumerate(similarities):
-            similar_scenarios.append({
-                'scenario': self.scenario_mappings[i],
-                'similarity': similarity
-            })
-        
-        # Sort by similarity and return top 3
-        similar_scenarios.sort(key=lambda x: x['similarity'], reverse=True)
-        return similar_scenarios[:3]
+        indices, similarities = self.scenario_index.search(scenario_features['embedding'], k)
+
+        return [{
+            'scenario': self.scenario_mappings[i],
+            'similarity': similarity
+        } for i, similarity in zip(indices, similarities)]
 
     def _get_base_ranges(self, scenario_features: Dict) -> Dict[str, Tuple[float, float]]:
         feature_ranges = {}
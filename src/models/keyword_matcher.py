@@ -0,0 +1,70 @@
+import re
+from typing import Dict, List, NamedTuple
+
+class KeywordMatch(NamedTuple):
+    dimension: str
+    category: str
+    keyword: str
+    start: int
+    end: int
+
+
+class KeywordMatcher:
+    """
+    Finds the category keywords of several dimensions (time, mood, ...) in one
+    pass with a single compiled regex.
+
+    Keywords only match whole words, so "late" no longer matches inside
+    "chocolate", but with their inflections: plurals and -ed/-ing forms,
+    dropping a final e or turning a final y into i where English does
+    ("exercising", "parties"). When a dimension has several
+    matching categories the one listed first wins, as with the old per
+    category scans, whatever their position in the text.
+    """
+    UNSPECIFIED = 'unspecified'
+
+    def __init__(self, dimensions: Dict[str, Dict[str, List[str]]]):
+        self.dimensions = list(dimensions.keys())
+        # keyword -> [(dimension, category, priority)], a keyword can belong to several dimensions
+        self.keywords = {}
+        for dimension, categories in dimensions.items():
+            for priority, (category, keywords) in enumerate(categories.items()):
+                for keyword in keywords:
+                    self.keywords.setdefault(keyword.lower(), []).append((dimension, category, priority))
+
+        # longest first so "by myself" wins over a shorter keyword at the same position,
+        # one group per keyword, so the group that matched names the keyword
+        self._group_keywords = sorted(self.keywords, key=len, reverse=True)
+        pattern = '|'.join(f"({self._inflected(keyword)})" for keyword in self._group_keywords)
+        self.pattern = re.compile(rf"\b(?:{pattern})\b", re.IGNORECASE)
+
+    @staticmethod
+    def _inflected(keyword: str) -> str:
+        """Regex for the keyword and the inflections of its last word, any whitespace inside phrases"""
+        *words, last = keyword.split()
+        if re.search(r'[^aeiou]y$', last):
+            last = re.escape(last[:-1]) + '(?:y|ies|ied|ying)'
+        elif last.endswith('e'):
+            last = re.escape(last[:-1]) + '(?:e|es|ed|ing)'
+        else:
+            last = re.escape(last) + '(?:s|es|ed|ing)?'
+        return r'\s+'.join([re.escape(word) for word in words] + [last])
+
+    def matches(self, text: str) -> List[KeywordMatch]:
+        """Every keyword found in text with its dimension, category and position"""
+        found = []
+        for m in self.pattern.finditer(text):
+            keyword = self._group_keywords[m.lastindex - 1]
+            for dimension, category, _ in self.keywords[keyword]:
+                found.append(KeywordMatch(dimension, category, keyword, m.start(), m.end()))
+        return found
+
+    def extract(self, text: str) -> Dict[str, str]:
+        """Category of every dimension, 'unspecified' where no keyword matched"""
+        best = {}
+        for m in self.pattern.finditer(text):
+            for dimension, category, priority in self.keywords[self._group_keywords[m.lastindex - 1]]:
+                if dimension not in best or priority < best[dimension][0]:
+                    best[dimension] = (priority, category)
+        return {dimension: best[dimension][1] if dimension in best else self.UNSPECIFIED
+                for dimension in self.dimensions}
@@ -0,0 +1,124 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Sequence
+
+class MicroBatcher:
+    """
+    Collects items submitted from many threads into small batches for one call.
+
+    A background thread takes the first waiting item, then keeps collecting
+    for at most max_wait_ms or until max_batch_size items are in hand, calls
+    batch_fn once with the whole list and hands result i back to the future
+    of item i. Under light load a request waits at most max_wait_ms, under
+    heavy load batches fill up and the wait is shorter.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], Sequence[Any]], max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0, name: str = "micro-batcher"):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.max_seen_batch = 0
+        self.total_queue_delay = 0.0
+        self.max_queue_delay = 0.0
+
+        self._closed = False
+        # makes the closed check and the put one step, so no item lands behind the stop sentinel
+        self._submit_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        """Queue one item, the future resolves to its slot of the batch result"""
+        future = Future()
+        with self._submit_lock:
+            if self._closed:
+                raise RuntimeError("MicroBatcher is closed")
+            self._queue.put((item, future, time.monotonic()))
+        return future
+
+    def __call__(self, item: Any, timeout: float = None) -> Any:
+        return self.submit(item).result(timeout)
+
+    def _collect(self) -> List:
+        batch = []
+        deadline = None
+        while len(batch) < self.max_batch_size:
+            if not batch:
+                entry = self._queue.get()
+            else:
+                remaining = deadline - time.monotonic()
+                try:
+                    # whatever is already queued is taken without waiting
+                    entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if entry is None:
+                if batch:
+                    self._queue.put(None)
+                break
+            # futures cancelled while queued (a caller gave up) are dropped, the rest can't be cancelled anymore
+            if not entry[1].set_running_or_notify_cancel():
+                continue
+            if not batch:
+                deadline = time.monotonic() + self.max_wait
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if not batch:
+                return
+
+            started = time.monotonic()
+            items = [item for item, _, _ in batch]
+            try:
+                results = self.batch_fn(items)
+                if len(results) != len(items):
+                    raise ValueError(f"batch_fn returned {len(results)} results for {len(items)} items")
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+
+            delays = [started - queued_at for _, _, queued_at in batch]
+            with self._lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.max_seen_batch = max(self.max_seen_batch, len(batch))
+                self.total_queue_delay += sum(delays)
+                self.max_queue_delay = max(self.max_queue_delay, max(delays))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'batches': self.batches,
+                'items': self.items,
+                'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+                'max_seen_batch_size': self.max_seen_batch,
+                'mean_queue_delay_ms': 1000.0 * self.total_queue_delay / self.items if self.items else 0.0,
+                'max_queue_delay_ms': 1000.0 * self.max_queue_delay
+            }
+
+    def close(self):
+        """Stop the worker once the items already queued are done"""
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
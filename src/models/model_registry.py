@@ -0,0 +1,28 @@
+import threading
+from src.models.scenario_processor import ScenarioProcessor
+
+# one ScenarioProcessor (tokenizer + model) per model name and backend for the whole process
+_processors = {}
+_lock = threading.Lock()
+
+def get_scenario_processor(model_name: str = None, backend: str = None) -> ScenarioProcessor:
+    """Return the shared ScenarioProcessor, loading the model on first use"""
+    if model_name is None:
+        model_name = ScenarioProcessor.MODEL_NAME
+    if backend is None:
+        backend = ScenarioProcessor.BACKEND
+
+    key = (model_name, backend)
+    processor = _processors.get(key)
+    if processor is None:
+        with _lock:
+            processor = _processors.get(key)
+            if processor is None:
+                processor = ScenarioProcessor(model_name, backend)
+                _processors[key] = processor
+    return processor
+
+def clear_scenario_processors():
+    """Drop the shared processors so the next call reloads the model"""
+    with _lock:
+        _processors.clear()
@@ -0,0 +1,443 @@
+import numpy as np
+from typing import Dict, List, Tuple
+
+def empty_bitset(n_rows: int) -> np.ndarray:
+    return np.zeros((n_rows + 63) // 64, dtype=np.uint64)
+
+def bitset_from_rows(rows: np.ndarray, n_rows: int) -> np.ndarray:
+    """Bitset with the bits of the given row ids set"""
+    bitset = empty_bitset(n_rows)
+    _set_rows(bitset, rows)
+    return bitset
+
+def bitset_to_rows(bitset: np.ndarray, limit: int = None) -> np.ndarray:
+    """Ascending row ids of the set bits, at most limit of them"""
+    words = np.flatnonzero(bitset)
+    if limit is not None:
+        # only unpack as many words as needed to reach limit rows
+        counts = np.cumsum(np.bitwise_count(bitset[words]))
+        words = words[:int(np.searchsorted(counts, limit)) + 1]
+    bits = np.unpackbits(bitset[words].view(np.uint8), bitorder='little').reshape(-1, 64)
+    rows = (words[:, None] * 64 + np.arange(64))[bits.astype(bool)]
+    return rows if limit is None else rows[:limit]
+
+def _row_bits(rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Group rows by 64-bit word, returns (word indices, OR-ed bits per word)"""
+    rows = np.sort(rows)
+    words = rows >> 6
+    bits = np.left_shift(np.uint64(1), (rows & 63).astype(np.uint64))
+    starts = np.flatnonzero(np.diff(words, prepend=-1))
+    return words[starts], np.bitwise_or.reduceat(bits, starts)
+
+def _set_rows(bitset: np.ndarray, rows: np.ndarray):
+    if len(rows):
+        words, bits = _row_bits(rows)
+        bitset[words] |= bits
+
+def _clear_rows(bitset: np.ndarray, rows: np.ndarray):
+    if len(rows):
+        words, bits = _row_bits(rows)
+        bitset[words] &= ~bits
+
+def shift_segments(position: np.ndarray) -> List[Tuple[int, int, int]]:
+    """
+    (start, end, delta) for every run of rows [start, end) that moved by the
+    same delta, given the new row of every old row (-1 for removed rows,
+    which are left out)
+    """
+    n = len(position)
+    if n == 0:
+        return []
+    delta = position - np.arange(n)
+    valid = position >= 0
+    breaks = np.flatnonzero((np.diff(delta) != 0) | (valid[1:] != valid[:-1])) + 1
+    starts = np.concatenate([[0], breaks])
+    ends = np.concatenate([breaks, [n]])
+    kept = valid[starts]
+    return list(zip(starts[kept].tolist(), ends[kept].tolist(), delta[starts[kept]].tolist()))
+
+def move_bits(dst: np.ndarray, src: np.ndarray, segments: List[Tuple[int, int, int]]):
+    """
+    OR the bits of src into dst, every segment's rows moved by its delta.
+    Works on whole stacks of bitsets (words along the last axis) at once and
+    costs one shifted copy of the words per segment, so a few removed or
+    inserted rows don't mean unpacking every bit.
+    """
+    for start, end, delta in segments:
+        w0, w1 = start >> 6, (end - 1) >> 6
+        block = src[..., w0:w1 + 1].copy()
+        # only the bits of [start, end) in the first and last word
+        block[..., 0] &= ~np.uint64((1 << (start & 63)) - 1)
+        block[..., -1] &= np.uint64((1 << (((end - 1) & 63) + 1)) - 1)
+
+        words, shift = divmod(delta, 64)
+        if shift:
+            shifted = np.zeros(block.shape[:-1] + (block.shape[-1] + 1,), dtype=np.uint64)
+            shifted[..., :-1] = block << np.uint64(shift)
+            shifted[..., 1:] |= block >> np.uint64(64 - shift)
+        else:
+            shifted = block
+        first = w0 + words
+        # words that would land before the first or after the last hold no bits of the segment
+        lo, hi = max(0, -first), min(shifted.shape[-1], dst.shape[-1] - first)
+        dst[..., first + lo:first + hi] |= shifted[..., lo:hi]
+
+
+class RangeIndex:
+    """
+    Bucketed bitmap index over the audio feature columns of a SongStore.
+
+    Every feature is sorted once and split into equal-count buckets, and for
+    each bucket boundary we keep a prefix bitset of the rows below it. A range
+    predicate becomes two binary searches into the sorted values plus one
+    AND-NOT of two prefix bitsets, only the (at most two) buckets the range
+    cuts through are patched row by row. Match counts are accumulated as
+    bit-sliced counters, so scoring is a handful of word-wide bit operations
+    per feature and top-k reads the best rows straight out of the bitsets.
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray], n_buckets: int = 64):
+        row_dtype = self._init_rows(len(next(iter(columns.values()))) if columns else 0, list(columns.keys()))
+        self.n_buckets = n_buckets
+        self.buckets = {}
+        for name, column in columns.items():
+            self.buckets[name] = self._build_buckets(column, n_buckets, row_dtype)
+
+    def _init_rows(self, n_rows: int, features: List[str]):
+        """Set up everything that only depends on the number of rows, returns the row id dtype"""
+        self.n_rows = n_rows
+        self.n_words = (n_rows + 63) // 64
+        self.features = features
+        # enough bit planes to count up to one match per feature
+        self.n_planes = max(1, len(features).bit_length())
+
+        self.all_rows = empty_bitset(n_rows)
+        self.all_rows[:] = np.uint64(0xFFFFFFFFFFFFFFFF)
+        if n_rows % 64:
+            self.all_rows[-1] = np.uint64((1 << (n_rows % 64)) - 1)
+        return np.int32 if n_rows < np.iinfo(np.int32).max else np.int64
+
+    def _build_buckets(self, column: np.ndarray, n_buckets: int, row_dtype) -> Dict:
+        # NaNs sort to the end and are left out of every bucket
+        n_valid = self.n_rows - int(np.count_nonzero(np.isnan(column)))
+        order = np.argsort(column, kind='stable')[:n_valid].astype(row_dtype)
+
+        n_buckets = max(1, min(n_buckets, n_valid))
+        starts = np.linspace(0, n_valid, n_buckets + 1).astype(np.int64)
+        prefix = np.zeros((n_buckets + 1, self.n_words), dtype=np.uint64)
+        for b in range(n_buckets):
+            prefix[b + 1] = prefix[b]
+            _set_rows(prefix[b + 1], order[starts[b]:starts[b + 1]])
+
+        return {
+            'order': order,
+            'sorted_values': column[order],
+            'starts': starts,
+            'prefix': prefix
+        }
+
+    def __contains__(self, feature: str) -> bool:
+        return feature in self.buckets
+
+    def extend(self, columns: Dict[str, np.ndarray]) -> 'RangeIndex':
+        """
+        New index over columns, which must be this index's columns with rows
+        appended. Only the new rows are merged into the sorted orders and prefix
+        bitsets; a feature whose buckets got too uneven is rebuilt instead.
+        This index is left untouched.
+        """
+        index = object.__new__(RangeIndex)
+        row_dtype = index._init_rows(len(next(iter(columns.values()))) if columns else 0, list(columns.keys()))
+        index.n_buckets = self.n_buckets
+        index.buckets = {}
+        for name, column in columns.items():
+            buckets = self._extend_buckets(self.buckets[name], column, index.n_words, row_dtype)
+            if buckets is None:
+                buckets = index._build_buckets(column, self.n_buckets, row_dtype)
+            index.buckets[name] = buckets
+        return index
+
+    def _extend_buckets(self, buckets: Dict, column: np.ndarray, n_words: int, row_dtype) -> Dict:
+        new_values = column[self.n_rows:]
+        valid = np.flatnonzero(~np.isnan(new_values))
+        new_rows = (valid + self.n_rows).astype(row_dtype)
+        new_values = new_values[valid]
+        by_value = np.argsort(new_values, kind='stable')
+        new_rows, new_values = new_rows[by_value], new_values[by_value]
+
+        # new rows have the highest row ids, so they go after existing equal values
+        positions = np.searchsorted(buckets['sorted_values'], new_values, side='right')
+        starts = buckets['starts']
+        n_buckets = len(starts) - 1
+        bucket_of = np.clip(np.searchsorted(starts, positions, side='right') - 1, 0, n_buckets - 1)
+
+        added_per_bucket = np.bincount(bucket_of, minlength=n_buckets)
+        new_starts = starts.copy()
+        new_starts[1:] += np.cumsum(added_per_bucket)
+        sizes = np.diff(new_starts)
+        if sizes.max() > 2 * max(1, new_starts[-1] // n_buckets):
+            return None
+
+        prefix = np.zeros((n_buckets + 1, n_words), dtype=np.uint64)
+        prefix[:, :buckets['prefix'].shape[1]] = buckets['prefix']
+        by_bucket = np.argsort(bucket_of, kind='stable')
+        counts = np.cumsum(added_per_bucket)
+        for b in range(n_buckets):
+            # prefix[b + 1] holds every row of buckets 0..b
+            _set_rows(prefix[b + 1], new_rows[by_bucket[:counts[b]]])
+
+        return {
+            'order': np.insert(buckets['order'], positions, new_rows),
+            'sorted_values': np.insert(buckets['sorted_values'], positions, new_values),
+            'starts': new_starts,
+            'prefix': prefix
+        }
+
+    def update(self, previous_columns: Dict[str, np.ndarray], columns: Dict[str, np.ndarray],
+               position: np.ndarray, stale: np.ndarray, changed: np.ndarray,
+               segments: List[Tuple[int, int, int]] = None) -> 'RangeIndex':
+        """
+        New index over columns after rows of previous_columns (the columns
+        this index was built over) were removed, patched or inserted. position
+        maps every old row to its row in columns (-1 when removed), stale holds
+        the old rows that were removed or patched and changed the new rows
+        with new values (patched or inserted), both ascending. Stale rows are
+        found in the sorted orders by their old values, the other rows keep
+        their place and their bits are moved over, and only the changed rows
+        are sorted in; a feature whose buckets got too uneven is rebuilt
+        instead. This index is left untouched.
+        """
+        index = object.__new__(RangeIndex)
+        row_dtype = index._init_rows(len(next(iter(columns.values()))) if columns else 0, list(columns.keys()))
+        index.n_buckets = self.n_buckets
+        index.buckets = {}
+        if segments is None:
+            segments = shift_segments(position)
+        for name, column in columns.items():
+            buckets = self._update_buckets(self.buckets[name], previous_columns[name][stale], stale, column,
+                                           position, changed, segments, index.n_words, row_dtype)
+            if buckets is None:
+                buckets = index._build_buckets(column, self.n_buckets, row_dtype)
+            index.buckets[name] = buckets
+        return index
+
+    @staticmethod
+    def _positions_of(order: np.ndarray, values: np.ndarray, rows: np.ndarray, row_values: np.ndarray) -> np.ndarray:
+        """Where rows with row_values (none NaN) sit or go in a sorted order, equal values are in row order"""
+        positions = np.searchsorted(values, row_values, side='left')
+        tie_ends = np.searchsorted(values, row_values, side='right')
+        for i in np.flatnonzero(tie_ends > positions):
+            positions[i] += np.searchsorted(order[positions[i]:tie_ends[i]], rows[i])
+        return positions
+
+    def _update_buckets(self, buckets: Dict, stale_values: np.ndarray, stale: np.ndarray, column: np.ndarray,
+                        position: np.ndarray, changed: np.ndarray, segments: List[Tuple[int, int, int]],
+                        n_words: int, row_dtype) -> Dict:
+        order, values, starts = buckets['order'], buckets['sorted_values'], buckets['starts']
+        n_buckets = len(starts) - 1
+        # stale rows leave the sorted order, NaNs were never in it
+        indexed = ~np.isnan(stale_values)
+        dropped = np.sort(self._positions_of(order, values, stale[indexed], stale_values[indexed]))
+        kept_order = np.delete(order, dropped)
+        if segments != [(0, self.n_rows, 0)]:
+            # removed or inserted rows shift the ones after them
+            kept_order = position[kept_order]
+        kept_order = kept_order.astype(row_dtype, copy=False)
+        kept_values = np.delete(values, dropped)
+        kept_starts = starts - np.searchsorted(dropped, starts)
+
+        new_values = column[changed]
+        valid = ~np.isnan(new_values)
+        new_rows = changed[valid].astype(row_dtype)
+        new_values = new_values[valid]
+        by_value = np.lexsort((new_rows, new_values))
+        new_rows, new_values = new_rows[by_value], new_values[by_value]
+        positions = self._positions_of(kept_order, kept_values, new_rows, new_values)
+
+        bucket_of = np.clip(np.searchsorted(kept_starts, positions, side='right') - 1, 0, n_buckets - 1)
+        added_per_bucket = np.bincount(bucket_of, minlength=n_buckets)
+        new_starts = kept_starts.copy()
+        new_starts[1:] += np.cumsum(added_per_bucket)
+        sizes = np.diff(new_starts)
+        if sizes.min() == 0 or sizes.max() > 2 * max(1, new_starts[-1] // n_buckets):
+            return None
+
+        prefix = np.zeros((n_buckets + 1, n_words), dtype=np.uint64)
+        move_bits(prefix, buckets['prefix'], segments)
+        # changed rows were moved with their old buckets' bits, clear them and set their new ones
+        if len(changed):
+            words, bits = _row_bits(changed)
+            prefix[:, words] &= ~bits
+        by_bucket = np.argsort(bucket_of, kind='stable')
+        counts = np.cumsum(added_per_bucket)
+        for b in range(n_buckets):
+            _set_rows(prefix[b + 1], new_rows[by_bucket[:counts[b]]])
+
+        return {
+            'order': np.insert(kept_order, positions, new_rows),
+            'sorted_values': np.insert(kept_values, positions, new_values),
+            'starts': new_starts,
+            'prefix': prefix
+        }
+
+    # the arrays kept per feature
+    BUCKET_ARRAYS = ('order', 'sorted_values', 'starts', 'prefix')
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """Every array of the index as '<feature>.<array>' -> array, from_arrays() rebuilds it from them"""
+        return {f"{feature}.{name}": self.buckets[feature][name]
+                for feature in self.features for name in self.BUCKET_ARRAYS}
+
+    @classmethod
+    def from_arrays(cls, n_rows: int, features: List[str], n_buckets: int,
+                    arrays: Dict[str, np.ndarray]) -> 'RangeIndex':
+        """Index over n_rows rows from the arrays of arrays(), e.g. memory-mapped from a snapshot"""
+        index = object.__new__(cls)
+        index._init_rows(n_rows, list(features))
+        index.n_buckets = n_buckets
+        index.buckets = {feature: {name: arrays[f"{feature}.{name}"] for name in cls.BUCKET_ARRAYS}
+                         for feature in index.features}
+        return index
+
+    def match(self, feature: str, min_val: float, max_val: float) -> np.ndarray:
+        """Bitset of the rows with min_val <= value <= max_val"""
+        buckets = self.buckets[feature]
+
+        # positions [lo, hi) of the matching rows in sorted order
+        values = buckets['sorted_values']
+        lo = int(np.searchsorted(values, np.float32(min_val), side='left'))
+        hi = int(np.searchsorted(values, np.float32(max_val), side='right'))
+        return self._match_positions(buckets, lo, hi)
+
+    def _match_positions(self, buckets: Dict, lo: int, hi: int) -> np.ndarray:
+        """Bitset of the rows at positions [lo, hi) of a feature's sorted order"""
+        order, starts, prefix = buckets['order'], buckets['starts'], buckets['prefix']
+        result = empty_bitset(self.n_rows)
+        if hi <= lo:
+            return result
+
+        first = int(np.searchsorted(starts, lo, side='right')) - 1
+        last = int(np.searchsorted(starts, hi - 1, side='right')) - 1
+        # buckets strictly between the two boundary buckets match entirely
+        if first + 1 < last:
+            np.bitwise_and(prefix[last], ~prefix[first + 1], out=result)
+
+        for b in sorted({first, last}):
+            start, end = starts[b], starts[b + 1]
+            inside_lo, inside_hi = max(lo, start), min(hi, end)
+            if inside_hi - inside_lo <= (end - start) // 2:
+                _set_rows(result, order[inside_lo:inside_hi])
+            else:
+                # most of the bucket matches: take all of it and clear the rest
+                result |= prefix[b + 1] & ~prefix[b]
+                _clear_rows(result, order[start:inside_lo])
+                _clear_rows(result, order[inside_hi:end])
+        return result
+
+    def count_planes(self, feature_ranges: Dict[str, Tuple[float, float]]) -> List[np.ndarray]:
+        """Per-row match counts as bit planes, plane i holds bit i of each count"""
+        planes = [empty_bitset(self.n_rows) for _ in range(self.n_planes)]
+        tmp = empty_bitset(self.n_rows)
+        for feature, (min_val, max_val) in feature_ranges.items():
+            if feature not in self.buckets:
+                continue
+            carry = self.match(feature, min_val, max_val)
+            # ripple-carry add of a 1-bit number to every counter at once
+            for plane in planes:
+                np.bitwise_and(plane, carry, out=tmp)
+                np.bitwise_xor(plane, carry, out=plane)
+                carry, tmp = tmp, carry
+        return planes
+
+    def score(self, feature_ranges: Dict[str, Tuple[float, float]], out: np.ndarray) -> np.ndarray:
+        """Write the number of ranges each row falls into to out"""
+        out.fill(0)
+        for i, plane in enumerate(self.count_planes(feature_ranges)):
+            bits = np.unpackbits(plane.view(np.uint8), bitorder='little', count=self.n_rows)
+            out += bits * (1 << i)
+        return out
+
+    def top_k(self, feature_ranges: Dict[str, Tuple[float, float]], k: int,
+              rows: np.ndarray = None) -> np.ndarray:
+        """
+        Row ids of the k rows matching the most ranges, best first and ties in
+        row order. rows is an optional bitset restricting the candidates.
+        """
+        planes = self.count_planes(feature_ranges)
+        candidates = self.all_rows if rows is None else rows & self.all_rows
+        return self._top_k_planes(np.stack(planes)[:, None], k, candidates)[0]
+
+    def _top_k_planes(self, planes: np.ndarray, k: int, candidates: np.ndarray) -> List[np.ndarray]:
+        """
+        Best k rows per query from [n_planes, n_queries, n_words] count planes,
+        reading the rows out of the bitsets from the highest count down.
+        """
+        n_queries = planes.shape[1]
+        top = [[] for _ in range(n_queries)]
+        need = np.full(n_queries, k)
+        level = np.empty(planes.shape[1:], dtype=np.uint64)
+        for count in range((1 << self.n_planes) - 1, -1, -1):
+            if not need.any():
+                break
+            # rows whose counter equals count exactly
+            level[:] = candidates
+            for i, plane in enumerate(planes):
+                if count >> i & 1:
+                    level &= plane
+                else:
+                    level &= ~plane
+            for q in np.flatnonzero((need > 0) & level.any(axis=1)):
+                found = bitset_to_rows(level[q], need[q])
+                top[q].append(found)
+                need[q] -= len(found)
+
+        return [np.concatenate(rows).astype(np.intp, copy=False) if rows else np.empty(0, dtype=np.intp)
+                for rows in top]
+
+    def top_k_batch(self, lower: np.ndarray, upper: np.ndarray, k: int, rows: np.ndarray = None,
+                    max_block: int = 1 << 15) -> np.ndarray:
+        """
+        top_k for many queries at once, given as [n_queries, len(features)]
+        lower and upper bounds (lower > upper where a feature has no range).
+        Range positions are looked up for all queries with one binary search
+        per feature and each distinct range is matched once, then the count
+        planes of a block of queries (max_block words per plane, small enough
+        to stay in cache) are added up as 2-D bitsets, so the per-query work
+        is only reading out the winners. Needs k rows to exist.
+        """
+        n_queries = len(lower)
+        candidates = self.all_rows if rows is None else rows & self.all_rows
+        # per feature: the distinct match bitsets and which one each query uses (-1 for none)
+        matches = []
+        for j, feature in enumerate(self.features):
+            buckets = self.buckets[feature]
+            values = buckets['sorted_values']
+            lo = np.searchsorted(values, lower[:, j].astype(np.float32), side='left')
+            hi = np.searchsorted(values, upper[:, j].astype(np.float32), side='right')
+            has_range = hi > lo
+            which = np.full(n_queries, -1)
+            if has_range.any():
+                keys, which[has_range] = np.unique(np.stack([lo[has_range], hi[has_range]], axis=1),
+                                                   axis=0, return_inverse=True)
+                matches.append((which, np.stack([self._match_positions(buckets, int(l), int(h))
+                                                 for l, h in keys])))
+
+        top = np.empty((n_queries, k), dtype=np.intp)
+        block = max(1, max_block // max(1, self.n_words))
+        for start in range(0, n_queries, block):
+            end = min(start + block, n_queries)
+            planes = np.zeros((self.n_planes, end - start, self.n_words), dtype=np.uint64)
+            carry = np.empty(planes.shape[1:], dtype=np.uint64)
+            tmp = np.empty_like(carry)
+            for which, bitsets in matches:
+                which = which[start:end]
+                carry[:] = 0
+                carry[which >= 0] = bitsets[which[which >= 0]]
+                # ripple-carry add of a 1-bit number to every counter of every query at once
+                for plane in planes:
+                    np.bitwise_and(plane, carry, out=tmp)
+                    np.bitwise_xor(plane, carry, out=plane)
+                    carry, tmp = tmp, carry
+            for q, rows_q in enumerate(self._top_k_planes(planes, k, candidates)):
+                top[start + q] = rows_q
+        return top
@@ -0,0 +1,180 @@
+import itertools
+import json
+import numpy as np
+from pathlib import Path
+from typing import Dict, List, Tuple
+from src.models.embedding_store import atomic_write, default_cache_dir
+
+class RangeRegressor:
+    """
+    Linear model from a scenario (one-hot categories plus the input
+    embedding) straight to its feature ranges and weights, trained offline
+    on what FeatureMatcher's similarity blending produces.
+
+    Per feature it predicts whether there is a range, its min and max, and
+    its weight, so at runtime resolving a scenario is one small matmul
+    instead of the similarity search over the mapped scenarios. Ridge
+    regression, one set of outputs per feature: presence and weight are
+    fitted on every sample, min and max only on the samples where the
+    feature has a range.
+    """
+    VERSION = 1
+    # predicted presence above this means the feature gets a range
+    PRESENCE_THRESHOLD = 0.5
+    # per feature outputs, in this order
+    OUTPUTS = ('presence', 'min', 'max', 'weight')
+
+    def __init__(self, coef: np.ndarray, intercept: np.ndarray, feature_names: List[str],
+                 categories: Dict[str, List[str]], use_embedding: bool = True, embedding_name: str = None):
+        # coef is [n_inputs, n_features * len(OUTPUTS)], outputs grouped per feature
+        self.coef = np.asarray(coef, dtype=np.float32)
+        self.intercept = np.asarray(intercept, dtype=np.float32)
+        self.feature_names = list(feature_names)
+        self.categories = {dimension: list(values) for dimension, values in categories.items()}
+        self.use_embedding = use_embedding
+        self.embedding_name = embedding_name
+        # category -> one-hot column per dimension, the last column of each dimension is 'unspecified'
+        self._columns = {}
+        offset = 0
+        for dimension, values in self.categories.items():
+            self._columns[dimension] = ({value: offset + i for i, value in enumerate(values)}, offset + len(values))
+            offset += len(values) + 1
+        self.n_category_columns = offset
+
+    @property
+    def embedding_dim(self) -> int:
+        return self.coef.shape[0] - self.n_category_columns if self.use_embedding else 0
+
+    def encode(self, scenario_features_list: List[Dict]) -> np.ndarray:
+        """[n, n_inputs] model inputs: category one-hots, then the embedding"""
+        n = len(scenario_features_list)
+        categories = np.zeros((n, self.n_category_columns), dtype=np.float32)
+        for i, scenario_features in enumerate(scenario_features_list):
+            for dimension, (columns, unspecified) in self._columns.items():
+                categories[i, columns.get(scenario_features.get(dimension), unspecified)] = 1
+        if not self.use_embedding:
+            return categories
+        embeddings = np.stack([np.asarray(f['embedding'], dtype=np.float32).ravel()
+                               for f in scenario_features_list]) if n else np.empty((0, self.embedding_dim))
+        return np.hstack([categories, embeddings.astype(np.float32)])
+
+    def predict(self, scenario_features_list: List[Dict]) -> Tuple[np.ndarray, np.ndarray]:
+        """Feature ranges [n, n_features, 2] (NaN for no range) and weights [n, n_features]"""
+        outputs = self.encode(scenario_features_list) @ self.coef + self.intercept
+        outputs = outputs.reshape(len(scenario_features_list), len(self.feature_names), len(self.OUTPUTS))
+
+        present = outputs[..., 0] > self.PRESENCE_THRESHOLD
+        bounds = np.sort(outputs[..., 1:3], axis=-1).astype(np.float64)
+        ranges = np.where(present[..., None], bounds, np.nan)
+        weights = np.where(present, np.clip(outputs[..., 3], 0, 1), 0).astype(np.float32)
+        return ranges, weights
+
+    @staticmethod
+    def training_scenarios(matcher, mask_dimensions: bool = True) -> List[Dict]:
+        """
+        Scenario features of every mapped scenario, and with mask_dimensions
+        also every variant with some of its categories unspecified (16 per
+        scenario), since inputs rarely mention all four dimensions.
+        """
+        dimensions = list(matcher._category_index.keys())
+        masks = list(itertools.product((False, True), repeat=len(dimensions))) if mask_dimensions else [
+            (False,) * len(dimensions)]
+        scenarios = []
+        for mapping in matcher.scenario_mappings:
+            for mask in masks:
+                scenario = {dimension: 'unspecified' if masked else mapping[dimension]
+                            for dimension, masked in zip(dimensions, mask)}
+                scenario['embedding'] = mapping['embedding']
+                scenarios.append(scenario)
+        return scenarios
+
+    @classmethod
+    def fit(cls, matcher, scenario_features_list: List[Dict], alpha: float = 1.0,
+            use_embedding: bool = True) -> 'RangeRegressor':
+        """Fit against matcher.blend_range_arrays on the given scenarios"""
+        from sklearn.linear_model import Ridge # deferred, sklearn is slow to import
+
+        ranges, weights = matcher.blend_range_arrays(scenario_features_list)
+        embedding_name = getattr(matcher._scenario_processor, 'embedding_name', None)
+        model = cls(np.zeros((0, 0)), np.zeros(0), matcher.feature_names, matcher._scenario_categories(),
+                    use_embedding, embedding_name)
+        inputs = model.encode(scenario_features_list)
+
+        n_features = len(model.feature_names)
+        coef = np.zeros((inputs.shape[1], n_features, len(cls.OUTPUTS)), dtype=np.float32)
+        intercept = np.zeros((n_features, len(cls.OUTPUTS)), dtype=np.float32)
+        present = ~np.isnan(ranges[..., 0])
+        for j in range(n_features):
+            # presence and weight are learned from every sample
+            ridge = Ridge(alpha=alpha).fit(inputs, np.column_stack([present[:, j], weights[:, j]]))
+            coef[:, j, [0, 3]] = ridge.coef_.T
+            intercept[j, [0, 3]] = ridge.intercept_
+            # the bounds only where the feature has a range
+            rows = present[:, j]
+            if rows.any():
+                ridge = Ridge(alpha=alpha).fit(inputs[rows], ranges[rows, j])
+                coef[:, j, 1:3] = ridge.coef_.T
+                intercept[j, 1:3] = ridge.intercept_
+
+        model.coef = coef.reshape(inputs.shape[1], -1)
+        model.intercept = intercept.reshape(-1)
+        return model
+
+    @staticmethod
+    def default_path(embedding_name: str, cache_dir: str = None) -> Path:
+        cache_dir = Path(cache_dir) if cache_dir is not None else default_cache_dir()
+        return cache_dir / "range_regressor" / f"{embedding_name.replace('/', '--')}.npz"
+
+    def save(self, path: str):
+        """Write the model as an .npz (see atomic_write)"""
+        meta = {
+            'version': self.VERSION,
+            'feature_names': self.feature_names,
+            'categories': self.categories,
+            'use_embedding': self.use_embedding,
+            'embedding_name': self.embedding_name
+        }
+        with atomic_write(path) as tmp_path:
+            np.savez(tmp_path, coef=self.coef, intercept=self.intercept, meta=np.array(json.dumps(meta)))
+
+    @classmethod
+    def load(cls, path: str) -> 'RangeRegressor':
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            if meta.get('version') != cls.VERSION:
+                raise ValueError(f"Range regressor {path} has version {meta.get('version')}, expected {cls.VERSION}")
+            return cls(data['coef'], data['intercept'], meta['feature_names'], meta['categories'],
+                       meta['use_embedding'], meta['embedding_name'])
+
+
+def accuracy_report(expected: Tuple[np.ndarray, np.ndarray], predicted: Tuple[np.ndarray, np.ndarray],
+                    feature_names: List[str]) -> Dict:
+    """
+    How close predicted (ranges, weights) are to expected ones: how often the
+    right features get a range, how far off the bounds of those are, and how
+    far off the weights are, overall and per feature.
+    """
+    expected_ranges, expected_weights = expected
+    predicted_ranges, predicted_weights = predicted
+    expected_present = ~np.isnan(expected_ranges[..., 0])
+    predicted_present = ~np.isnan(predicted_ranges[..., 0])
+    both = expected_present & predicted_present
+    errors = np.abs(predicted_ranges - expected_ranges)  # NaN unless both have a range
+
+    def mean(values: np.ndarray) -> float:
+        return round(float(values.mean()), 4) if values.size else None
+
+    report = {
+        'n': len(expected_ranges),
+        'presence_accuracy': mean(expected_present == predicted_present),
+        'same_feature_set': mean((expected_present == predicted_present).all(axis=1)),
+        'bound_mae': mean(errors[both]),
+        'weight_mae': mean(np.abs(predicted_weights - expected_weights)[expected_present]),
+        'features': {}
+    }
+    for j, feature in enumerate(feature_names):
+        report['features'][feature] = {
+            'presence_accuracy': mean(expected_present[:, j] == predicted_present[:, j]),
+            'bound_mae': mean(errors[both[:, j], j])
+        }
+    return report
@@ -0,0 +1,65 @@
+import numpy as np
+
+# scores are scanned in chunks of this many songs, so temporaries stay small and cache friendly
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+def _chunk_top_k(chunk: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k best scores in chunk, ties broken towards the lower position"""
+    if len(chunk) <= k:
+        return np.flatnonzero(~np.isnan(chunk)) if chunk.dtype.kind == 'f' else np.arange(len(chunk))
+
+    kth = np.partition(chunk, len(chunk) - k)[len(chunk) - k]
+    if np.isnan(kth):
+        # fewer than k real scores in this chunk
+        return np.flatnonzero(~np.isnan(chunk))
+    above = np.flatnonzero(chunk > kth)
+    equal = np.flatnonzero(chunk == kth)[:k - len(above)]
+    return np.concatenate([above, equal])
+
+def top_k(scores: np.ndarray, k: int, rows: np.ndarray = None,
+          chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+    """
+    Row ids of the k highest scores, best first.
+
+    Equal scores keep catalog order (lower row id first), the same as
+    DataFrame.nlargest(keep='first'). When rows is given only those rows
+    (sorted ascending) are considered. The scores are scanned once in chunks
+    and at most k candidates per chunk are kept, so memory doesn't grow with
+    the catalog. NaN scores are never selected.
+    """
+    n = len(scores) if rows is None else len(rows)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.intp)
+
+    candidate_rows = []
+    candidate_scores = []
+    for start in range(0, n, chunk_size):
+        if rows is None:
+            chunk = scores[start:start + chunk_size]
+            chunk_rows = None
+        else:
+            chunk_rows = rows[start:start + chunk_size]
+            chunk = scores[chunk_rows]
+
+        best = _chunk_top_k(chunk, k)
+        candidate_scores.append(chunk[best])
+        candidate_rows.append(best + start if chunk_rows is None else chunk_rows[best])
+
+    candidate_rows = np.concatenate(candidate_rows)
+    candidate_scores = np.concatenate(candidate_scores)
+    # sort by score descending, then by row id
+    order = np.lexsort((candidate_rows, -candidate_scores))[:k]
+    return candidate_rows[order].astype(np.intp, copy=False)
+
+def merge_top_k_per_query(queries: np.ndarray, keys: np.ndarray, k: int):
+    """
+    Keep the k largest keys of every query. queries and keys are flat
+    parallel arrays, the result comes back grouped by query (ascending) with
+    keys descending inside each group.
+    """
+    order = np.lexsort((-keys, queries))
+    queries, keys = queries[order], keys[order]
+    group_start = np.flatnonzero(np.diff(queries, prepend=-1))
+    rank = np.arange(len(queries)) - np.repeat(group_start, np.diff(np.append(group_start, len(queries))))
+    keep = rank < k
+    return queries[keep], keys[keep]
@@ -0,0 +1,61 @@
+import numpy as np
+from typing import Tuple
+
+class ScenarioIndex:
+    """
+    Cosine-similarity top-k lookup over the mapped scenario embeddings.
+
+    The embeddings are normalized once into a contiguous float32 matrix, so a
+    lookup is one matrix product plus argpartition. Queries can be a single
+    embedding or a (n_queries, dim) batch.
+    """
+
+    def __init__(self, embeddings: np.ndarray):
+        matrix = np.array(embeddings, dtype=np.float32, order='C')
+        self.matrix = self._normalize(matrix)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        # zero vectors stay zero, same as sklearn's cosine_similarity
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def similarities(self, queries: np.ndarray) -> np.ndarray:
+        """Cosine similarity of each query against every scenario"""
+        queries = self._normalize(np.asarray(queries, dtype=np.float32))
+        return queries @ self.matrix.T
+
+    def search(self, queries: np.ndarray, k: int = 3) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return (indices, similarities) of the k most similar scenarios, best first.
+        Shapes are (k,) for a single query and (n_queries, k) for a batch.
+        """
+        queries = np.asarray(queries)
+        single = queries.ndim == 1
+        sims = self.similarities(np.atleast_2d(queries))
+
+        k = min(k, sims.shape[1])
+        if k <= 0:
+            indices = np.empty((sims.shape[0], 0), dtype=np.intp)
+            similarities = np.empty((sims.shape[0], 0), dtype=sims.dtype)
+            return (indices[0], similarities[0]) if single else (indices, similarities)
+
+        if k < sims.shape[1]:
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            top.sort(axis=1)
+        else:
+            top = np.tile(np.arange(sims.shape[1]), (sims.shape[0], 1))
+        top_sims = np.take_along_axis(sims, top, axis=1)
+
+        # order the k winners by similarity, ties go to the lower scenario index
+        order = np.argsort(-top_sims, axis=1, kind='stable')
+        indices = np.take_along_axis(top, order, axis=1)
+        similarities = np.take_along_axis(top_sims, order, axis=1)
+
+        if single:
+            return indices[0], similarities[0]
+        return indices, similarities
@@ -1,6 +1,9 @@
-from transformers import AutoTokenizer, AutoModel
-import torch
+import os
+import threading
 import numpy as np
+from typing import List
+from src.models.micro_batcher import MicroBatcher
+from src.models.keyword_matcher import KeywordMatcher
 
 class ScenarioProcessor:
     #since I want to keep this project at a manageable scale, i just decided to manually created
@@ -10,7 +13,7 @@ class ScenarioProcessor:
         'morning': ['morning', 'dawn', 'breakfast', 'early'],
         'afternoon': ['afternoon', 'lunch', 'midday', 'noon'],
         'evening': ['evening', 'sunset', 'dinner', 'dusk'],
-        'night': ['night', 'late', 'midnight', 'bedtime']
+        'night': ['night', 'late', 'midnight', 'bedtime', 'tonight']
     }
     
     ACTIVITY_CATEGORIES = {
@@ -35,80 +38,151 @@ class ScenarioProcessor:
         'with_family': ['family', 'relatives', 'home']
     }
 
-    def __init__(self):
+    MODEL_NAME = 'distilroberta-base'
+    # 'torch', 'quantized' (dynamic int8) or 'onnx' (ONNX Runtime), see embedding_backends.py
+    BACKEND = os.environ.get('SCENARIO_EMBEDDING_BACKEND', 'torch')
+
+    def __init__(self, model_name: str = None, backend: str = None):
         """
         TODO:
         Initialize:
         - DistilRoBERTa model and tokenizer
         - Scenario categories/features
+
+        Prefer model_registry.get_scenario_processor() so the model is only loaded once per process.
+        """
+        # transformers and torch take seconds to import, so only load them with a model
+        from transformers import AutoTokenizer
+        from src.models.embedding_backends import load_backend
+
+        self.model_name = model_name or self.MODEL_NAME
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        # fast tokenizers change truncation/padding state on every call and raise
+        # "Already borrowed" when shared between request threads
+        self._tokenizer_lock = threading.Lock()
+        self.backend_name = backend or self.BACKEND
+        self.backend = load_backend(self.backend_name, self.model_name)
+
+        # set by enable_micro_batching, single embeddings then share forward passes
+        self.batcher = None
+
+    @staticmethod
+    def embedding_id(model_name: str, backend: str) -> str:
+        """Identifies the embeddings a model/backend pair produces, e.g. for cache keys"""
+        return model_name if backend == 'torch' else f"{model_name}+{backend}"
+
+    @property
+    def embedding_name(self) -> str:
+        return self.embedding_id(self.model_name, self.backend_name)
+
+    def enable_micro_batching(self, max_batch_size: int = 16, max_wait_ms: float = 5.0) -> MicroBatcher:
+        """
+        Route generate_embedding through a MicroBatcher, so concurrent requests
+        are embedded together in one padded forward pass.
         """
-        self.tokenizer = AutoTokenizer.from_pretrained('distilroberta-base')
-        self.model = AutoModel.from_pretrained('distilroberta-base')
-        self.model.eval() # we need to tell the model that we are predicting, not training
-        
-        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        self.model.to(self.device)
+        if self.batcher is not None:
+            self.batcher.close()
+        self.batcher = MicroBatcher(
+            lambda texts: self.generate_embeddings(texts, batch_size=len(texts)),
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            name="embedding-batcher"
+        )
+        return self.batcher
+
+    def disable_micro_batching(self):
+        if self.batcher is not None:
+            self.batcher.close()
+            self.batcher = None
 
     def process_user_input(self, input_text:str) -> dict:
         input_text = input_text.lower() 
 
-        features = {
-            'time': self._extract_time(input_text),
-            'activity': self._extract_activity(input_text),
-            'mood': self._extract_mood(input_text),
-            'social': self._extract_social_context(input_text),
-            'raw_text': input_text,
-            'embedding': self.generate_embedding(input_text)
-        }
+        features = self._extract_features(input_text)
+        features['embedding'] = self.generate_embedding(input_text)
+        return features
+
+    def process_user_inputs(self, input_texts: List[str], batch_size: int = 32) -> List[dict]:
+        """Same as process_user_input, but embeds all inputs with batched forward passes"""
+        input_texts = [text.lower() for text in input_texts]
+        embeddings = self.generate_embeddings(input_texts, batch_size=batch_size)
+
+        results = []
+        for input_text, embedding in zip(input_texts, embeddings):
+            features = self._extract_features(input_text)
+            features['embedding'] = embedding
+            results.append(features)
+        return results
+
+    @classmethod
+    def keyword_matcher(cls) -> KeywordMatcher:
+        """One compiled matcher over all the category keywords, built on first use"""
+        matcher = cls.__dict__.get('_keyword_matcher')
+        if matcher is None:
+            matcher = KeywordMatcher({
+                'time': cls.TIME_CATEGORIES,
+                'activity': cls.ACTIVITY_CATEGORIES,
+                'mood': cls.MOOD_CATEGORIES,
+                'social': cls.SOCIAL_CONTEXT
+            })
+            cls._keyword_matcher = matcher
+        return matcher
+
+    def _extract_features(self, input_text: str) -> dict:
+        # all four dimensions in one pass over the text
+        features = self.keyword_matcher().extract(input_text)
+        features['raw_text'] = input_text
         return features
 
     def _extract_time(self, text: str) -> str:
-        
-        for time, keywords in self.TIME_CATEGORIES.items():
-            if any(keyword in text for keyword in keywords):
-                return time
-        return 'unspecified'
+        return self.keyword_matcher().extract(text)['time']
 
     def _extract_activity(self, text: str) -> str:
-        
-        for activity, keywords in self.ACTIVITY_CATEGORIES.items():
-            if any(keyword in text for keyword in keywords):
-                return activity
-        return 'unspecified'
+        return self.keyword_matcher().extract(text)['activity']
 
     def _extract_mood(self, text: str) -> str:
-        
-        for mood, keywords in self.MOOD_CATEGORIES.items():
-            if any(keyword in text for keyword in keywords):
-                return mood
-        return 'unspecified'
+        return self.keyword_matcher().extract(text)['mood']
 
     def _extract_social_context(self, text: str) -> str:
-        
-        for context, keywords in self.SOCIAL_CONTEXT.items():
-            if any(keyword in text for keyword in keywords):
-                return context
-        return 'unspecified'
+        return self.keyword_matcher().extract(text)['social']
 
     def generate_embedding(self, text:str) -> np.ndarray:
         """
         TODO:
         Convert processed scenario into embeddings using DistilRoBERTa
         """
-        inputs = self.tokenizer(text, 
-                                return_tensors = "pt",
-                                padding=True,
-                                truncation=True,
-                                max_length=512
-                                )
-        
-        inputs = {k: v.to(self.device) for k, v in inputs.items()}
-        
-        
-        with torch.no_grad(): 
-            outputs = self.model(**inputs)
-            
-        
-        embedding = outputs.last_hidden_state[:, 0, :].cpu().numpy()
-        
-        return embedding[0]  # Return the first (and only) embedding
+        batcher = self.batcher
+        if batcher is not None:
+            return batcher(text)
+        return self.generate_embeddings([text], batch_size=1)[0]
+
+    def generate_embeddings(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """
+        Embed many texts at once, returns a (len(texts), hidden_size) array.
+
+        Inputs are sorted by token length before batching so each padded batch
+        holds texts of similar length and little compute goes to padding.
+        """
+        hidden_size = self.backend.hidden_size
+        if not texts:
+            return np.empty((0, hidden_size), dtype=np.float32)
+
+        with self._tokenizer_lock:
+            encoded = self.tokenizer(list(texts), truncation=True, max_length=512)
+        input_ids = encoded['input_ids']
+        order = sorted(range(len(texts)), key=lambda i: len(input_ids[i]))
+
+        embeddings = np.empty((len(texts), hidden_size), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            batch_idx = order[start:start + batch_size]
+            with self._tokenizer_lock:
+                batch = self.tokenizer.pad(
+                    {k: [encoded[k][i] for i in batch_idx] for k in encoded.keys()},
+                    padding=True,
+                    return_tensors="np"
+                )
+
+            # CLS vector of each text, padding is masked out so it doesn't change it
+            embeddings[batch_idx] = self.backend.embed(batch['input_ids'], batch['attention_mask'])
+
+        return embeddings
@@ -1,9 +1,16 @@
+import os
+import threading
+import time
+import warnings
 import numpy as np
-import pandas as pd
 from typing import Dict, List, Tuple
 from src.models.scenario_processor import ScenarioProcessor
 from src.models.feature_matcher import FeatureMatcher
+from src.models.model_registry import get_scenario_processor
 from src.database.db_manager import DatabaseManager
+from src.models.song_store import SongStore
+from src.models.song_similarity import SongSimilarityIndex
+from src.models.lru_cache import LRUCache
 
 class SongRecommender:
     # Define genre characteristics based on audio features
@@ -36,67 +43,347 @@ class SongRecommender:
         }
     }
 
-    def __init__(self):
-        self.scenario_processor = ScenarioProcessor()
-        self.feature_matcher = FeatureMatcher()
-        self.db_manager = DatabaseManager()
-        # Cache the song data
-        self._song_data = None
+    def __init__(self, scenario_processor: ScenarioProcessor = None, feature_matcher: FeatureMatcher = None,
+                 db_manager: DatabaseManager = None, use_range_index: bool = True,
+                 cache_size: int = 1024, cache_ttl: float = None, backend: str = 'memory',
+                 snapshot_path: str = None, scoring: str = 'count'):
+        # share one tokenizer/model between the recommender and the feature matcher
+        self.scenario_processor = scenario_processor if scenario_processor is not None else get_scenario_processor()
+        self.feature_matcher = feature_matcher if feature_matcher is not None else FeatureMatcher(self.scenario_processor)
+        self.db_manager = db_manager if db_manager is not None else DatabaseManager()
+        # 'memory' scores an in-memory copy of the catalog, 'sql' scores inside SQLite
+        # and never loads the catalog, for workers that can't hold it in RAM
+        if backend not in ('memory', 'sql'):
+            raise ValueError(f"Unknown backend: {backend}")
+        self.backend = backend
+        # 'count' ranks by how many ranges a song falls into, 'graded' by how close it is
+        # to each range (see SongStore.graded_scores), which breaks the ties between full matches
+        if scoring not in ('count', 'graded'):
+            raise ValueError(f"Unknown scoring: {scoring}")
+        if scoring == 'graded' and backend == 'sql':
+            raise ValueError("graded scoring needs the 'memory' backend")
+        self.scoring = scoring
+        # binary catalog snapshot (see src/database/export_snapshot.py), used instead of the database when present
+        self.snapshot_path = snapshot_path
+        # the bitmap index costs about 16 bytes per song and feature (65 prefix bitsets of one bit per
+        # song, plus the int32 sort order and the float32 sorted values), ~110 MB per million songs
+        # with the 7 features; turn it off on small workers
+        self.use_range_index = use_range_index
+        # Cache the song data, replaced as a whole (never mutated) on reload/refresh
+        self._song_store = None
+        self._catalog_lock = threading.RLock()
+        # updated_at high-water mark, only used when the table has an updated_at column
+        self._updated_at = None
+        # rowid high-water mark, over all rows (the store only has the usable ones)
+        self._max_row_id = 0
+        # normalized input text -> (scenario features, feature ranges with weights), most queries repeat
+        self.scenario_cache = LRUCache(cache_size, cache_ttl)
+        # (song store, its similarity index), built on first use, then rebuilt (or loaded from disk)
+        # by reload/refresh before they swap in a new store, never on the request path
+        self._similarity = None
 
-    def _get_song_data(self):
-        """Get or cache song data"""
-        if self._song_data is None:
-            self._song_data = self.db_manager.get_song_features()
-        return self._song_data
+    def _get_song_store(self) -> SongStore:
+        """Get or cache song data as a columnar store"""
+        song_store = self._song_store
+        if song_store is None:
+            with self._catalog_lock:
+                if self._song_store is None:
+                    self._song_store = self._load_song_store()
+                song_store = self._song_store
+        return song_store
+
+    def _load_song_store(self) -> SongStore:
+        """Load the catalog and build everything derived from it"""
+        from_snapshot = bool(self.snapshot_path) and os.path.exists(self.snapshot_path)
+        if from_snapshot:
+            song_store = SongStore.load(self.snapshot_path)
+            metadata = SongStore.snapshot_metadata(self.snapshot_path)['metadata']
+            self._updated_at = metadata.get('updated_at')
+            self._max_row_id = metadata.get('max_row_id', song_store.max_row_id)
+        else:
+            # taken before loading, so rows edited during the load are picked up by the next refresh
+            self._updated_at = self.db_manager.get_max_updated_at()
+            self._max_row_id = self.db_manager.get_max_row_id()
+            song_store = SongStore.from_database(self.db_manager)
+
+        # snapshots come with the index and the partitions, only what's missing or stale is built
+        if not self.use_range_index:
+            song_store.range_index = None
+            song_store.partition_bitsets = {}
+        elif song_store.range_index is None:
+            song_store.build_range_index()
+            song_store.partition_bitsets = {}
+        # genre partitions are built with the store, so they always match its rows
+        if (song_store.partition_profiles != self.GENRE_PROFILES or
+                (song_store.range_index is not None and set(song_store.partition_bitsets) != set(self.GENRE_PROFILES))):
+            song_store.build_partitions(self.GENRE_PROFILES)
+
+        if from_snapshot:
+            # catch up with whatever was added to the database after the snapshot
+            song_store, _ = self._apply_catalog_changes(song_store)
+        return song_store
+
+    @staticmethod
+    def _in_store(song_store: SongStore, row_ids: np.ndarray) -> np.ndarray:
+        """Mask of the row ids the store has, a binary search each"""
+        if not len(song_store):
+            return np.zeros(len(row_ids), dtype=bool)
+        pos = np.minimum(np.searchsorted(song_store.row_ids, row_ids), len(song_store) - 1)
+        return song_store.row_ids[pos] == row_ids
+
+    def _apply_catalog_changes(self, song_store: SongStore) -> Tuple[SongStore, int]:
+        updated_at = self.db_manager.get_max_updated_at()
+        # unfiltered, so rows edited into having a NULL feature come back and can be dropped
+        changes = SongStore.from_database(self.db_manager, song_store.feature_names,
+                                          after_rowid=self._max_row_id, updated_since=self._updated_at,
+                                          filtered=False)
+        if len(changes):
+            # unusable rows count too, or the ones after the last usable row would come back every time
+            self._max_row_id = max(self._max_row_id, int(changes.row_ids.max()))
+            # rows edited at the updated_at mark are fetched again (>=), skip the ones we already have
+            unchanged = song_store.unchanged_rows(changes)
+            if unchanged.any():
+                changes = changes.select(np.flatnonzero(~unchanged))
+
+        required = [j for j, name in enumerate(changes.feature_names) if name in DatabaseManager.REQUIRED_COLUMNS]
+        unusable = np.isnan(changes.features[:, required]).any(axis=1)
+        removed = changes.row_ids[unusable]
+        if unusable.any():
+            changes = changes.select(np.flatnonzero(~unusable))
+        removed = removed[self._in_store(song_store, removed)]
+
+        # deleted rows leave no trace to query: the table's row ids are only read when its
+        # count of usable rows is off from what the store will hold
+        n_added = len(changes) - int(np.count_nonzero(self._in_store(song_store, changes.row_ids)))
+        n_usable = self.db_manager.count_song_features(columns=[DatabaseManager.ROWID_COLUMN])['rows']
+        if n_usable != len(song_store) + n_added - len(removed):
+            row_ids = self.db_manager.get_song_row_ids()
+            deleted = song_store.row_ids[~np.isin(song_store.row_ids, row_ids)]
+            removed = np.union1d(removed, deleted)
+
+        if len(changes) or len(removed):
+            song_store = song_store.apply_changes(changes, removed)
+        self._updated_at = updated_at
+        return song_store, len(changes) + len(removed)
+
+    def reload_catalog(self):
+        """Reload the whole catalog and swap in the new store"""
+        with self._catalog_lock:
+            self._swap_song_store(self._load_song_store())
+
+    def refresh_catalog(self) -> int:
+        """
+        Merge in the songs added since the last load (by rowid) and, when the
+        table has an updated_at column, the songs edited since then; songs
+        deleted or edited into failing DatabaseManager.SONG_FILTER are dropped.
+        The new store is built on the side and swapped in with one assignment,
+        requests already running keep the store they started with. Returns the
+        number of added, changed or removed songs.
+        """
+        with self._catalog_lock:
+            song_store, n_changes = self._apply_catalog_changes(self._get_song_store())
+            self._swap_song_store(song_store)
+            return n_changes
+
+    def _swap_song_store(self, song_store: SongStore):
+        # called with the catalog lock held; the similarity index (once in use) is
+        # built for the new store first and replaced together with the store it matches
+        similarity = self._similarity
+        if similarity is not None and similarity[0] is not song_store:
+            self._similarity = self._build_similarity(song_store)
+        self._song_store = song_store
+
+    @staticmethod
+    def _build_similarity(song_store: SongStore) -> Tuple[SongStore, SongSimilarityIndex]:
+        """The store with its similarity index and the track name lookup similar_songs needs, all warm"""
+        song_store.track_names.build_lookup()
+        return song_store, SongSimilarityIndex.load_or_build(song_store)
+
+    def start_auto_refresh(self, interval: float = 300.0) -> threading.Thread:
+        """Call refresh_catalog every interval seconds from a daemon thread"""
+        def refresh_loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh_catalog()
+                except Exception as e:
+                    # keep the thread alive, the next refresh may well succeed
+                    warnings.warn(f"Catalog refresh failed: {e!r}")
+
+        thread = threading.Thread(target=refresh_loop, name="catalog-refresh", daemon=True)
+        thread.start()
+        return thread
+
+    @staticmethod
+    def _normalize_input(user_input: str) -> str:
+        return ' '.join(user_input.lower().split())
+
+    def _resolve_scenario(self, user_input: str,
+                          cache_checked: bool = False) -> Tuple[Dict, Dict[str, Tuple[float, float]]]:
+        """
+        Scenario features and feature ranges for the input, memoized on the
+        normalized text. The cached values are shared by every request, so
+        callers get copies and the embedding is read-only. With cache_checked
+        the caller already counted a miss for the input (see cached_scenario),
+        the cache is only peeked at in case another request resolved it since.
+        """
+        key = self._normalize_input(user_input)
+        resolved = self.scenario_cache.peek(key) if cache_checked else self.scenario_cache.get(key)
+        if resolved is None:
+            scenario_features = self.scenario_processor.process_user_input(key)
+            feature_ranges = self.feature_matcher.get_feature_ranges(scenario_features)
+            if isinstance(scenario_features.get('embedding'), np.ndarray):
+                scenario_features['embedding'].setflags(write=False)
+            resolved = (scenario_features, feature_ranges)
+            self.scenario_cache.put(key, resolved)
+        return dict(resolved[0]), resolved[1].copy()
+
+    def resolve_scenario(self, user_input: str, cache_checked: bool = False) -> Dict[str, Tuple[float, float]]:
+        """Feature ranges for the input, the model-bound half of recommend_songs"""
+        return self._resolve_scenario(user_input, cache_checked)[1]
+
+    def cached_scenario(self, user_input: str) -> Dict[str, Tuple[float, float]]:
+        """Feature ranges for the input if already resolved (a copy), None otherwise"""
+        resolved = self.scenario_cache.get(self._normalize_input(user_input))
+        return None if resolved is None else resolved[1].copy()
 
     def recommend_songs(self, user_input: str, genre: str = None, top_n: int = 10) -> List[Dict]:
-        scenario_features = self.scenario_processor.process_user_input(user_input)
-        feature_ranges = self.feature_matcher.get_feature_ranges(scenario_features)
-        
+        return self.rank_songs(self.resolve_scenario(user_input), genre, top_n)
+
+    def rank_songs(self, feature_ranges: Dict[str, Tuple[float, float]], genre: str = None,
+                   top_n: int = 10) -> List[Dict]:
+        """Best songs for already resolved feature ranges, the catalog-bound half of recommend_songs"""
+        if self.backend == 'sql':
+            genre_ranges = self.GENRE_PROFILES[genre] if genre and genre in self.GENRE_PROFILES else None
+            return self.db_manager.get_top_scored_songs(feature_ranges, genre_ranges, top_n)
+
         # Get songs from cache
-        song_data = self._get_song_data()
-        
-        # Apply genre filtering if specified
-        if genre and genre in self.GENRE_PROFILES:
-            song_data = self._apply_genre_filter(song_data, genre)
-        
-        # Score and sort songs more efficiently
-        scored_songs = self._filter_and_score_songs(song_data, feature_ranges)
-        recommend_songs = scored_songs.nlargest(top_n, 'score')
-
-        # Convert to list of dictionaries
-        return [{
-            "track_name": row["track_name"],
-            "artist_name": row["artist_name"],
-            "danceability": row["danceability"],
-            "energy": row["energy"],
-            "valence": row["valence"],
-            "tempo": row["tempo"],
-            "acousticness": row["acousticness"],
-            "instrumentalness": row["instrumentalness"]
-        } for _, row in recommend_songs.iterrows()]
-
-    def _apply_genre_filter(self, song_data: pd.DataFrame, genre: str) -> pd.DataFrame:
-        genre_features = self.GENRE_PROFILES[genre]
-        mask = pd.Series(True, index=song_data.index)
-        
-        for feature, (min_val, max_val) in genre_features.items():
-            mask &= (song_data[feature] >= min_val) & (song_data[feature] <= max_val)
-        
-        return song_data[mask]
-
-    def _filter_and_score_songs(self, song_data: pd.DataFrame, feature_ranges: Dict[str, Tuple[float, float]]) -> pd.DataFrame:
-        # Calculate scores using vectorized operations
-        scores = pd.Series(0, index=song_data.index)
-        for feature, (min_val, max_val) in feature_ranges.items():
-            if feature in song_data.columns:
-                scores += ((song_data[feature] >= min_val) & 
-                         (song_data[feature] <= max_val)).astype(int)
-        
-        # Add scores to the dataframe
-        result = song_data.copy()
-        result['score'] = scores
-        return result
+        song_store = self._get_song_store()
+
+        # Apply genre filtering if specified, through the precomputed genre partition
+        partition = genre if genre and genre in self.GENRE_PROFILES else None
+
+        if self.scoring == 'graded':
+            weights = getattr(feature_ranges, 'weights', None) or None
+            top = song_store.top_k_graded(feature_ranges, top_n, weights, partition=partition)
+        else:
+            # equal scores keep catalog order like nlargest did. Single requests stay on the
+            # feature_ranges dict the scenario cache holds: building it from the range array costs
+            # ~20us against ~1ms for the index lookup, batches pass arrays (see recommend_batch)
+            top = song_store.top_k(feature_ranges, top_n, partition=partition)
+
+        # Convert to list of dictionaries, only for the winners
+        return [song_store.song(row) for row in top]
+
+    def resolve_scenario_arrays(self, user_inputs: List[str], batch_size: int = 64) -> np.ndarray:
+        """
+        Feature ranges for many inputs as an [n, n_features, 2] array over
+        feature_matcher.feature_names (NaN where there's no range). Inputs
+        missing from the scenario cache are embedded together in batched
+        forward passes, and each distinct input is resolved only once.
+        """
+        return self.resolve_weighted_arrays(user_inputs, batch_size)[0]
+
+    def resolve_weighted_arrays(self, user_inputs: List[str], batch_size: int = 64) -> Tuple[np.ndarray, np.ndarray]:
+        """resolve_scenario_arrays plus the [n, n_features] feature weights"""
+        keys = [self._normalize_input(user_input) for user_input in user_inputs]
+        matcher = self.feature_matcher
+        resolved = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            cached = self.scenario_cache.get(key)
+            if cached is None:
+                missing.append(key)
+            else:
+                feature_ranges = cached[1]
+                weights = getattr(feature_ranges, 'weights', {})
+                resolved[key] = (matcher.ranges_to_array(feature_ranges),
+                                 np.array([weights.get(f, 0.0) for f in matcher.feature_names], dtype=np.float32))
+
+        # offline batches don't go into the cache, they would only evict the hot entries
+        if missing:
+            scenario_features = self.scenario_processor.process_user_inputs(missing, batch_size)
+            resolved.update(zip(missing, zip(*matcher.get_weighted_range_arrays(scenario_features))))
+        if not keys:
+            n_features = len(matcher.feature_names)
+            return np.empty((0, n_features, 2)), np.empty((0, n_features), dtype=np.float32)
+        return (np.stack([resolved[key][0] for key in keys]),
+                np.stack([resolved[key][1] for key in keys]))
+
+    def resolve_scenarios(self, user_inputs: List[str], batch_size: int = 64) -> List[Dict[str, Tuple[float, float]]]:
+        """resolve_scenario_arrays as feature_ranges dicts"""
+        return [self.feature_matcher.range_array_to_dict(ranges)
+                for ranges in self.resolve_scenario_arrays(user_inputs, batch_size)]
+
+    def recommend_batch(self, user_inputs: List[str], genre: str = None, top_n: int = 10,
+                        batch_size: int = 64) -> List[List[Dict]]:
+        """
+        recommend_songs for many inputs at once, one list of songs per input.
+        Inputs are embedded in batches and all their feature ranges are scored
+        against the catalog in a single pass.
+        """
+        ranges, weights = self.resolve_weighted_arrays(user_inputs, batch_size)
+        if self.backend == 'sql':
+            return [self.rank_songs(self.feature_matcher.range_array_to_dict(r), genre, top_n) for r in ranges]
+
+        # different inputs often end up with the same ranges, score each set once
+        graded = self.scoring == 'graded'
+        keys = [r.tobytes() + w.tobytes() if graded else r.tobytes() for r, w in zip(ranges, weights)]
+        slot = {}
+        first = []
+        for i, key in enumerate(keys):
+            if key not in slot:
+                slot[key] = len(first)
+                first.append(i)
+
+        if graded:
+            # graded scores aren't bounded by a small count, so each set gets its own pass
+            songs = [self.rank_songs(self.feature_matcher.range_array_to_dict(ranges[i], weights[i]), genre, top_n)
+                     for i in first]
+            return [songs[slot[key]] for key in keys]
+
+        song_store = self._get_song_store()
+        partition = genre if genre and genre in self.GENRE_PROFILES else None
+        top = song_store.top_k_batch(ranges[first], top_n, partition=partition,
+                                     feature_names=self.feature_matcher.feature_names)
+
+        songs = [[song_store.song(row) for row in rows] for rows in top]
+        return [songs[slot[key]] for key in keys]
+
+    def _get_similarity(self) -> Tuple[SongStore, SongSimilarityIndex]:
+        """The catalog the similarity index was built for and the index, always a matching pair"""
+        if self.backend != 'memory':
+            raise ValueError("similar songs need the 'memory' backend")
+        similarity = self._similarity
+        if similarity is None:
+            # only the first call builds it, after that reload/refresh keep it up to date
+            with self._catalog_lock:
+                if self._similarity is None:
+                    self._similarity = self._build_similarity(self._get_song_store())
+                similarity = self._similarity
+        return similarity
+
+    def similar_songs(self, track: str, artist: str = None, top_n: int = 10) -> List[Dict]:
+        """
+        The top_n songs that sound most like the track (closest audio features),
+        closest first. With several songs of that name the artist picks one,
+        otherwise the first in the catalog is used. Raises KeyError for an
+        unknown track.
+        """
+        song_store, index = self._get_similarity()
+        rows = song_store.track_names.find(track)
+        if artist is not None:
+            rows = [row for row in rows if song_store.artist_names[row] == artist]
+        if len(rows) == 0:
+            raise KeyError(f"Unknown track: {track}" + (f" by {artist}" if artist else ""))
+
+        similar, distances = index.similar(song_store, int(rows[0]), top_n)
+        songs = []
+        for row, distance in zip(similar, distances):
+            song = song_store.song(row)
+            song['distance'] = round(float(distance), 4)
+            songs.append(song)
+        return songs
 
     def get_available_genres(self) -> List[str]:
         return list(self.GENRE_PROFILES.keys())
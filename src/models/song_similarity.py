@@ -0,0 +1,150 @@
+import hashlib
+import pickle
+import warnings
+import numpy as np
+from pathlib import Path
+from typing import List, Tuple
+from src.models.embedding_store import atomic_write, default_cache_dir
+from src.models.song_store import SongStore
+
+class SongSimilarityIndex:
+    """
+    Nearest neighbours of songs in audio feature space, for "songs like this one".
+
+    Every feature is standardized (mean 0, std 1) so tempo doesn't drown out
+    the 0-1 features, missing values sit at the mean. The standardized
+    songs go into a KD-tree, which is exact and answers a query in well
+    under a millisecond on a million songs with this few dimensions.
+    Building it takes a few seconds, so it's saved to disk keyed on a hash
+    of the catalog and reused until the catalog changes.
+    """
+    VERSION = 1
+    LEAF_SIZE = 40
+
+    def __init__(self, tree, mean: np.ndarray, scale: np.ndarray, feature_names: List[str], fingerprint: str):
+        self.tree = tree
+        self.mean = mean
+        self.scale = scale
+        self.feature_names = list(feature_names)
+        self.fingerprint = fingerprint
+
+    @staticmethod
+    def catalog_fingerprint(song_store: SongStore) -> str:
+        """Hash of the features and row ids, changes whenever a song is added or edited"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr((SongSimilarityIndex.VERSION, song_store.feature_names)).encode('utf-8'))
+        # the transpose of the column-major matrix is C-contiguous, no copy
+        digest.update(np.ascontiguousarray(song_store.features.T))
+        digest.update(np.ascontiguousarray(song_store.row_ids))
+        return digest.hexdigest()
+
+    @classmethod
+    def build(cls, song_store: SongStore, fingerprint: str = None) -> 'SongSimilarityIndex':
+        from sklearn.neighbors import KDTree
+
+        features = song_store.features
+        with warnings.catch_warnings():
+            # all-NaN columns are caught below
+            warnings.simplefilter("ignore", RuntimeWarning)
+            mean = np.nanmean(features, axis=0)
+            scale = np.nanstd(features, axis=0)
+        mean = np.nan_to_num(mean).astype(np.float32)
+        scale = np.where(np.isnan(scale) | (scale == 0), 1, scale).astype(np.float32)
+
+        index = cls(None, mean, scale, song_store.feature_names,
+                    fingerprint or cls.catalog_fingerprint(song_store))
+        index.tree = KDTree(index.normalize(features), leaf_size=cls.LEAF_SIZE)
+        return index
+
+    def normalize(self, features: np.ndarray) -> np.ndarray:
+        """Standardized (n, n_features) float64 copy of features, NaN moved to the mean"""
+        normalized = (np.asarray(features, dtype=np.float64) - self.mean) / self.scale
+        return np.nan_to_num(normalized, nan=0.0)
+
+    def query(self, features: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Row ids and distances of the k songs closest to each row of features, closest first"""
+        features = np.atleast_2d(features)
+        k = min(k, self.tree.data.shape[0])
+        if k <= 0:
+            return np.empty((len(features), 0), dtype=np.intp), np.empty((len(features), 0))
+        distances, rows = self.tree.query(self.normalize(features), k=k)
+        return rows, distances
+
+    def similar(self, song_store: SongStore, row: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Row ids and distances of the k songs closest to song row, leaving out
+        the song itself and other copies of it (same track and artist name).
+        """
+        track_name, artist_name = song_store.track_names[row], song_store.artist_names[row]
+        n = len(song_store)
+        n_query = k + 1
+        while True:
+            rows, distances = self.query(song_store.features[row], n_query)
+            rows, distances = rows[0], distances[0]
+            keep = np.array([r != row and not (song_store.track_names[r] == track_name and
+                                                song_store.artist_names[r] == artist_name)
+                             for r in rows], dtype=bool)
+            if keep.sum() >= k or n_query >= n:
+                return rows[keep][:k], distances[keep][:k]
+            # a track with many copies, look further
+            n_query = min(2 * n_query, n)
+
+    @staticmethod
+    def default_path(fingerprint: str, cache_dir: str = None) -> Path:
+        cache_dir = Path(cache_dir) if cache_dir is not None else default_cache_dir()
+        return cache_dir / "similarity" / f"songs_{fingerprint[:16]}.pkl"
+
+    def save(self, path: str):
+        """Pickle the index to path (see atomic_write)"""
+        with atomic_write(path) as tmp_path, open(tmp_path, 'wb') as f:
+            pickle.dump({
+                'version': self.VERSION,
+                'fingerprint': self.fingerprint,
+                'feature_names': self.feature_names,
+                'mean': self.mean,
+                'scale': self.scale,
+                'tree': self.tree
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path: str) -> 'SongSimilarityIndex':
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if state.get('version') != cls.VERSION:
+            raise ValueError(f"Similarity index {path} has version {state.get('version')}, expected {cls.VERSION}")
+        return cls(state['tree'], state['mean'], state['scale'], state['feature_names'], state['fingerprint'])
+
+    @classmethod
+    def load_or_build(cls, song_store: SongStore, cache_dir: str = None) -> 'SongSimilarityIndex':
+        """The saved index for this catalog if there is one, otherwise build it and save it"""
+        fingerprint = cls.catalog_fingerprint(song_store)
+        path = cls.default_path(fingerprint, cache_dir)
+        if path.exists():
+            try:
+                index = cls.load(str(path))
+                if index.fingerprint == fingerprint:
+                    return index
+            except (OSError, ValueError, pickle.UnpicklingError, EOFError):
+                pass
+
+        index = cls.build(song_store, fingerprint)
+        try:
+            index.save(str(path))
+        except OSError as e:
+            # read-only deployments still work, they just rebuild on start
+            warnings.warn(f"Could not save the song similarity index: {e}")
+            return index
+        cls._remove_stale(path)
+        return index
+
+    @staticmethod
+    def _remove_stale(path: Path):
+        """Delete the indexes of earlier catalogs next to path, every refresh would leave one behind"""
+        for stale in path.parent.glob("songs_*.pkl"):
+            # other workers' temp files (see atomic_write) are still being written
+            if stale != path and '.tmp' not in stale.suffixes:
+                try:
+                    stale.unlink()
+                except OSError:
+                    # already removed by another worker
+                    pass
@@ -0,0 +1,799 @@
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+from src.models.range_index import RangeIndex, bitset_from_rows, bitset_to_rows, empty_bitset, shift_segments
+from src.models.ranking import DEFAULT_CHUNK_SIZE, merge_top_k_per_query, top_k
+
+try:
+    import numexpr
+except ImportError:
+    # optional, graded scoring falls back to plain numpy
+    numexpr = None
+
+# numexpr's win is spreading the expression over threads, on one core numpy is faster
+USE_NUMEXPR = numexpr is not None and numexpr.detect_number_of_cores() > 1
+# SongStore.graded_scores for one feature, added to total (x == x is False for NaN)
+GRADED_EXPRESSION = ("total + weight * where(x == x, (1 - edge * where(abs(x - center) < half, abs(x - center) / half, 1))"
+                     " / (1 + where(abs(x - center) > half, abs(x - center) - half, 0) * inv_scale), 0)")
+
+def _encode(s) -> bytes:
+    # missing names (None, or NaN coming from pandas) are stored as empty strings
+    return s.encode('utf-8') if isinstance(s, str) else b''
+
+
+class StringTable:
+    """Immutable list of strings kept as one utf-8 blob plus offsets"""
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+        # (sorted string hashes, positions) for find(), built on first use
+        self._lookup = None
+
+    @classmethod
+    def from_strings(cls, strings: Iterable[str]) -> 'StringTable':
+        encoded = [_encode(s) for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(blob, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.blob[start:end].tobytes().decode('utf-8')
+
+    def tolist(self) -> List[str]:
+        return [self[i] for i in range(len(self))]
+
+    _HASH_MULTIPLIER = np.uint64(0x100000001B3)
+
+    def _hash_strings(self) -> np.ndarray:
+        """Polynomial hash of every string, computed over the whole blob at once"""
+        lengths = np.diff(self.offsets)
+        n_bytes = len(self.blob)
+        if n_bytes == 0:
+            return np.zeros(len(self), dtype=np.uint64)
+        powers = np.cumprod(np.full(int(lengths.max()), self._HASH_MULTIPLIER, dtype=np.uint64))
+        position = np.arange(n_bytes) - np.repeat(self.offsets[:-1], lengths)
+        with np.errstate(over='ignore'):
+            terms = (self.blob.astype(np.uint64) + np.uint64(1)) * powers[position]
+            # a trailing 0 so empty strings at the end still have a valid start
+            hashes = np.add.reduceat(np.append(terms, np.uint64(0)), self.offsets[:-1])
+        # reduceat gives the next string's first term for empty strings
+        hashes[lengths == 0] = 0
+        return hashes
+
+    def _hash_one(self, encoded: bytes) -> np.uint64:
+        if not encoded:
+            return np.uint64(0)
+        powers = np.cumprod(np.full(len(encoded), self._HASH_MULTIPLIER, dtype=np.uint64))
+        with np.errstate(over='ignore'):
+            return np.add.reduce((np.frombuffer(encoded, dtype=np.uint8).astype(np.uint64) + np.uint64(1)) * powers)
+
+    def build_lookup(self) -> Tuple[np.ndarray, np.ndarray]:
+        """The sorted string hashes find() searches, built on the first call"""
+        lookup = self._lookup
+        if lookup is None:
+            hashes = self._hash_strings()
+            order = np.argsort(hashes, kind='stable')
+            lookup = self._lookup = (hashes[order], order)
+        return lookup
+
+    def find(self, s: str) -> np.ndarray:
+        """
+        Positions of the strings equal to s, ascending. The first call hashes
+        every string and sorts the hashes (see build_lookup, the table never
+        changes), later calls are a binary search plus a check of the few
+        candidates.
+        """
+        sorted_hashes, order = self.build_lookup()
+
+        encoded = _encode(s)
+        target = self._hash_one(encoded)
+        start, end = np.searchsorted(sorted_hashes, target, 'left'), np.searchsorted(sorted_hashes, target, 'right')
+        starts = self.offsets[:-1]
+        candidates = order[start:end]
+        candidates = candidates[self.offsets[candidates + 1] - starts[candidates] == len(encoded)]
+        target_bytes = np.frombuffer(encoded, dtype=np.uint8)
+        for j, byte in enumerate(target_bytes):
+            candidates = candidates[self.blob[starts[candidates] + j] == byte]
+        return candidates
+
+    def merge(self, sources: np.ndarray, other: 'StringTable') -> 'StringTable':
+        """
+        New table whose string i is self[sources[i]], or other[~sources[i]]
+        where sources[i] is negative. Runs of consecutive strings of this
+        table are copied as whole slices of the blob, so the cost is the copy
+        plus one step per string taken from other.
+        """
+        sources = np.asarray(sources, dtype=np.int64)
+        from_self = sources >= 0
+        lengths = np.empty(len(sources), dtype=np.int64)
+        lengths[from_self] = np.diff(self.offsets)[sources[from_self]]
+        lengths[~from_self] = np.diff(other.offsets)[~sources[~from_self]]
+        offsets = np.zeros(len(sources) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        if not len(sources):
+            return StringTable(np.empty(0, dtype=np.uint8), offsets)
+
+        # a run ends wherever the next string isn't the next one of this table
+        breaks = np.flatnonzero(~from_self[1:] | ~from_self[:-1] | (np.diff(sources) != 1)) + 1
+        run_starts = np.concatenate([[0], breaks]).tolist()
+        run_ends = np.concatenate([breaks, [len(sources)]]).tolist()
+        pieces = []
+        for start, end in zip(run_starts, run_ends):
+            if from_self[start]:
+                pieces.append(self.blob[self.offsets[sources[start]]:self.offsets[sources[end - 1] + 1]])
+            else:
+                j = ~sources[start]
+                pieces.append(other.blob[other.offsets[j]:other.offsets[j + 1]])
+        return StringTable(np.concatenate(pieces), offsets)
+
+    def concat(self, other: 'StringTable') -> 'StringTable':
+        blob = np.concatenate([self.blob, other.blob])
+        offsets = np.concatenate([self.offsets, other.offsets[1:] + self.offsets[-1]])
+        return StringTable(blob, offsets)
+
+
+class StringTableBuilder:
+    """Fills a StringTable chunk by chunk into buffers sized up front"""
+
+    def __init__(self, n_strings: int = 0, n_bytes: int = 0):
+        self.blob = np.empty(n_bytes, dtype=np.uint8)
+        self.offsets = np.zeros(n_strings + 1, dtype=np.int64)
+        self.n_strings = 0
+
+    def extend(self, strings: Iterable[str]):
+        encoded = [_encode(s) for s in strings]
+        chunk = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        start, end = self.n_strings, self.n_strings + len(encoded)
+        byte_start = self.offsets[start]
+
+        # the sizes are only a hint, grow if the table changed since they were taken
+        if end + 1 > len(self.offsets):
+            self.offsets = np.resize(self.offsets, max(end + 1, 2 * len(self.offsets)))
+        if byte_start + len(chunk) > len(self.blob):
+            self.blob = np.resize(self.blob, max(byte_start + len(chunk), 2 * len(self.blob)))
+
+        self.blob[byte_start:byte_start + len(chunk)] = chunk
+        np.cumsum([len(b) for b in encoded], out=self.offsets[start + 1:end + 1])
+        self.offsets[start + 1:end + 1] += byte_start
+        self.n_strings = end
+
+    def build(self) -> StringTable:
+        offsets = self.offsets[:self.n_strings + 1]
+        return StringTable(self.blob[:offsets[-1]], offsets)
+
+
+class SongStore:
+    """
+    Columnar in-memory song catalog.
+
+    Audio features live in one float32 matrix stored column-major, so every
+    feature is a contiguous array. Track and artist names sit in separate
+    string tables and are only decoded for the songs that get returned.
+    """
+    FEATURE_COLUMNS = ['danceability', 'energy', 'valence', 'tempo',
+                       'acousticness', 'instrumentalness', 'speechiness']
+    # bump when the snapshot layout written by save() changes
+    SNAPSHOT_VERSION = 3
+    # file in a snapshot directory naming the version directory to load
+    SNAPSHOT_POINTER = "CURRENT"
+    # graded scoring: share of a feature's score a song at the edge of the range loses
+    # against one at its center, so full matches don't all tie
+    GRADED_EDGE_PENALTY = 0.25
+    # the features returned with every recommendation
+    RESULT_COLUMNS = ['danceability', 'energy', 'valence', 'tempo',
+                      'acousticness', 'instrumentalness']
+
+    def __init__(self, features: np.ndarray, track_names: StringTable, artist_names: StringTable,
+                 feature_names: List[str] = None, row_ids: np.ndarray = None):
+        self.feature_names = list(feature_names or self.FEATURE_COLUMNS)
+        self.features = np.asfortranarray(features, dtype=np.float32)
+        if self.features.shape != (len(track_names), len(self.feature_names)):
+            raise ValueError(f"features has shape {self.features.shape}, expected "
+                             f"({len(track_names)}, {len(self.feature_names)})")
+
+        self.track_names = track_names
+        self.artist_names = artist_names
+        # database rowid of every song, ascending
+        self.row_ids = np.arange(len(track_names), dtype=np.int64) if row_ids is None else row_ids
+        # contiguous views into the feature matrix, no copies
+        self.columns = {name: self.features[:, j] for j, name in enumerate(self.feature_names)}
+        # per-thread scoring buffers, allocated once and reused by every request
+        self._buffers = threading.local()
+        self.range_index = None
+        # precomputed row subsets (e.g. genres), as sorted row ids and as bitsets for the range index
+        self.partitions = {}
+        self.partition_bitsets = {}
+        self._partition_profiles = {}
+        self._feature_scales = None
+
+    @classmethod
+    def from_dataframe(cls, song_data: pd.DataFrame) -> 'SongStore':
+        feature_names = [c for c in cls.FEATURE_COLUMNS if c in song_data.columns]
+        features = np.empty((len(song_data), len(feature_names)), dtype=np.float32, order='F')
+        for j, name in enumerate(feature_names):
+            features[:, j] = song_data[name].to_numpy(dtype=np.float32, na_value=np.nan)
+
+        row_ids = song_data['rowid'].to_numpy(dtype=np.int64) if 'rowid' in song_data.columns else None
+        return cls(features,
+                   StringTable.from_strings(song_data['track_name']),
+                   StringTable.from_strings(song_data['artist_name']),
+                   feature_names, row_ids)
+
+    @classmethod
+    def from_database(cls, db_manager, feature_names: List[str] = None, chunk_size: int = 50000,
+                      limit: int = None, after_rowid: int = None, updated_since=None,
+                      filtered: bool = True) -> 'SongStore':
+        """
+        Stream the catalog from the database straight into the columnar buffers.
+
+        The buffers are sized from a count query first, then filled one chunk at a
+        time, so peak memory is the final store plus a single chunk. feature_names
+        limits which audio features are loaded, after_rowid / updated_since load
+        only the rows added or changed since a previous load, and filtered=False
+        keeps the rows that fail DatabaseManager.SONG_FILTER.
+        """
+        if feature_names is None:
+            feature_names = cls.FEATURE_COLUMNS
+        feature_names = [c for c in cls.FEATURE_COLUMNS if c in feature_names]
+        columns = ['rowid', 'track_name', 'artist_name'] + feature_names
+
+        counts = db_manager.count_song_features(limit, columns, after_rowid, updated_since, filtered)
+        features = np.empty((counts['rows'], len(feature_names)), dtype=np.float32, order='F')
+        row_ids = np.empty(counts['rows'], dtype=np.int64)
+        track_names = StringTableBuilder(counts['rows'], counts['track_name'])
+        artist_names = StringTableBuilder(counts['rows'], counts['artist_name'])
+
+        n = 0
+        for chunk in db_manager.iter_song_features(columns, chunk_size, limit, after_rowid, updated_since, filtered):
+            end = n + len(chunk['track_name'])
+            if end > len(features):
+                # rows were added after the count, grow the buffers
+                grown = np.empty((max(end, 2 * len(features)), len(feature_names)), dtype=np.float32, order='F')
+                grown[:n] = features[:n]
+                features = grown
+                row_ids = np.resize(row_ids, len(features))
+            row_ids[n:end] = chunk['rowid']
+            for j, name in enumerate(feature_names):
+                features[n:end, j] = chunk[name]
+            track_names.extend(chunk['track_name'])
+            artist_names.extend(chunk['artist_name'])
+            n = end
+
+        return cls(features[:n], track_names.build(), artist_names.build(), feature_names, row_ids[:n])
+
+    def save(self, path: str, metadata: Dict = None):
+        """
+        Write the store as a snapshot: raw .npy files plus meta.json, with the
+        range index and the partitions when they are built, so loading it
+        needs no rebuild.
+
+        Every save writes a new version directory inside path, and the
+        CURRENT file naming the version to load is swapped in with a single
+        rename, so a worker loading it never sees a half written or missing
+        snapshot. The previous version is kept for workers that just read the
+        old CURRENT, older ones are removed.
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        version = f"snapshot-{time.time_ns()}-{os.getpid()}"
+        directory = path / version
+        directory.mkdir()
+
+        np.save(directory / "features.npy", np.asfortranarray(self.features))
+        np.save(directory / "row_ids.npy", self.row_ids)
+        for name, table in (('track_names', self.track_names), ('artist_names', self.artist_names)):
+            np.save(directory / f"{name}.blob.npy", table.blob)
+            np.save(directory / f"{name}.offsets.npy", table.offsets)
+
+        index_meta = None
+        if self.range_index is not None:
+            (directory / "range_index").mkdir()
+            for name, array in self.range_index.arrays().items():
+                np.save(directory / "range_index" / f"{name}.npy", array)
+            index_meta = {'features': self.range_index.features, 'n_buckets': self.range_index.n_buckets}
+        if self._partition_profiles:
+            (directory / "partitions").mkdir()
+            for name, rows in self.partitions.items():
+                np.save(directory / "partitions" / f"{name}.rows.npy", rows)
+            for name, bitset in self.partition_bitsets.items():
+                np.save(directory / "partitions" / f"{name}.bitset.npy", bitset)
+
+        with open(directory / "meta.json", 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': self.SNAPSHOT_VERSION,
+                'n_rows': len(self),
+                'feature_names': self.feature_names,
+                'range_index': index_meta,
+                'partitions': self._partition_profiles,
+                'metadata': metadata or {}
+            }, f)
+
+        pointer = path / self.SNAPSHOT_POINTER
+        previous = pointer.read_text(encoding='utf-8').strip() if pointer.exists() else None
+        tmp = path / f"{self.SNAPSHOT_POINTER}.tmp-{os.getpid()}"
+        tmp.write_text(version, encoding='utf-8')
+        os.replace(tmp, pointer)
+        for old in path.glob("snapshot-*"):
+            # processes that mapped the old files keep them until they let go
+            if old.name not in (version, previous):
+                shutil.rmtree(old, ignore_errors=True)
+
+    @classmethod
+    def _snapshot_directory(cls, path: str) -> Path:
+        path = Path(path)
+        return path / (path / cls.SNAPSHOT_POINTER).read_text(encoding='utf-8').strip()
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'SongStore':
+        """
+        Load a snapshot written by save(). With mmap the arrays are memory-mapped
+        read-only, so every worker on the machine shares one copy in the page cache.
+        """
+        directory = cls._snapshot_directory(path)
+        with open(directory / "meta.json", 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != cls.SNAPSHOT_VERSION:
+            raise ValueError(f"Snapshot {path} has version {meta.get('version')}, "
+                             f"expected {cls.SNAPSHOT_VERSION}")
+
+        mmap_mode = 'r' if mmap else None
+        tables = {}
+        for name in ('track_names', 'artist_names'):
+            tables[name] = StringTable(np.load(directory / f"{name}.blob.npy", mmap_mode=mmap_mode),
+                                       np.load(directory / f"{name}.offsets.npy", mmap_mode=mmap_mode))
+        features = np.load(directory / "features.npy", mmap_mode=mmap_mode)
+        row_ids = np.load(directory / "row_ids.npy", mmap_mode=mmap_mode)
+        store = cls(features, tables['track_names'], tables['artist_names'], meta['feature_names'], row_ids)
+
+        index_meta = meta.get('range_index')
+        if index_meta:
+            arrays = {file.stem: np.load(file, mmap_mode=mmap_mode)
+                      for file in (directory / "range_index").glob("*.npy")}
+            store.range_index = RangeIndex.from_arrays(len(store), index_meta['features'],
+                                                       index_meta['n_buckets'], arrays)
+        for name, ranges in meta.get('partitions', {}).items():
+            store.partitions[name] = np.load(directory / "partitions" / f"{name}.rows.npy", mmap_mode=mmap_mode)
+            bitset_path = directory / "partitions" / f"{name}.bitset.npy"
+            if bitset_path.exists():
+                store.partition_bitsets[name] = np.load(bitset_path, mmap_mode=mmap_mode)
+            store._partition_profiles[name] = {feature: tuple(bounds) for feature, bounds in ranges.items()}
+        return store
+
+    @classmethod
+    def snapshot_metadata(cls, path: str) -> Dict:
+        with open(cls._snapshot_directory(path) / "meta.json", 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def __len__(self):
+        return self.features.shape[0]
+
+    @property
+    def max_row_id(self) -> int:
+        """Highest row id in the store (rows that can't be used aren't in it, see SongRecommender._max_row_id)"""
+        return int(self.row_ids[-1]) if len(self) else 0
+
+    def unchanged_rows(self, changes: 'SongStore') -> np.ndarray:
+        """Mask of the rows of changes this store already holds as they are: same row id, features and names"""
+        same = np.zeros(len(changes), dtype=bool)
+        if not len(self) or not len(changes):
+            return same
+        pos = np.minimum(np.searchsorted(self.row_ids, changes.row_ids), len(self) - 1)
+        ours, theirs = self.features[pos], changes.features
+        same = (self.row_ids[pos] == changes.row_ids) & \
+            ((ours == theirs) | (np.isnan(ours) & np.isnan(theirs))).all(axis=1)
+        for i in np.flatnonzero(same):
+            same[i] = (self.track_names[pos[i]] == changes.track_names[i] and
+                       self.artist_names[pos[i]] == changes.artist_names[i])
+        return same
+
+    def select(self, rows: np.ndarray) -> 'SongStore':
+        """New store with just the given rows, in that order"""
+        rows = np.asarray(rows, dtype=np.intp)
+        return SongStore(self.features[rows],
+                         StringTable.from_strings([self.track_names[row] for row in rows]),
+                         StringTable.from_strings([self.artist_names[row] for row in rows]),
+                         self.feature_names, self.row_ids[rows])
+
+    def apply_changes(self, changes: 'SongStore', removed: np.ndarray = None) -> 'SongStore':
+        """
+        New store with the rows of changes merged in and the row ids in
+        removed dropped: rows whose row id is already here are patched, the
+        others are inserted in row id order. The range index and partitions
+        are updated for just the changed rows, the others are moved over (see
+        RangeIndex.update), so a refresh costs about a copy of the store, not a
+        rebuild. This store is not modified, so readers holding it keep a
+        consistent view until they pick up the new one.
+        """
+        if changes.feature_names != self.feature_names:
+            raise ValueError("changes must have the same features as the store")
+
+        n = len(self)
+        keep = None
+        if removed is not None and len(removed):
+            keep = ~np.isin(self.row_ids, removed)
+            if keep.all():
+                keep = None
+            # a row both changed and removed is removed
+            dropped = np.isin(changes.row_ids, removed)
+            if dropped.any():
+                changes = changes.select(np.flatnonzero(~dropped))
+        order = np.argsort(changes.row_ids, kind='stable')
+        if (np.diff(order) < 0).any():
+            changes = changes.select(order)
+
+        pos = np.searchsorted(self.row_ids, changes.row_ids)
+        patched = np.zeros(len(changes), dtype=bool)
+        if n:
+            patched = self.row_ids[np.minimum(pos, n - 1)] == changes.row_ids
+        patched_rows = np.flatnonzero(patched)
+        added = np.flatnonzero(~patched)
+        if not len(patched_rows) and keep is None and (not n or not len(added) or
+                                                       changes.row_ids[added[0]] > self.row_ids[-1]):
+            return self._append(changes)
+
+        # where every row ends up: the kept rows in their order, the added ones merged in by row id
+        kept_rows = np.arange(n) if keep is None else np.flatnonzero(keep)
+        kept_ids = self.row_ids[kept_rows]
+        added_ids = changes.row_ids[added]
+        kept_at = np.arange(len(kept_rows)) + np.searchsorted(added_ids, kept_ids)
+        added_at = np.searchsorted(kept_ids, added_ids) + np.arange(len(added))
+        position = np.full(n, -1, dtype=np.int64)
+        position[kept_rows] = kept_at
+        patched_at = position[pos[patched_rows]]
+        segments = shift_segments(position)
+
+        n_rows = len(kept_rows) + len(added)
+        features = np.empty((n_rows, len(self.feature_names)), dtype=np.float32, order='F')
+        row_ids = np.empty(n_rows, dtype=np.int64)
+        # negative sources (~i) take row i of changes
+        sources = np.empty(n_rows, dtype=np.int64)
+        # kept rows move in runs, copied as slices
+        for start, end, delta in segments:
+            features[start + delta:end + delta] = self.features[start:end]
+            row_ids[start + delta:end + delta] = self.row_ids[start:end]
+            sources[start + delta:end + delta] = np.arange(start, end)
+        features[patched_at] = changes.features[patched_rows]
+        features[added_at] = changes.features[added]
+        row_ids[added_at] = added_ids
+        sources[patched_at] = ~patched_rows
+        sources[added_at] = ~added
+        store = SongStore(features, self.track_names.merge(sources, changes.track_names),
+                          self.artist_names.merge(sources, changes.artist_names), self.feature_names, row_ids)
+
+        changed = np.sort(np.concatenate([patched_at, added_at]))
+        if self.range_index is not None:
+            # the rows whose old values leave the index
+            stale = np.union1d(np.flatnonzero(position < 0), pos[patched_rows])
+            store.range_index = self.range_index.update(self.columns, store.columns, position, stale,
+                                                        changed, segments)
+        if self._partition_profiles:
+            store._update_partitions(self, position, changed)
+        return store
+
+    def _append(self, appended: 'SongStore') -> 'SongStore':
+        """apply_changes for rows that all come after the existing ones"""
+        features = np.empty((len(self) + len(appended), len(self.feature_names)), dtype=np.float32, order='F')
+        features[:len(self)] = self.features
+        features[len(self):] = appended.features
+        store = SongStore(features, self.track_names.concat(appended.track_names),
+                          self.artist_names.concat(appended.artist_names), self.feature_names,
+                          np.concatenate([self.row_ids, appended.row_ids]))
+        if self.range_index is not None:
+            store.range_index = self.range_index.extend(store.columns)
+        if self._partition_profiles:
+            store._extend_partitions(self, appended)
+        return store
+
+    def _extend_partitions(self, previous: 'SongStore', appended: 'SongStore'):
+        """Partitions of previous plus the rows of appended, which follow its rows"""
+        n = len(previous)
+        self._partition_profiles = previous._partition_profiles
+        for name, ranges in self._partition_profiles.items():
+            new_rows = np.flatnonzero(appended.range_mask(ranges)) + n
+            self.partitions[name] = np.concatenate([previous.partitions[name], new_rows])
+            if self.range_index is not None:
+                bitset = empty_bitset(len(self))
+                old_bitset = previous.partition_bitsets.get(name)
+                if old_bitset is not None:
+                    bitset[:len(old_bitset)] = old_bitset
+                    bitset |= bitset_from_rows(new_rows, len(self))
+                else:
+                    bitset = bitset_from_rows(self.partitions[name], len(self))
+                self.partition_bitsets[name] = bitset
+
+    def _update_partitions(self, previous: 'SongStore', position: np.ndarray, changed: np.ndarray):
+        """Partitions of previous with its rows moved to position, the changed rows matched again"""
+        self._partition_profiles = previous._partition_profiles
+        is_changed = np.zeros(len(self), dtype=bool)
+        is_changed[changed] = True
+        for name, ranges in self._partition_profiles.items():
+            rows = position[previous.partitions[name]]
+            rows = rows[rows >= 0]
+            rows = rows[~is_changed[rows]]
+            mask = np.ones(len(changed), dtype=bool)
+            for feature, (min_val, max_val) in ranges.items():
+                column = self.columns[feature][changed]
+                mask &= (column >= np.float32(min_val)) & (column <= np.float32(max_val))
+            matching = changed[mask]
+            self.partitions[name] = np.insert(rows, np.searchsorted(rows, matching), matching)
+            if self.range_index is not None:
+                self.partition_bitsets[name] = bitset_from_rows(self.partitions[name], len(self))
+
+    def build_range_index(self, n_buckets: int = 64) -> RangeIndex:
+        """Bucket every feature once so range scoring works on bitsets"""
+        self.range_index = RangeIndex(self.columns, n_buckets)
+        return self.range_index
+
+    def build_partitions(self, profiles: Dict[str, Dict[str, Tuple[float, float]]]):
+        """Precompute the rows matching every profile, call again after the index is (re)built"""
+        partitions = {}
+        partition_bitsets = {}
+        for name, ranges in profiles.items():
+            if self.range_index is not None:
+                bitset = self.range_index.all_rows.copy()
+                for feature, (min_val, max_val) in ranges.items():
+                    bitset &= self.range_index.match(feature, min_val, max_val)
+                partition_bitsets[name] = bitset
+                partitions[name] = bitset_to_rows(bitset)
+            else:
+                partitions[name] = np.flatnonzero(self.range_mask(ranges))
+
+        self.partitions = partitions
+        self.partition_bitsets = partition_bitsets
+        self._partition_profiles = dict(profiles)
+
+    @property
+    def partition_profiles(self) -> Dict[str, Dict[str, Tuple[float, float]]]:
+        """The profiles the current partitions were built from"""
+        return self._partition_profiles
+
+    def _scratch(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        buffers = self._buffers
+        if getattr(buffers, 'scores', None) is None or len(buffers.scores) != len(self):
+            n = len(self)
+            buffers.scores = np.empty(n, dtype=np.float32)
+            buffers.mask = np.empty(n, dtype=bool)
+            buffers.tmp = np.empty(n, dtype=bool)
+        return buffers.scores, buffers.mask, buffers.tmp
+
+    def score_ranges(self, feature_ranges: Dict[str, Tuple[float, float]]) -> np.ndarray:
+        """
+        Count for every song how many of the feature ranges it falls into.
+
+        The returned array is this thread's scoring buffer, it is overwritten by
+        the next call from the same thread.
+        """
+        scores, mask, tmp = self._scratch()
+        if self.range_index is not None:
+            return self.range_index.score(feature_ranges, scores)
+
+        scores.fill(0)
+        for feature, (min_val, max_val) in feature_ranges.items():
+            column = self.columns.get(feature)
+            if column is None:
+                continue
+            # compare in float32 so a bound equal to a stored value still matches
+            np.greater_equal(column, np.float32(min_val), out=mask)
+            np.less_equal(column, np.float32(max_val), out=tmp)
+            mask &= tmp
+            scores += mask
+        return scores
+
+    def top_k(self, feature_ranges: Dict[str, Tuple[float, float]], k: int, rows: np.ndarray = None,
+              partition: str = None) -> np.ndarray:
+        """
+        Row ids of the k songs matching the most ranges. Candidates can be
+        limited to a precomputed partition or to an explicit array of rows.
+        """
+        if partition is not None:
+            rows = self.partitions[partition]
+
+        if self.range_index is not None:
+            if partition is not None and partition in self.partition_bitsets:
+                bitset = self.partition_bitsets[partition]
+            else:
+                bitset = None if rows is None else bitset_from_rows(rows, len(self))
+            return self.range_index.top_k(feature_ranges, k, bitset)
+        return top_k(self.score_ranges(feature_ranges), k, rows=rows)
+
+    def _range_bounds(self, feature_ranges_list, feature_names: List[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(n_queries, n_features) lower and upper bounds, features without a range never match"""
+        lower = np.full((len(feature_ranges_list), len(self.feature_names)), np.inf, dtype=np.float32)
+        upper = np.full_like(lower, -np.inf)
+        index = {name: j for j, name in enumerate(self.feature_names)}
+        if isinstance(feature_ranges_list, np.ndarray):
+            # [n_queries, len(feature_names), 2] array, NaN where a feature has no range
+            for i, name in enumerate(feature_names):
+                if name in index:
+                    bounds = feature_ranges_list[:, i]
+                    has_range = ~np.isnan(bounds[:, 0])
+                    lower[has_range, index[name]] = bounds[has_range, 0]
+                    upper[has_range, index[name]] = bounds[has_range, 1]
+            return lower, upper
+
+        for i, feature_ranges in enumerate(feature_ranges_list):
+            for feature, (min_val, max_val) in feature_ranges.items():
+                if feature in index:
+                    lower[i, index[feature]] = min_val
+                    upper[i, index[feature]] = max_val
+        return lower, upper
+
+    def top_k_batch(self, feature_ranges_list, k: int, rows: np.ndarray = None, partition: str = None,
+                    feature_names: List[str] = None, max_block: int = 1 << 20) -> np.ndarray:
+        """
+        top_k for many sets of feature ranges in one pass over the catalog.
+
+        Every chunk of songs is scored against all range sets at once as a
+        (n_queries, chunk) matrix. Only songs scoring at least the current k-th
+        best of their query are pulled out of it, so after the first chunk the
+        merge works on a handful of candidates. Returns an
+        (n_queries, min(k, n_candidates)) array of row ids, in the same order
+        top_k would give for each set. With a range index the sets are scored
+        together on the index's bitsets instead (RangeIndex.top_k_batch),
+        which is faster still.
+
+        feature_ranges_list is a list of feature_ranges dicts, or an
+        [n_queries, len(feature_names), 2] array of (min, max) with NaN where a
+        feature has no range, as FeatureMatcher.get_feature_range_arrays returns.
+        """
+        if partition is not None:
+            rows = self.partitions[partition]
+        n_queries = len(feature_ranges_list)
+        n_candidates = len(self) if rows is None else len(rows)
+        k = max(0, min(k, n_candidates))
+        if n_queries == 0 or k == 0:
+            return np.empty((n_queries, k), dtype=np.intp)
+
+        lower, upper = self._range_bounds(feature_ranges_list, feature_names)
+        if self.range_index is not None:
+            if partition is not None and partition in self.partition_bitsets:
+                bitset = self.partition_bitsets[partition]
+            else:
+                bitset = None if rows is None else bitset_from_rows(rows, len(self))
+            return self.range_index.top_k_batch(lower, upper, k, bitset)
+
+        # a song's key orders by score, then by lower row id, and is unique per song
+        n = len(self)
+        chunk_size = max(1024, max_block // n_queries)
+        scores = np.empty((n_queries, chunk_size), dtype=np.uint8)
+        match = np.empty((n_queries, chunk_size), dtype=bool)
+        tmp = np.empty_like(match)
+        threshold = np.zeros((n_queries, 1), dtype=np.uint8)
+        best_queries = np.empty(0, dtype=np.intp)
+        best_keys = np.empty(0, dtype=np.int64)
+
+        for start in range(0, n_candidates, chunk_size):
+            end = min(start + chunk_size, n_candidates)
+            chunk_rows = np.arange(start, end) if rows is None else rows[start:end]
+            width = end - start
+            chunk_scores, chunk_match, chunk_tmp = scores[:, :width], match[:, :width], tmp[:, :width]
+
+            chunk_scores.fill(0)
+            for j, name in enumerate(self.feature_names):
+                column = self.columns[name][start:end] if rows is None else self.columns[name][chunk_rows]
+                np.greater_equal(column, lower[:, j, None], out=chunk_match)
+                np.less_equal(column, upper[:, j, None], out=chunk_tmp)
+                chunk_match &= chunk_tmp
+                chunk_scores += chunk_match
+
+            # later rows lose ties, so only strictly better scores can displace a full top k
+            np.greater_equal(chunk_scores, threshold, out=chunk_match)
+            queries, positions = np.nonzero(chunk_match)
+            keys = chunk_scores[queries, positions].astype(np.int64) * n + (n - 1 - chunk_rows[positions])
+            best_queries, best_keys = merge_top_k_per_query(
+                np.concatenate([best_queries, queries]), np.concatenate([best_keys, keys]), k)
+
+            # k-th best score of every query with a full top k, plus one
+            counts = np.bincount(best_queries, minlength=n_queries)
+            full = np.flatnonzero(counts == k)
+            last = np.cumsum(counts)[full] - 1
+            threshold[full, 0] = best_keys[last] // n + 1
+
+        return (n - 1 - best_keys % n).reshape(n_queries, k).astype(np.intp)
+
+    def feature_scales(self) -> np.ndarray:
+        """Standard deviation of every feature, graded scoring measures distances in these units"""
+        if self._feature_scales is None:
+            scales = np.ones(len(self.feature_names), dtype=np.float32)
+            for j, name in enumerate(self.feature_names):
+                column = self.columns[name]
+                valid = column[~np.isnan(column)]
+                if len(valid) and valid.std() > 0:
+                    scales[j] = valid.std()
+            self._feature_scales = scales
+        return self._feature_scales
+
+    def graded_scores(self, feature_ranges: Dict[str, Tuple[float, float]], weights: Dict[str, float] = None,
+                      rows: np.ndarray = None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+        """
+        Continuous score of every song (or of rows, in that order) against the ranges.
+
+        Per feature a song inside the range scores between 1 (center) and
+        1 - GRADED_EDGE_PENALTY (edge), outside it keeps that edge score divided
+        by 1 + its distance to the range in standard deviations. The score is
+        the weighted sum over the features, weights default to 1, missing
+        values score 0. Evaluated one cache-sized chunk of a feature column at
+        a time, through numexpr when it's installed and there are cores to
+        spread it over. Without rows the result is this thread's scoring
+        buffer, overwritten by the next call.
+        """
+        features = [f for f in feature_ranges if f in self.columns]
+        scales = self.feature_scales()
+        n = len(self) if rows is None else len(rows)
+        scores = self._scratch()[0] if rows is None else np.empty(n, dtype=np.float32)
+        scores.fill(0)
+
+        terms = []
+        for feature in features:
+            min_val, max_val = feature_ranges[feature]
+            weight = 1.0 if weights is None else weights.get(feature, 0.0)
+            if weight:
+                terms.append((self.columns[feature], {
+                    'center': np.float32((min_val + max_val) / 2),
+                    'half': np.float32(max((max_val - min_val) / 2, 1e-6)),
+                    'inv_scale': np.float32(1 / scales[self.feature_names.index(feature)]),
+                    'weight': np.float32(weight),
+                    'edge': np.float32(self.GRADED_EDGE_PENALTY)
+                }))
+
+        for start in range(0, n, chunk_size):
+            end = min(start + chunk_size, n)
+            total = scores[start:end]
+            for column, params in terms:
+                x = column[start:end] if rows is None else column[rows[start:end]]
+                if USE_NUMEXPR:
+                    numexpr.evaluate(GRADED_EXPRESSION, local_dict=dict(params, x=x, total=total), out=total)
+                    continue
+                distance = np.abs(x - params['center'])
+                half = params['half']
+                score = (1 - params['edge'] * np.minimum(distance / half, 1)) / (
+                    1 + np.maximum(distance - half, 0) * params['inv_scale'])
+                # NaN feature values score 0 (fmax ignores the NaN)
+                np.fmax(score, 0, out=score)
+                score *= params['weight']
+                total += score
+        return scores
+
+    def top_k_graded(self, feature_ranges: Dict[str, Tuple[float, float]], k: int,
+                     weights: Dict[str, float] = None, rows: np.ndarray = None,
+                     partition: str = None) -> np.ndarray:
+        """Row ids of the k songs with the best graded score, ties in row order"""
+        if partition is not None:
+            rows = self.partitions[partition]
+        if rows is None:
+            return top_k(self.graded_scores(feature_ranges, weights), k)
+        rows = np.asarray(rows)
+        return rows[top_k(self.graded_scores(feature_ranges, weights, rows), k)]
+
+    def range_mask(self, feature_ranges: Dict[str, Tuple[float, float]]) -> np.ndarray:
+        """Boolean mask of the songs that fall into every one of the ranges"""
+        mask = np.ones(len(self), dtype=bool)
+        for feature, (min_val, max_val) in feature_ranges.items():
+            column = self.columns[feature]
+            mask &= (column >= np.float32(min_val)) & (column <= np.float32(max_val))
+        return mask
+
+    def song(self, row: int) -> Dict:
+        song = {
+            "track_name": self.track_names[row],
+            "artist_name": self.artist_names[row]
+        }
+        for name in self.RESULT_COLUMNS:
+            if name not in self.columns:
+                continue
+            # go through str() so 0.7 comes back as 0.7 rather than its float32 expansion
+            song[name] = float(str(self.columns[name][row]))
+        return song
@@ -0,0 +1,101 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+import numpy as np
+
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from src.example_inputs import EXAMPLE_INPUTS
+from src.models.feature_matcher import FeatureMatcher
+from src.models.model_registry import get_scenario_processor
+from src.models.range_regressor import RangeRegressor, accuracy_report
+
+# free text like the users type, none of it among the mapped scenarios: the cross-validation only
+# sees mapped scenarios (and their masked variants), these show how the model does on real inputs
+HELD_OUT_INPUTS = EXAMPLE_INPUTS + [
+    "cleaning the house on a saturday",
+    "can't sleep, lying in bed at 3am",
+    "angry after an argument",
+    "romantic dinner for two",
+    "painting in my studio in the afternoon",
+    "hiking up a mountain with my partner",
+    "waking up slowly with a coffee",
+    "heartbroken and alone tonight",
+    "gaming with friends late at night",
+    "meditating before bed"
+]
+
+def held_out_report(processor, matcher: FeatureMatcher, model: RangeRegressor, texts: List[str]) -> Dict:
+    """Accuracy of a trained model on input texts it never saw, against the blended ranges"""
+    scenarios = processor.process_user_inputs(texts)
+    return accuracy_report(matcher.blend_range_arrays(scenarios), model.predict(scenarios), matcher.feature_names)
+
+def cross_validate(matcher: FeatureMatcher, scenarios: List[Dict], groups: np.ndarray, folds: int = 5,
+                   alpha: float = 1.0, use_embedding: bool = True) -> Dict:
+    """
+    Accuracy of the regressor on scenarios it wasn't trained on. Variants of
+    the same text share a group and always land in the same fold.
+    """
+    expected = matcher.blend_range_arrays(scenarios)
+    ranges = np.empty_like(expected[0])
+    weights = np.empty_like(expected[1])
+    fold = groups % folds
+    for i in range(folds):
+        train = np.flatnonzero(fold != i)
+        test = np.flatnonzero(fold == i)
+        model = RangeRegressor.fit(matcher, [scenarios[j] for j in train], alpha, use_embedding)
+        ranges[test], weights[test] = model.predict([scenarios[j] for j in test])
+    return accuracy_report(expected, (ranges, weights), matcher.feature_names)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Train the linear model that maps scenarios straight to feature ranges")
+    parser.add_argument("--model", default=None, help="model name (default: ScenarioProcessor.MODEL_NAME)")
+    parser.add_argument("--backend", default='torch', help="embedding backend the regressor is trained for")
+    parser.add_argument("--alpha", type=float, default=1.0, help="ridge regularization strength")
+    parser.add_argument("--categories-only", action="store_true",
+                        help="use only the extracted categories, not the embedding")
+    parser.add_argument("--inputs", default=None, help="file with one extra input text per line to train on")
+    parser.add_argument("--folds", type=int, default=5, help="cross-validation folds for the report (0 to skip)")
+    parser.add_argument("--held-out", default=None,
+                        help="file with one input text per line to report on, never trained on "
+                             "(default: HELD_OUT_INPUTS)")
+    parser.add_argument("--out", default=None, help="where to save the model (default: data/cache/range_regressor/)")
+    args = parser.parse_args()
+
+    processor = get_scenario_processor(args.model, args.backend)
+    matcher = FeatureMatcher(processor)
+    use_embedding = not args.categories_only
+
+    scenarios = RangeRegressor.training_scenarios(matcher)
+    # the masked variants of a mapped scenario are one group
+    n_variants = len(scenarios) // len(matcher.scenario_mappings)
+    groups = np.arange(len(scenarios)) // n_variants
+    held_out = HELD_OUT_INPUTS
+    if args.held_out:
+        with open(args.held_out, 'r', encoding='utf-8') as f:
+            held_out = [line.strip() for line in f if line.strip()]
+    if args.inputs:
+        with open(args.inputs, 'r', encoding='utf-8') as f:
+            texts = [line.strip() for line in f if line.strip()]
+        # a held-out text that is also trained on says nothing about unseen inputs
+        trained = {text.lower() for text in texts}
+        held_out = [text for text in held_out if text.lower() not in trained]
+        scenarios += processor.process_user_inputs(texts)
+        groups = np.concatenate([groups, groups.max() + 1 + np.arange(len(texts))])
+
+    if args.folds > 1:
+        report = cross_validate(matcher, scenarios, groups, args.folds, args.alpha, use_embedding)
+        print("Cross-validation:", json.dumps(report, indent=2))
+
+    start = time.time()
+    model = RangeRegressor.fit(matcher, scenarios, args.alpha, use_embedding)
+    out = args.out or RangeRegressor.default_path(processor.embedding_name)
+    model.save(str(out))
+    print(f"Trained on {len(scenarios)} scenarios in {time.time() - start:.1f}s, saved to {out}")
+    if held_out:
+        print("Held-out inputs:", json.dumps(held_out_report(processor, matcher, model, held_out), indent=2))
@@ -1,10 +1,15 @@
+import os
 from flask import Flask
-from .routes import main
+from .routes import main, warmup
 
 def create_app():
     app = Flask(__name__)
     
     # Register blueprints
     app.register_blueprint(main)
+
+    # load the model and catalog in the background, WARMUP_ON_START=0 waits for the first request
+    if os.environ.get('WARMUP_ON_START', '1') != '0':
+        warmup.start()
     
-    return app
\ No newline at end of file
+    return app
@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify, render_template
 import sys
 import os
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from pathlib import Path
 
 # i had trouble with accessing my project paths, so I had to manually add the path
@@ -8,23 +9,102 @@ project_root = Path(__file__).resolve().parent.parent.parent.parent
 sys.path.append(str(project_root))
 
 from src.models.song_recommender import SongRecommender
+from src.webapp.pipeline import PipelineFull
+from src.webapp.warmup import RecommenderWarmup
 
 main = Blueprint('main', __name__)
-recommender = SongRecommender()  # Initialize the recommender
+# the recommender is built in the background (see create_app), or on the first request
+warmup = RecommenderWarmup()
+REQUEST_TIMEOUT = float(os.environ.get('REQUEST_TIMEOUT', 30))
+# the most songs one request can ask for, top_n is clamped to 1..MAX_TOP_N
+MAX_TOP_N = int(os.environ.get('MAX_TOP_N', 100))
+
+def _busy(message: str, **extra):
+    # clients and load balancers should retry shortly
+    return jsonify({'error': message, **extra}), 503, {'Retry-After': '1'}
+
+def _top_n(value) -> int:
+    """top_n from the request clamped to 1..MAX_TOP_N, ValueError when it isn't a number"""
+    try:
+        top_n = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"top_n must be a number, got {value!r}")
+    return min(max(top_n, 1), MAX_TOP_N)
 
 @main.route('/')
 def index():
-    # Pass available genres to the template
-    genres = recommender.get_available_genres()
+    # Pass available genres to the template, known without loading anything
+    genres = list(SongRecommender.GENRE_PROFILES.keys())
     return render_template('index.html', genres=genres)
 
 @main.route('/recommend', methods=['POST'])
 def recommend():
+    if not warmup.ready:
+        warmup.start()
+        return _busy('Recommender is still loading', progress=warmup.progress())
+
     data = request.json
     user_input = data.get('input')
-    top_n = data.get('top_n', 10)
+    try:
+        top_n = _top_n(data.get('top_n', 10))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     genre = data.get('genre')  # Get genre from request
 
-    # Call the recommender with genre
-    recommendations = recommender.recommend_songs(user_input, genre=genre, top_n=top_n)
-    return jsonify(recommendations)
\ No newline at end of file
+    # Call the recommender with genre, through the worker pools
+    try:
+        recommendations = warmup.pipeline.recommend(user_input, genre=genre, top_n=top_n, timeout=REQUEST_TIMEOUT)
+    except (PipelineFull, FutureTimeoutError):
+        # shed load instead of queueing
+        return _busy('Server busy, try again shortly')
+    return jsonify(recommendations)
+
+@main.route('/similar')
+def similar():
+    """Songs that sound like ?track= (optionally ?artist=), closest first"""
+    if not warmup.ready:
+        warmup.start()
+        return _busy('Recommender is still loading', progress=warmup.progress())
+
+    track = request.args.get('track')
+    if not track:
+        return jsonify({'error': 'track is required'}), 400
+    artist = request.args.get('artist') or None
+    try:
+        top_n = _top_n(request.args.get('top_n', 10))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if warmup.recommender.backend != 'memory':
+        # the similarity index is built from the in-memory catalog
+        return jsonify({'error': "Similar songs need the 'memory' backend"}), 501
+
+    try:
+        songs = warmup.pipeline.similar(track, artist=artist, top_n=top_n, timeout=REQUEST_TIMEOUT)
+    except KeyError:
+        return jsonify({'error': 'Unknown track', 'track': track, 'artist': artist}), 404
+    except (PipelineFull, FutureTimeoutError):
+        return _busy('Server busy, try again shortly')
+    return jsonify(songs)
+
+@main.route('/healthz')
+def healthz():
+    """Liveness: the process is up and serving, whether or not the model is loaded"""
+    return jsonify({'status': 'ok', 'warmup': warmup.state})
+
+@main.route('/readyz')
+def readyz():
+    """Readiness: 200 once the recommender can answer requests, 503 with warmup progress until then"""
+    progress = warmup.progress()
+    return jsonify(progress), 200 if warmup.ready else 503
+
+@main.route('/metrics')
+def metrics():
+    if not warmup.ready:
+        return jsonify({'warmup': warmup.progress()})
+    stats = warmup.pipeline.stats()
+    stats['warmup'] = warmup.progress()
+    stats['scenario_cache'] = warmup.recommender.scenario_cache.stats()
+    batcher = warmup.recommender.scenario_processor.batcher
+    if batcher is not None:
+        stats['embedding_batches'] = batcher.stats()
+    return jsonify(stats)
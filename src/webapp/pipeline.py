@@ -0,0 +1,151 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List
+
+class PipelineFull(Exception):
+    """Raised when too many requests are already waiting, the caller should answer 503"""
+
+
+class RequestPipeline:
+    """
+    Runs recommendation requests in two stages on bounded thread pools.
+
+    The embedding stage (tokenizer + transformer forward pass) gets a few
+    workers that split the cores between them through torch's intra-op
+    threads, the scoring stage (numpy over the catalog, which releases the
+    GIL) gets its own workers so cheap requests and cache hits never wait
+    behind a forward pass. At most max_pending requests are in flight, the
+    rest are rejected right away instead of queueing up tail latency.
+    """
+
+    def __init__(self, recommender, embed_workers: int = None, score_workers: int = None,
+                 max_pending: int = 64, torch_threads: int = None):
+        n_cpus = os.cpu_count() or 1
+        self.recommender = recommender
+        self.embed_workers = embed_workers or max(1, min(4, n_cpus // 2))
+        self.score_workers = score_workers or n_cpus
+        self.max_pending = max_pending
+        # every embed worker runs its forward pass on its own share of the cores
+        self.torch_threads = torch_threads or max(1, n_cpus // self.embed_workers)
+        self._set_torch_threads(self.torch_threads)
+
+        self._embed_pool = ThreadPoolExecutor(self.embed_workers, thread_name_prefix="embed")
+        self._score_pool = ThreadPoolExecutor(self.score_workers, thread_name_prefix="score")
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+        self._lock = threading.Lock()
+        self._counts = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0, 'cache_hits': 0}
+        self._in_flight = 0
+
+    @staticmethod
+    def _set_torch_threads(n_threads: int):
+        try:
+            import torch
+        except ImportError:
+            return
+        torch.set_num_threads(n_threads)
+
+    def _count(self, name: str, delta: int = 1):
+        with self._lock:
+            self._counts[name] += delta
+
+    def _start(self) -> Future:
+        """Take a slot for a new request, or raise PipelineFull"""
+        if not self._slots.acquire(blocking=False):
+            self._count('rejected')
+            raise PipelineFull(f"{self.max_pending} requests already in flight")
+
+        with self._lock:
+            self._counts['submitted'] += 1
+            self._in_flight += 1
+        result = Future()
+        # mark it running so callers can't cancel it halfway through the stages
+        result.set_running_or_notify_cancel()
+        return result
+
+    def submit(self, user_input: str, genre: str = None, top_n: int = 10) -> Future:
+        """Queue a request, returns a future of the recommendations or raises PipelineFull"""
+        result = self._start()
+        try:
+            feature_ranges = self.recommender.cached_scenario(user_input)
+            if feature_ranges is not None:
+                # known input: skip the embedding stage entirely
+                self._count('cache_hits')
+                self._rank(feature_ranges, genre, top_n, result)
+            else:
+                # the miss is already counted, resolving must not count a second one
+                embedded = self._embed_pool.submit(self.recommender.resolve_scenario, user_input, cache_checked=True)
+                embedded.add_done_callback(lambda f: self._on_resolved(f, genre, top_n, result))
+        except Exception as e:
+            self._finish(result, error=e)
+        return result
+
+    def submit_similar(self, track: str, artist: str = None, top_n: int = 10) -> Future:
+        """Queue a similar songs lookup on the scoring workers, same slots as submit"""
+        result = self._start()
+        try:
+            similar = self._score_pool.submit(self.recommender.similar_songs, track, artist, top_n)
+            similar.add_done_callback(lambda f: self._finish(result, *self._outcome(f)))
+        except Exception as e:
+            self._finish(result, error=e)
+        return result
+
+    def _on_resolved(self, embedded: Future, genre: str, top_n: int, result: Future):
+        try:
+            feature_ranges = embedded.result()
+        except Exception as e:
+            self._finish(result, error=e)
+            return
+        try:
+            self._rank(feature_ranges, genre, top_n, result)
+        except RuntimeError as e:
+            # score pool already shut down
+            self._finish(result, error=e)
+
+    def _rank(self, feature_ranges: Dict, genre: str, top_n: int, result: Future):
+        ranked = self._score_pool.submit(self.recommender.rank_songs, feature_ranges, genre, top_n)
+        ranked.add_done_callback(lambda f: self._finish(result, *self._outcome(f)))
+
+    @staticmethod
+    def _outcome(future: Future):
+        try:
+            return future.result(), None
+        except Exception as e:
+            return None, e
+
+    def _finish(self, result: Future, value=None, error: Exception = None):
+        # give the slot back before waking the caller, so its next request finds it free
+        with self._lock:
+            self._in_flight -= 1
+            self._counts['failed' if error is not None else 'completed'] += 1
+        self._slots.release()
+        if error is not None:
+            result.set_exception(error)
+        else:
+            result.set_result(value)
+
+    def recommend(self, user_input: str, genre: str = None, top_n: int = 10,
+                  timeout: float = None) -> List[Dict]:
+        """Blocking version of submit for request handlers"""
+        return self.submit(user_input, genre, top_n).result(timeout)
+
+    def similar(self, track: str, artist: str = None, top_n: int = 10, timeout: float = None) -> List[Dict]:
+        """Blocking version of submit_similar"""
+        return self.submit_similar(track, artist, top_n).result(timeout)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counts)
+            stats['in_flight'] = self._in_flight
+        stats.update({
+            'max_pending': self.max_pending,
+            'embed_workers': self.embed_workers,
+            'score_workers': self.score_workers,
+            'torch_threads': self.torch_threads
+        })
+        return stats
+
+    def shutdown(self, wait: bool = True):
+        self._embed_pool.shutdown(wait=wait)
+        self._score_pool.shutdown(wait=wait)
@@ -0,0 +1,160 @@
+import os
+import threading
+import time
+import warnings
+from typing import Callable, Dict, List, Tuple
+
+class RecommenderWarmup:
+    """
+    Builds the recommender and its request pipeline on a background thread.
+
+    Loading the model, embedding the scenarios and reading the catalog takes a
+    while, so the web app starts serving (health checks, the index page) right
+    away and reports progress until everything is loaded. Nothing heavy is
+    imported before start() is called.
+    """
+
+    def __init__(self, config: Dict[str, str] = None):
+        # pipeline / model settings, read from the environment by default
+        self.config = dict(os.environ if config is None else config)
+        self.recommender = None
+        self.pipeline = None
+
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread = None
+        self.state = 'idle'
+        self.step = None
+        self.completed = []
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._scenario_processor = None
+        self._feature_matcher = None
+
+    def _setting(self, name: str, default, cast=int):
+        value = self.config.get(name)
+        return default if value in (None, '') else cast(value)
+
+    def _steps(self) -> List[Tuple[str, Callable]]:
+        return [
+            ('imports', self._import_libraries),
+            ('scenario_model', self._load_scenario_model),
+            ('scenario_embeddings', self._load_feature_matcher),
+            ('catalog', self._load_catalog),
+            ('similarity_index', self._load_similarity_index),
+            ('pipeline', self._start_pipeline)
+        ]
+
+    def _import_libraries(self):
+        import torch  # noqa: F401
+        import transformers  # noqa: F401
+
+    def _load_scenario_model(self):
+        from src.models.model_registry import get_scenario_processor
+        self._scenario_processor = get_scenario_processor()
+
+        # concurrent requests share forward passes, MICRO_BATCH_SIZE=0 turns it off
+        micro_batch_size = self._setting('MICRO_BATCH_SIZE', 16)
+        if micro_batch_size > 0 and self._scenario_processor.batcher is None:
+            self._scenario_processor.enable_micro_batching(
+                max_batch_size=micro_batch_size,
+                max_wait_ms=self._setting('MICRO_BATCH_WAIT_MS', 5.0, float)
+            )
+
+    def _load_feature_matcher(self):
+        from src.models.feature_matcher import FeatureMatcher
+        self._feature_matcher = FeatureMatcher(self._scenario_processor)
+        # trained with src/train_range_regressor.py, replaces the similarity blending
+        regressor_path = self._setting('RANGE_REGRESSOR', None, str)
+        if regressor_path:
+            from src.models.range_regressor import RangeRegressor
+            self._feature_matcher.use_range_regressor(RangeRegressor.load(regressor_path))
+
+    def _load_catalog(self):
+        from src.models.song_recommender import SongRecommender
+        recommender = SongRecommender(
+            self._scenario_processor,
+            self._feature_matcher,
+            backend=self._setting('RECOMMENDER_BACKEND', 'memory', str),
+            snapshot_path=self._setting('CATALOG_SNAPSHOT', None, str),
+            scoring=self._setting('RECOMMENDER_SCORING', 'count', str)
+        )
+        if recommender.backend == 'memory':
+            recommender._get_song_store()
+        self.recommender = recommender
+
+    def _load_similarity_index(self):
+        # loaded from data/cache when the catalog hasn't changed since it was built
+        if self.recommender.backend == 'memory':
+            self.recommender._get_similarity()
+
+    def _start_pipeline(self):
+        from src.webapp.pipeline import RequestPipeline
+        micro_batching = self._scenario_processor.batcher is not None
+        # with micro-batching the embed workers mostly wait on the batcher, so there are
+        # enough of them to fill a batch and the single forward pass gets every core
+        self.pipeline = RequestPipeline(
+            self.recommender,
+            embed_workers=self._setting('EMBED_WORKERS', 0) or (
+                self._scenario_processor.batcher.max_batch_size if micro_batching else None),
+            score_workers=self._setting('SCORE_WORKERS', 0) or None,
+            max_pending=self._setting('MAX_PENDING_REQUESTS', 64),
+            torch_threads=self._setting('TORCH_THREADS', 0) or (os.cpu_count() if micro_batching else None)
+        )
+
+    def start(self) -> bool:
+        """Start warming up in the background, returns False if already started or done"""
+        with self._lock:
+            if self._thread is not None or self._ready.is_set():
+                return False
+            self.state = 'warming'
+            self.error = None
+            self.completed = []
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._run, name="recommender-warmup", daemon=True)
+            self._thread.start()
+            return True
+
+    def _run(self):
+        for name, step in self._steps():
+            self.step = name
+            step_start = time.monotonic()
+            try:
+                step()
+            except Exception as e:
+                warnings.warn(f"Recommender warmup failed at {name}: {e!r}")
+                with self._lock:
+                    self.state = 'failed'
+                    self.error = f"{name}: {e!r}"
+                    # a later start() tries again
+                    self._thread = None
+                return
+            self.completed.append({'step': name, 'seconds': round(time.monotonic() - step_start, 3)})
+
+        self.step = None
+        self.finished_at = time.time()
+        self.state = 'ready'
+        self._ready.set()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """Start warming up if needed and wait until done, returns whether it's ready"""
+        self.start()
+        return self._ready.wait(timeout)
+
+    def progress(self) -> Dict:
+        steps = [name for name, _ in self._steps()]
+        end = self.finished_at or time.time()
+        return {
+            'state': self.state,
+            'step': self.step,
+            'steps_done': len(self.completed),
+            'steps_total': len(steps),
+            'steps': self.completed,
+            'error': self.error,
+            'elapsed': round(end - self.started_at, 3) if self.started_at else None
+        }
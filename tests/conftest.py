@@ -0,0 +1,20 @@
+# tests/conftest.py
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from tests import fakes
+
+@pytest.fixture
+def fake_processor():
+    """Keyword extraction plus random 16-dim embeddings (see tests/fakes.py)"""
+    return fakes.FakeProcessor()
+
+@pytest.fixture
+def make_db(tmp_path):
+    """Builds a small catalog database under tmp_path, returns its path (see fakes.make_db)"""
+    def factory(name="extracted.db", **kwargs):
+        return fakes.make_db(tmp_path / name, **kwargs)
+    return factory
@@ -0,0 +1,63 @@
+# tests/fakes.py
+
+import sqlite3
+import zlib
+import numpy as np
+
+class FakeProcessor:
+    """
+    Stands in for the ScenarioProcessor: keyword extraction plus a
+    deterministic random embedding per text, no model needed. Used by the
+    tests and by the benchmarks' --no-model runs.
+    """
+    model_name = 'fake'
+    backend_name = 'torch'
+    embedding_name = 'fake'
+    batcher = None
+
+    def __init__(self, dim: int = 16):
+        self.dim = dim
+
+    def generate_embedding(self, text):
+        return np.random.default_rng(zlib.crc32(text.encode('utf-8'))).normal(size=self.dim).astype(np.float32)
+
+    def generate_embeddings(self, texts, batch_size=32):
+        return np.stack([self.generate_embedding(text) for text in texts])
+
+    def process_user_input(self, text):
+        from src.models.scenario_processor import ScenarioProcessor
+        features = ScenarioProcessor.keyword_matcher().extract(text.lower())
+        features['raw_text'] = text.lower()
+        features['embedding'] = self.generate_embedding(text.lower())
+        return features
+
+    def process_user_inputs(self, texts, batch_size=32):
+        return [self.process_user_input(text) for text in texts]
+
+def make_db(path, n=3000, seed=0, updated_at=None):
+    """
+    Small 'extracted' table with the columns the recommender reads: every
+    50th song has no danceability (filtered out), every 33rd no tempo (kept),
+    every 41st no artist. With updated_at every row gets that value in an
+    updated_at column.
+    """
+    rng = np.random.default_rng(seed)
+    conn = sqlite3.connect(path)
+    extra = ", updated_at INTEGER" if updated_at is not None else ""
+    conn.execute(f"""CREATE TABLE extracted (track_id TEXT, track_name TEXT, artist_name TEXT,
+        danceability REAL, energy REAL, valence REAL, tempo REAL, acousticness REAL,
+        instrumentalness REAL, speechiness REAL{extra})""")
+    rows = []
+    for i in range(n):
+        features = np.round(rng.random(7), 1).tolist()
+        features[3] = round(float(rng.normal(115, 25)), 1)
+        if i % 50 == 0:
+            features[0] = None
+        if i % 33 == 0:
+            features[3] = None
+        row = (f"T{i}", f"tråck {i}", None if i % 41 == 0 else f"artist {i % 97}", *features)
+        rows.append(row if updated_at is None else row + (updated_at,))
+    conn.executemany(f"INSERT INTO extracted VALUES ({', '.join('?' * len(rows[0]))})", rows)
+    conn.commit()
+    conn.close()
+    return str(path)
@@ -1,7 +1,7 @@
-from src.models.scenario_processor import ScenarioProcessor
+from src.models.model_registry import get_scenario_processor
 
 def test_scenario_proceessor():
-    processor = ScenarioProcessor()
+    processor = get_scenario_processor()
 
     test_scenarios = [
         "I'm working out from home in the morning, feeling focused", 
@@ -0,0 +1,51 @@
+# tests/test_benchmarks.py
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import numpy as np
+import pytest
+from benchmarks.run_benchmarks import compare, run_benchmarks
+from benchmarks.synthetic_catalog import generate_catalog
+from src.database.db_manager import DatabaseManager
+from src.models.song_store import SongStore
+
+def test_synthetic_catalog(tmp_path):
+    db_path = str(tmp_path / "catalog.db")
+    n_songs = generate_catalog(db_path, 5000, seed=1, missing_rate=0.02)
+    # songs with a NULL in a filtered feature are dropped, the rest kept
+    assert 4800 < n_songs < 5000
+
+    store = SongStore.from_database(DatabaseManager(db_path))
+    assert len(store) == n_songs
+    for feature in ('danceability', 'energy', 'valence', 'acousticness', 'instrumentalness', 'speechiness'):
+        values = store.columns[feature]
+        assert np.nanmin(values) >= 0 and np.nanmax(values) <= 1
+    assert 100 < np.nanmedian(store.columns['tempo']) < 140
+    # energy and acousticness pull in opposite directions like in real catalogs
+    valid = ~np.isnan(store.columns['energy']) & ~np.isnan(store.columns['acousticness'])
+    assert np.corrcoef(store.columns['energy'][valid], store.columns['acousticness'][valid])[0, 1] < -0.2
+
+    with pytest.raises(FileExistsError):
+        generate_catalog(db_path, 10)
+
+def test_run_benchmarks(tmp_path):
+    db_path = str(tmp_path / "catalog.db")
+    generate_catalog(db_path, 3000)
+    results = run_benchmarks(db_path, n_queries=10, warmup=2, use_model=False)
+    # the results are meant to be kept and compared between commits
+    results = json.loads(json.dumps(results))
+
+    assert results['config']['songs'] > 2900
+    stages = results['stages']
+    for stage in ('db_load', 'range_index', 'genre_partitions', 'feature_ranges', 'genre_filter',
+                  'scoring', 'top_k', 'recommend'):
+        assert stages[stage]['p50_ms'] <= stages[stage]['p99_ms']
+    assert stages['scoring']['n'] == 10 and stages['genre_filter']['n'] == 5
+    assert 'embedding' not in stages
+    assert stages['db_load']['throughput_per_s'] > 0
+
+    lines = compare(results, results)
+    assert len(lines) == len(stages) and all('(1.00x)' in line for line in lines)
@@ -1,16 +1,17 @@
-from src.models.scenario_processor import ScenarioProcessor
+from src.models.model_registry import get_scenario_processor
 from src.models.feature_matcher import FeatureMatcher
 from src.database.db_manager import DatabaseManager
 
 
 #test scnario processor
 user_input = "I'm working out with friends in the late evening."
-scenario_features = ScenarioProcessor().process_user_input(user_input)
+scenario_processor = get_scenario_processor()
+scenario_features = scenario_processor.process_user_input(user_input)
 print("Processed Scenario Features:")
 print(scenario_features)
 
 #test feature matcher
-feature_ranges = FeatureMatcher().get_feature_ranges(scenario_features)
+feature_ranges = FeatureMatcher(scenario_processor).get_feature_ranges(scenario_features)
 print("Feature Ranges:")
 print(feature_ranges)
 
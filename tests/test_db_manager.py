@@ -0,0 +1,119 @@
+# tests/test_db_manager.py
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import threading
+import numpy as np
+from src.database.db_manager import DatabaseManager
+from src.models.song_store import SongStore
+
+def test_streaming_matches_dataframe(tmp_path, make_db):
+    db_manager = DatabaseManager(make_db())
+    song_data = db_manager.get_song_features()
+
+    chunks = list(db_manager.iter_song_features(['track_name', 'energy'], chunk_size=500))
+    assert [len(c['energy']) for c in chunks][:-1] == [500] * (len(chunks) - 1)
+    assert chunks[0]['energy'].dtype == np.float32
+    assert sum(len(c['track_name']) for c in chunks) == len(song_data)
+
+    counts = db_manager.count_song_features()
+    assert counts['rows'] == len(song_data)
+    assert counts['track_name'] == sum(len(s.encode('utf-8')) for s in song_data['track_name'])
+
+    streamed = SongStore.from_database(db_manager, chunk_size=700)
+    expected = SongStore.from_dataframe(song_data)
+    np.testing.assert_array_equal(streamed.features, expected.features)
+    assert streamed.track_names.tolist() == expected.track_names.tolist()
+    assert streamed.artist_names.tolist() == expected.artist_names.tolist()
+
+def test_column_projection(tmp_path, make_db):
+    db_manager = DatabaseManager(make_db())
+    store = SongStore.from_database(db_manager, feature_names=['energy', 'tempo'], limit=100)
+    assert store.feature_names == ['energy', 'tempo']
+    assert len(store) == 100
+    assert set(store.song(0)) == {'track_name', 'artist_name', 'energy', 'tempo'}
+
+def test_pooled_read_only_connections(tmp_path, make_db):
+    db_manager = DatabaseManager(make_db())
+
+    conn = db_manager.get_connection()
+    assert db_manager.get_connection() is conn
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(db_manager.get_connection()))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+
+    try:
+        conn.execute("DELETE FROM extracted")
+        assert False, "pooled connections should be read-only"
+    except sqlite3.OperationalError:
+        pass
+
+    db_manager.close()
+    assert db_manager.get_connection() is not conn
+
+def test_migration_runs_once(tmp_path, make_db):
+    db_path = make_db()
+    DatabaseManager(db_path)
+
+    conn = sqlite3.connect(db_path)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    indices = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+    journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    # drop an index, a second manager must not recreate it since the migration already ran
+    conn.execute("DROP INDEX idx_energy")
+    conn.commit()
+    conn.close()
+
+    assert version == DatabaseManager.SCHEMA_VERSION
+    assert 'idx_energy' in indices
+    assert journal_mode == 'wal'
+
+    DatabaseManager(db_path)
+    conn = sqlite3.connect(db_path)
+    indices = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+    conn.close()
+    assert 'idx_energy' not in indices
+
+def test_migrated_database_opened_read_only(tmp_path, monkeypatch, make_db):
+    db_path = make_db()
+    DatabaseManager(db_path)
+
+    uris = []
+    connect = sqlite3.connect
+    monkeypatch.setattr(sqlite3, 'connect',
+                        lambda path, *args, **kwargs: uris.append(path) or connect(path, *args, **kwargs))
+    DatabaseManager(db_path).get_connection()
+    assert uris and all(uri.endswith('mode=ro') for uri in uris)
+
+def test_sql_scoring_matches_memory(tmp_path, make_db):
+    db_manager = DatabaseManager(make_db())
+    store = SongStore.from_database(db_manager)
+    feature_ranges = {'energy': (0.4, 0.7), 'valence': (0.5, 0.7), 'tempo': (90.0, 120.0),
+                      'acousticness': (0.6, 0.9), 'loudness': (-10.0, 0.0)}
+    genre_ranges = {'danceability': (0.6, 1.0), 'energy': (0.3, 1.0)}
+
+    top = db_manager.get_top_scored_songs(feature_ranges, top_n=20)
+    expected = [store.song(row) for row in store.top_k(feature_ranges, 20)]
+    assert [s['track_name'] for s in top] == [s['track_name'] for s in expected]
+    assert set(top[0]) == set(expected[0])
+
+    rows = np.flatnonzero(store.range_mask(genre_ranges))
+    top = db_manager.get_top_scored_songs(feature_ranges, genre_ranges, top_n=20)
+    expected = [store.song(row) for row in store.top_k(feature_ranges, 20, rows=rows)]
+    assert [s['track_name'] for s in top] == [s['track_name'] for s in expected]
+
+def test_sql_scoring_bounds_match_memory(tmp_path, make_db):
+    db_manager = DatabaseManager(make_db())
+    store = SongStore.from_database(db_manager)
+    # bounds right on stored values, as doubles and as the float32 the in-memory ranges hold
+    for bound in (0.3, float(np.float32(0.3)), float(np.nextafter(np.float32(0.3), np.float32(1)))):
+        feature_ranges = {'energy': (bound, 0.5), 'valence': (0.2, bound)}
+        top = db_manager.get_top_scored_songs(feature_ranges, top_n=200)
+        expected = [store.song(row) for row in store.top_k(feature_ranges, 200)]
+        assert [s['track_name'] for s in top] == [s['track_name'] for s in expected]
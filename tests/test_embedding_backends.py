@@ -0,0 +1,63 @@
+# tests/test_embedding_backends.py
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import copy
+import numpy as np
+import pytest
+import torch
+from transformers import RobertaConfig, RobertaModel
+from src.models.embedding_backends import TorchBackend, QuantizedTorchBackend, OnnxBackend, load_backend
+
+def tiny_model():
+    # random weights, no download needed
+    torch.manual_seed(0)
+    config = RobertaConfig(vocab_size=100, hidden_size=64, num_hidden_layers=2,
+                           num_attention_heads=4, intermediate_size=128)
+    return RobertaModel(config).eval()
+
+def padded_batch():
+    rng = np.random.default_rng(0)
+    input_ids = rng.integers(3, 100, size=(4, 12)).astype(np.int64)
+    attention_mask = np.ones_like(input_ids)
+    input_ids[2:, 8:] = 1
+    attention_mask[2:, 8:] = 0
+    return input_ids, attention_mask
+
+def cosine(a, b):
+    return (a * b).sum(axis=1) / np.linalg.norm(a, axis=1) / np.linalg.norm(b, axis=1)
+
+def test_quantized_backend_close_to_torch():
+    model = tiny_model()
+    input_ids, attention_mask = padded_batch()
+    expected = TorchBackend(copy.deepcopy(model)).embed(input_ids, attention_mask)
+    actual = QuantizedTorchBackend(model).embed(input_ids, attention_mask)
+
+    assert expected.shape == actual.shape == (4, 64)
+    assert actual.dtype == np.float32
+    assert cosine(expected, actual).min() > 0.99
+
+def test_padding_does_not_change_embeddings():
+    backend = TorchBackend(tiny_model())
+    input_ids, attention_mask = padded_batch()
+    batched = backend.embed(input_ids, attention_mask)
+    alone = backend.embed(input_ids[2:3, :8], attention_mask[2:3, :8])
+    np.testing.assert_allclose(batched[2:3], alone, atol=1e-5)
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        load_backend('tensorrt', 'distilroberta-base')
+
+def test_onnx_backend_matches_torch(tmp_path):
+    pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    model = tiny_model()
+    input_ids, attention_mask = padded_batch()
+    expected = TorchBackend(copy.deepcopy(model)).embed(input_ids, attention_mask)
+
+    path = tmp_path / "tiny.onnx"
+    OnnxBackend.export(model, path)
+    actual = OnnxBackend(str(path), 64).embed(input_ids, attention_mask)
+    np.testing.assert_allclose(actual, expected, atol=1e-4)
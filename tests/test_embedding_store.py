@@ -0,0 +1,59 @@
+# tests/test_embedding_store.py
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+from src.models.embedding_store import ScenarioEmbeddingStore, atomic_write
+
+CATEGORIES = {
+    'mood': ['happy', 'sad'],
+    'activity': ['working'],
+    'time': ['morning'],
+    'social': ['alone']
+}
+TEMPLATE = "{activity} in the {time}, feeling {mood}, {social}"
+TEXTS = ["working in the morning, feeling happy, alone",
+         "working in the morning, feeling sad, alone"]
+
+def test_round_trip(tmp_path):
+    store = ScenarioEmbeddingStore(str(tmp_path))
+    key = store.make_key('distilroberta-base', CATEGORIES, TEMPLATE)
+    assert store.load(key, TEXTS) is None
+
+    embeddings = np.random.rand(2, 768).astype(np.float32)
+    store.save(key, embeddings, TEXTS, 'distilroberta-base')
+
+    loaded = store.load(key, TEXTS)
+    assert isinstance(loaded, np.memmap)
+    np.testing.assert_array_equal(loaded, embeddings)
+
+def test_key_changes_invalidate(tmp_path):
+    store = ScenarioEmbeddingStore(str(tmp_path))
+    key = store.make_key('distilroberta-base', CATEGORIES, TEMPLATE)
+    store.save(key, np.zeros((2, 4), dtype=np.float32), TEXTS, 'distilroberta-base')
+
+    assert store.make_key('roberta-base', CATEGORIES, TEMPLATE) != key
+    assert store.make_key('distilroberta-base', CATEGORIES, "{mood} {activity}") != key
+    reordered = dict(CATEGORIES, mood=['sad', 'happy'])
+    assert store.make_key('distilroberta-base', reordered, TEMPLATE) != key
+
+    # texts that don't match the saved metadata are treated as a miss
+    assert store.load(key, TEXTS[:1]) is None
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / "cache" / "matrix.npy"
+    with atomic_write(path) as tmp:
+        assert tmp.suffix == ".npy" and tmp.parent == path.parent
+        np.save(tmp, np.arange(3))
+    assert np.load(path).tolist() == [0, 1, 2]
+
+    # a failed write leaves the old file and no temp file behind
+    with pytest.raises(RuntimeError):
+        with atomic_write(path) as tmp:
+            np.save(tmp, np.arange(5))
+            raise RuntimeError("interrupted")
+    assert np.load(path).tolist() == [0, 1, 2]
+    assert list(path.parent.iterdir()) == [path]
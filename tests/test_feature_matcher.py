@@ -4,13 +4,13 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from src.models.scenario_processor import ScenarioProcessor
 from src.models.feature_matcher import FeatureMatcher
+from src.models.model_registry import get_scenario_processor
 
 def test_feature_matcher():
     # Initialize
-    scenario_processor = ScenarioProcessor()
-    feature_matcher = FeatureMatcher()
+    scenario_processor = get_scenario_processor()
+    feature_matcher = FeatureMatcher(scenario_processor)
     
     # Test scenarios
     test_scenarios = [
@@ -73,8 +73,8 @@ def test_feature_matcher():
 
 def test_specific_cases():
     
-    scenario_processor = ScenarioProcessor()
-    feature_matcher = FeatureMatcher()
+    scenario_processor = get_scenario_processor()
+    feature_matcher = FeatureMatcher(scenario_processor)
     
     print("\nTesting Specific Cases:")
     print("="*80)
@@ -0,0 +1,80 @@
+# tests/test_feature_ranges.py
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+from src.models.embedding_store import ScenarioEmbeddingStore
+from src.models.feature_matcher import FeatureMatcher
+
+def dict_feature_ranges(matcher, scenario_features):
+    # get_feature_ranges as it was before the range tables
+    feature_ranges = matcher._get_base_ranges(scenario_features)
+    similar_scenarios = matcher._similar_scenarios(scenario_features)
+    for feature in matcher.feature_names:
+        similar_mins = []
+        similar_maxs = []
+        for similar in similar_scenarios:
+            if feature in similar['scenario']['features']:
+                min_val, max_val = similar['scenario']['features'][feature]
+                similar_mins.append(min_val)
+                similar_maxs.append(max_val)
+            if similar_mins and similar_maxs:
+                if feature in feature_ranges:
+                    current_min, current_max = feature_ranges[feature]
+                    feature_ranges[feature] = ((current_min + np.mean(similar_mins)) / 2,
+                                               (current_max + np.mean(similar_maxs)) / 2)
+                else:
+                    feature_ranges[feature] = (np.mean(similar_mins), np.mean(similar_maxs))
+    return feature_ranges
+
+def random_scenarios(matcher, n, seed=1):
+    rng = np.random.default_rng(seed)
+    scenarios = []
+    for _ in range(n):
+        scenario = {dimension: str(rng.choice(categories + ['unspecified', 'unknown']))
+                    for dimension, categories in matcher._scenario_categories().items()}
+        scenario['embedding'] = rng.normal(size=16).astype(np.float32)
+        scenarios.append(scenario)
+    return scenarios
+
+def test_range_tables(tmp_path, fake_processor):
+    matcher = FeatureMatcher(fake_processor, ScenarioEmbeddingStore(str(tmp_path)))
+    assert matcher.base_range_table.shape == (720, len(matcher.feature_names), 2)
+    assert matcher.scenario_range_table.shape == (300, len(matcher.feature_names), 2)
+
+    scenario = {'mood': 'happy', 'activity': 'working', 'time': 'night', 'social': 'unspecified'}
+    base = matcher.base_range_table[matcher._combo_index(scenario)]
+    assert matcher.range_array_to_dict(base) == matcher._get_base_ranges(scenario)
+
+def test_blending_matches_dict_version(tmp_path, fake_processor):
+    matcher = FeatureMatcher(fake_processor, ScenarioEmbeddingStore(str(tmp_path)))
+    scenarios = random_scenarios(matcher, 200)
+
+    arrays = matcher.get_feature_range_arrays(scenarios)
+    assert arrays.shape == (200, len(matcher.feature_names), 2)
+    for scenario, ranges in zip(scenarios, arrays):
+        expected = dict_feature_ranges(matcher, scenario)
+        # same arithmetic in the same order, so the results are identical
+        assert matcher.get_feature_ranges(scenario) == {f: tuple(map(float, r)) for f, r in expected.items()}
+        assert matcher.range_array_to_dict(ranges) == matcher.get_feature_ranges(scenario)
+
+def test_feature_weights(tmp_path, fake_processor):
+    matcher = FeatureMatcher(fake_processor, ScenarioEmbeddingStore(str(tmp_path)))
+    scenarios = random_scenarios(matcher, 50)
+
+    ranges, weights = matcher.get_weighted_range_arrays(scenarios)
+    assert weights.shape == ranges.shape[:2]
+    has_range = ~np.isnan(ranges[..., 0])
+    assert (weights[~has_range] == 0).all()
+    assert (weights[has_range] > 0).all() and (weights <= 1 + 1e-6).all()
+
+    for scenario, r, w in zip(scenarios, ranges, weights):
+        base = matcher._get_base_ranges(scenario)
+        # base features weigh at least half, the others only what the similar scenarios give them
+        for feature, weight in matcher.get_feature_ranges(scenario).weights.items():
+            assert (weight >= 0.5 - 1e-6) if feature in base else (weight <= 0.5 + 1e-6)
+        # batched and single sums can round differently in float32
+        assert matcher.range_array_to_dict(r, w).weights == pytest.approx(matcher.get_feature_ranges(scenario).weights)
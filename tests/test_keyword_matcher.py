@@ -0,0 +1,61 @@
+# tests/test_keyword_matcher.py
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.models.keyword_matcher import KeywordMatcher, KeywordMatch
+from src.models.scenario_processor import ScenarioProcessor
+
+def extract(text):
+    # keyword extraction doesn't need the model
+    processor = object.__new__(ScenarioProcessor)
+    features = processor._extract_features(text)
+    assert features.pop('raw_text') == text
+    return features
+
+def test_whole_words_only():
+    assert extract("eating chocolate cake")['time'] == 'unspecified'
+    assert extract("late night coding")['time'] == 'night'
+    # plurals still match
+    assert extract("morning workouts")['activity'] == 'exercising'
+
+def test_inflections():
+    assert extract("partying all night")['activity'] == 'socializing'
+    assert extract("we partied, then more parties")['social'] == 'with_friends'
+    assert extract("exercising before work")['activity'] == 'exercising'
+    assert extract("family gatherings")['activity'] == 'socializing'
+
+def test_baseline_inputs():
+    # what the substring matching extracted for the inputs of scenario_proc_test.py
+    assert extract("i'm working out from home in the morning, feeling focused") == {
+        'time': 'morning', 'activity': 'working', 'mood': 'focused', 'social': 'with_family'}
+    assert extract("running with friends in the evening, feeling energetic") == {
+        'time': 'evening', 'activity': 'exercising', 'mood': 'energetic', 'social': 'with_friends'}
+    assert extract("ralaxing alone a night, i am feeling quite happy") == {
+        'time': 'night', 'activity': 'unspecified', 'mood': 'happy', 'social': 'alone'}
+    assert extract("i am partying with friends at midnight") == {
+        'time': 'night', 'activity': 'socializing', 'mood': 'unspecified', 'social': 'with_friends'}
+    assert extract("party with friends tonight")['time'] == 'night'
+
+def test_category_order_wins_over_position():
+    # 'working' is listed before 'exercising', like the old per-category scan
+    assert extract("gym after studying")['activity'] == 'working'
+    features = extract("happy party with friends by myself")
+    assert features == {'time': 'unspecified', 'activity': 'socializing', 'mood': 'happy', 'social': 'alone'}
+
+def test_match_positions():
+    matcher = KeywordMatcher({
+        'time': {'night': ['night', 'late']},
+        'social': {'alone': ['by myself'], 'with_friends': ['party']},
+        'activity': {'socializing': ['party']}
+    })
+    text = "Late party, by  myself"
+    assert matcher.matches(text) == [
+        KeywordMatch('time', 'night', 'late', 0, 4),
+        KeywordMatch('social', 'with_friends', 'party', 5, 10),
+        KeywordMatch('activity', 'socializing', 'party', 5, 10),
+        KeywordMatch('social', 'alone', 'by myself', 12, 22)
+    ]
+    assert matcher.extract(text) == {'time': 'night', 'social': 'alone', 'activity': 'socializing'}
+    assert matcher.extract("") == {'time': 'unspecified', 'social': 'unspecified', 'activity': 'unspecified'}
@@ -0,0 +1,49 @@
+# tests/test_lru_cache.py
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.models.lru_cache import LRUCache
+
+def test_eviction_order():
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1   # 'a' is now the most recently used
+    cache.put('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions'], stats['size']) == (3, 1, 1, 2)
+
+def test_ttl():
+    now = [0.0]
+    cache = LRUCache(maxsize=10, ttl=5.0, clock=lambda: now[0])
+    cache.put('a', 1)
+    now[0] = 4.9
+    assert cache.get('a') == 1
+    now[0] = 5.0
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+    assert len(cache) == 0
+
+def test_disabled():
+    cache = LRUCache(maxsize=0)
+    cache.put('a', 1)
+    assert cache.get('a') is None
+
+def test_peek_leaves_stats_alone():
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.peek('a') == 1
+    assert cache.peek('c') is None
+    # 'a' wasn't moved to the end, so it's still the one evicted
+    cache.put('c', 3)
+    assert cache.peek('a') is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (0, 0)
@@ -0,0 +1,95 @@
+# tests/test_micro_batcher.py
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import threading
+import pytest
+from src.models.micro_batcher import MicroBatcher
+
+def test_concurrent_items_share_a_batch():
+    calls = []
+    def batch_fn(items):
+        calls.append(list(items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(batch_fn, max_batch_size=8, max_wait_ms=200)
+    results = {}
+    def worker(i):
+        results[i] = batcher(i, timeout=5)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+
+    assert results == {i: i * 2 for i in range(8)}
+    # every item went through, in fewer calls than items
+    assert sorted(item for call in calls for item in call) == list(range(8))
+    assert len(calls) < 8
+    assert all(len(call) <= 8 for call in calls)
+
+    stats = batcher.stats()
+    assert stats['items'] == 8 and stats['batches'] == len(calls)
+    assert stats['max_seen_batch_size'] == max(len(call) for call in calls)
+
+def test_batch_size_limit_and_errors():
+    batcher = MicroBatcher(lambda items: [len(items)] * len(items), max_batch_size=3, max_wait_ms=50)
+    futures = [batcher.submit(i) for i in range(7)]
+    assert all(future.result(5) <= 3 for future in futures)
+    batcher.close()
+    with pytest.raises(RuntimeError):
+        batcher.submit(1)
+
+    def failing(items):
+        raise ValueError("model error")
+    batcher = MicroBatcher(failing, max_wait_ms=1)
+    with pytest.raises(ValueError):
+        batcher("x", timeout=5)
+    batcher.close()
+
+def test_submit_racing_close():
+    for _ in range(20):
+        batcher = MicroBatcher(lambda items: items, max_wait_ms=1)
+        futures = []
+        def worker():
+            for i in range(50):
+                try:
+                    futures.append(batcher.submit(i))
+                except RuntimeError:
+                    return
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        batcher.close()
+        for thread in threads:
+            thread.join()
+        # every accepted item is answered, none is stranded behind the stop sentinel
+        assert all(future.result(5) is not None for future in futures)
+
+def test_cancelled_future_is_skipped():
+    release = threading.Event()
+    calls = []
+    def batch_fn(items):
+        release.wait(5)
+        calls.append(list(items))
+        return items
+
+    batcher = MicroBatcher(batch_fn, max_batch_size=1, max_wait_ms=1)
+    busy = batcher.submit('busy')
+    # queued behind the batch in progress, the caller gives up on it
+    cancelled = batcher.submit('cancelled')
+    assert cancelled.cancel()
+    release.set()
+    assert busy.result(5) == 'busy'
+
+    assert batcher.submit('next').result(5) == 'next'
+    assert ['cancelled'] not in calls
+    # a running future can't be cancelled anymore
+    running = batcher.submit('running')
+    assert running.result(5) == 'running' and not running.cancel()
+    batcher.close()
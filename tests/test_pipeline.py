@@ -0,0 +1,61 @@
+# tests/test_pipeline.py
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import threading
+import pytest
+from src.webapp.pipeline import RequestPipeline, PipelineFull
+
+class FakeRecommender:
+    """Stands in for SongRecommender, resolve blocks until released"""
+    def __init__(self):
+        self.release = threading.Event()
+        self.cache = {}
+
+    def cached_scenario(self, user_input):
+        return self.cache.get(user_input)
+
+    def resolve_scenario(self, user_input, cache_checked=False):
+        self.release.wait(5)
+        if user_input == "boom":
+            raise ValueError("bad input")
+        self.cache[user_input] = {'energy': (0.0, 1.0)}
+        return self.cache[user_input]
+
+    def rank_songs(self, feature_ranges, genre=None, top_n=10):
+        return [{'track_name': f"song {i}", 'genre': genre} for i in range(top_n)]
+
+def test_pipeline_runs_both_stages():
+    recommender = FakeRecommender()
+    recommender.release.set()
+    pipeline = RequestPipeline(recommender, embed_workers=2, score_workers=2, torch_threads=1)
+
+    result = pipeline.recommend("night drive", genre='rock', top_n=3, timeout=5)
+    assert result == [{'track_name': f"song {i}", 'genre': 'rock'} for i in range(3)]
+    # second time the scenario is cached and the embedding stage is skipped
+    pipeline.recommend("night drive", top_n=1, timeout=5)
+    with pytest.raises(ValueError):
+        pipeline.recommend("boom", timeout=5)
+
+    stats = pipeline.stats()
+    assert stats['completed'] == 2 and stats['failed'] == 1
+    assert stats['cache_hits'] == 1 and stats['in_flight'] == 0
+    pipeline.shutdown()
+
+def test_pipeline_rejects_when_full():
+    recommender = FakeRecommender()
+    pipeline = RequestPipeline(recommender, embed_workers=1, score_workers=1, max_pending=2, torch_threads=1)
+
+    pending = [pipeline.submit(f"input {i}") for i in range(2)]
+    with pytest.raises(PipelineFull):
+        pipeline.submit("one too many")
+    assert pipeline.stats()['rejected'] == 1
+
+    recommender.release.set()
+    for future in pending:
+        assert len(future.result(5)) == 10
+    # slots are given back once requests finish
+    assert len(pipeline.recommend("input 3", timeout=5)) == 10
+    pipeline.shutdown()
@@ -0,0 +1,73 @@
+# tests/test_range_regressor.py
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+from src.models.embedding_store import ScenarioEmbeddingStore
+from src.models.feature_matcher import FeatureMatcher
+from src.models.range_regressor import RangeRegressor, accuracy_report
+from src.train_range_regressor import HELD_OUT_INPUTS, held_out_report
+
+def test_fit_predict_and_report(tmp_path, fake_processor):
+    matcher = FeatureMatcher(fake_processor, ScenarioEmbeddingStore(str(tmp_path)))
+    scenarios = RangeRegressor.training_scenarios(matcher)
+    assert len(scenarios) == 16 * len(matcher.scenario_mappings)
+
+    model = RangeRegressor.fit(matcher, scenarios)
+    assert model.embedding_name == 'fake' and model.embedding_dim == 16
+    ranges, weights = model.predict(scenarios[:50])
+    assert ranges.shape == (50, len(matcher.feature_names), 2)
+    present = ~np.isnan(ranges[..., 0])
+    assert (ranges[present][:, 0] <= ranges[present][:, 1]).all()
+    assert (weights[~present] == 0).all()
+
+    report = accuracy_report(matcher.blend_range_arrays(scenarios), model.predict(scenarios), matcher.feature_names)
+    assert report['n'] == len(scenarios)
+    # the categories alone decide most of which features get a range
+    assert report['presence_accuracy'] > 0.9
+    assert report['features']['energy']['bound_mae'] < 0.1
+
+    # a categories-only model needs no embedding
+    categories_only = RangeRegressor.fit(matcher, scenarios, use_embedding=False)
+    scenario = {'mood': 'happy', 'activity': 'working', 'time': 'night', 'social': 'unspecified'}
+    assert categories_only.predict([scenario])[0].shape == (1, len(matcher.feature_names), 2)
+
+def test_save_load_and_matcher_integration(tmp_path, fake_processor):
+    matcher = FeatureMatcher(fake_processor, ScenarioEmbeddingStore(str(tmp_path)))
+    scenarios = RangeRegressor.training_scenarios(matcher, mask_dimensions=False)
+    model = RangeRegressor.fit(matcher, scenarios, alpha=10.0)
+
+    path = RangeRegressor.default_path(model.embedding_name, str(tmp_path))
+    model.save(str(path))
+    loaded = RangeRegressor.load(str(path))
+    expected = model.predict(scenarios)
+    actual = loaded.predict(scenarios)
+    assert np.array_equal(np.isnan(expected[0]), np.isnan(actual[0]))
+    assert np.allclose(np.nan_to_num(expected[0]), np.nan_to_num(actual[0]))
+
+    matcher.use_range_regressor(loaded)
+    ranges, weights = matcher.get_weighted_range_arrays(scenarios[:5])
+    assert np.allclose(np.nan_to_num(ranges), np.nan_to_num(expected[0][:5]))
+    feature_ranges = matcher.get_feature_ranges(scenarios[0])
+    assert set(feature_ranges) == {f for f, r in zip(matcher.feature_names, expected[0][0]) if not np.isnan(r[0])}
+
+    matcher.use_range_regressor(None)
+    assert np.array_equal(np.nan_to_num(matcher.get_weighted_range_arrays(scenarios[:5])[0]),
+                          np.nan_to_num(matcher.blend_range_arrays(scenarios[:5])[0]))
+
+    loaded.embedding_name = 'another model'
+    with pytest.raises(ValueError):
+        matcher.use_range_regressor(loaded)
+
+def test_held_out_report(tmp_path, fake_processor):
+    matcher = FeatureMatcher(fake_processor, ScenarioEmbeddingStore(str(tmp_path)))
+    model = RangeRegressor.fit(matcher, RangeRegressor.training_scenarios(matcher))
+
+    mapped = {mapping['text'].lower() for mapping in matcher.scenario_mappings}
+    assert not mapped & {text.lower() for text in HELD_OUT_INPUTS}
+    report = held_out_report(fake_processor, matcher, model, HELD_OUT_INPUTS)
+    assert report['n'] == len(HELD_OUT_INPUTS)
+    assert 0 <= report['presence_accuracy'] <= 1
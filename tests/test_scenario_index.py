@@ -0,0 +1,32 @@
+# tests/test_scenario_index.py
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from src.models.scenario_index import ScenarioIndex
+
+def test_matches_full_sort():
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(300, 32)).astype(np.float32)
+    queries = rng.normal(size=(4, 32)).astype(np.float32)
+    index = ScenarioIndex(embeddings)
+
+    normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    for query in queries:
+        expected = np.argsort(-(normalized @ (query / np.linalg.norm(query))))[:3]
+        indices, similarities = index.search(query, 3)
+        assert list(indices) == list(expected)
+        assert similarities[0] >= similarities[1] >= similarities[2]
+
+    # a batch of queries gives the same answer as querying one at a time
+    batch_indices, _ = index.search(queries, 3)
+    assert batch_indices.shape == (4, 3)
+    for query, row in zip(queries, batch_indices):
+        assert list(row) == list(index.search(query, 3)[0])
+
+def test_ties_prefer_lower_index():
+    embeddings = np.tile(np.array([[1.0, 0.0]]), (5, 1))
+    indices, _ = ScenarioIndex(embeddings).search(np.array([1.0, 0.0]), 3)
+    assert list(indices) == [0, 1, 2]
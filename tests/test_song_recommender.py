@@ -0,0 +1,152 @@
+# tests/test_song_recommender.py
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import numpy as np
+import pytest
+from src.database.db_manager import DatabaseManager
+from src.database.export_snapshot import export_snapshot
+from src.models.embedding_store import ScenarioEmbeddingStore
+from src.models.feature_matcher import FeatureMatcher
+from src.models.song_recommender import SongRecommender
+from src.models.song_similarity import SongSimilarityIndex
+from src.models.song_store import SongStore, StringTable
+from src.webapp.pipeline import RequestPipeline
+
+@pytest.fixture
+def recommender(tmp_path, fake_processor, make_db):
+    matcher = FeatureMatcher(fake_processor, ScenarioEmbeddingStore(str(tmp_path / "embeddings")))
+    # with an updated_at column, so refreshes pick up edits
+    db_manager = DatabaseManager(make_db(n=500, updated_at=1))
+    yield SongRecommender(fake_processor, matcher, db_manager)
+    db_manager.close()
+
+def test_cached_scenario_is_not_shared(recommender):
+    feature_ranges = recommender.resolve_scenario("working out with friends in the evening")
+    expected = (dict(feature_ranges), dict(feature_ranges.weights))
+    feature_ranges['energy'] = (0.0, 0.0)
+    feature_ranges.weights.clear()
+
+    cached = recommender.cached_scenario("working out with friends in the evening")
+    assert (dict(cached), cached.weights) == expected
+    scenario_features, _ = recommender._resolve_scenario("working out with friends in the evening")
+    assert not scenario_features['embedding'].flags.writeable
+
+def test_snapshot_load_builds_nothing(recommender, tmp_path, monkeypatch):
+    export_snapshot(recommender.db_manager.db_path, str(tmp_path / "snapshot"))
+    def recommended():
+        # tempo may be NaN, which never compares equal
+        return [(song['track_name'], song['artist_name']) for song in
+                recommender.recommend_songs("studying alone at night", 'classical')]
+    expected = recommended()
+
+    def rebuild(*args):
+        raise AssertionError("the snapshot has the index and partitions")
+    monkeypatch.setattr(SongStore, 'build_range_index', rebuild)
+    monkeypatch.setattr(SongStore, 'build_partitions', rebuild)
+    recommender.snapshot_path = str(tmp_path / "snapshot")
+    recommender.reload_catalog()
+    assert recommended() == expected
+
+def test_refresh_inserts_fixes_and_removes(recommender):
+    store = recommender._get_song_store()
+    db_path = recommender.db_manager.db_path
+    assert 51 not in store.row_ids   # loaded without its danceability
+
+    conn = sqlite3.connect(db_path)
+    # fill in a missing feature of an old row, null out one of another, delete a third, add one
+    conn.execute("UPDATE extracted SET danceability = 0.5, updated_at = 2 WHERE rowid = 51")
+    conn.execute("UPDATE extracted SET energy = NULL, updated_at = 2 WHERE rowid = 10")
+    conn.execute("DELETE FROM extracted WHERE rowid = 20")
+    conn.execute("INSERT INTO extracted VALUES ('T500', 'new', 'artist', 0.5, 0.5, 0.5, 120, 0.5, 0.5, 0.5, 2)")
+    conn.commit()
+    conn.close()
+
+    assert recommender.refresh_catalog() == 4
+    refreshed = recommender._get_song_store()
+    expected = SongRecommender(recommender.scenario_processor, recommender.feature_matcher,
+                               DatabaseManager(db_path))._get_song_store()
+    np.testing.assert_array_equal(refreshed.row_ids, expected.row_ids)
+    np.testing.assert_array_equal(refreshed.features, expected.features)
+    assert refreshed.track_names.tolist() == expected.track_names.tolist()
+    for genre in SongRecommender.GENRE_PROFILES:
+        np.testing.assert_array_equal(refreshed.partitions[genre], expected.partitions[genre])
+    feature_ranges = {'energy': (0.4, 0.7), 'valence': (0.5, 0.9), 'danceability': (0.3, 0.6)}
+    assert refreshed.top_k(feature_ranges, 25).tolist() == expected.top_k(feature_ranges, 25).tolist()
+
+    # nothing changed since
+    assert recommender.refresh_catalog() == 0
+    assert recommender._get_song_store() is refreshed
+
+def test_refresh_high_water_marks(recommender, monkeypatch):
+    store = recommender._get_song_store()
+    db_path = recommender.db_manager.db_path
+    conn = sqlite3.connect(db_path)
+    # a trailing row that can't be used yet, and an edit in the same tick as the loaded mark
+    conn.execute("INSERT INTO extracted VALUES ('T500', 'new', 'artist', NULL, 0.5, 0.5, 120, 0.5, 0.5, 0.5, 0)")
+    conn.execute("UPDATE extracted SET energy = 0.25, updated_at = 1 WHERE rowid = 7")
+    conn.commit()
+
+    # nothing was deleted, so the table's row ids aren't read
+    def row_ids(*args):
+        raise AssertionError("read every row id")
+    monkeypatch.setattr(recommender.db_manager, 'get_song_row_ids', row_ids)
+    assert recommender.refresh_catalog() == 1
+    refreshed = recommender._get_song_store()
+    assert refreshed.columns['energy'][np.searchsorted(refreshed.row_ids, 7)] == np.float32(0.25)
+    assert recommender._max_row_id == 501 and refreshed.max_row_id == 500
+
+    # the rows at the mark come back, but nothing changed, and the unusable row isn't fetched again
+    fetched = []
+    from_database = SongStore.from_database.__func__
+    def spy(cls, *args, **kwargs):
+        changes = from_database(cls, *args, **kwargs)
+        fetched.extend(changes.row_ids.tolist())
+        return changes
+    monkeypatch.setattr(SongStore, 'from_database', classmethod(spy))
+    assert recommender.refresh_catalog() == 0
+    assert recommender._get_song_store() is refreshed
+    assert 501 not in fetched
+
+    monkeypatch.undo()
+    conn.execute("DELETE FROM extracted WHERE rowid = 3")
+    conn.commit()
+    conn.close()
+    assert recommender.refresh_catalog() == 1
+    assert 3 not in recommender._get_song_store().row_ids
+
+def test_pipeline_counts_one_miss_per_input(recommender):
+    pipeline = RequestPipeline(recommender, embed_workers=1, score_workers=1, torch_threads=1)
+    pipeline.recommend("studying alone at night", timeout=10)
+    pipeline.recommend("studying alone at night", timeout=10)
+    pipeline.shutdown()
+    stats = recommender.scenario_cache.stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
+
+def test_refresh_rebuilds_the_similarity_index(recommender, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    load_or_build = SongSimilarityIndex.load_or_build.__func__
+    monkeypatch.setattr(SongSimilarityIndex, 'load_or_build',
+                        classmethod(lambda cls, song_store: load_or_build(cls, song_store, cache_dir)))
+    assert recommender.similar_songs("tråck 1", top_n=3)
+
+    conn = sqlite3.connect(recommender.db_manager.db_path)
+    conn.execute("INSERT INTO extracted VALUES ('T500', 'new', 'artist', 0.5, 0.5, 0.5, 120, 0.5, 0.5, 0.5, 2)")
+    conn.commit()
+    conn.close()
+    assert recommender.refresh_catalog() == 1
+
+    # the refresh built the new index, requests only read it
+    def build(*args, **kwargs):
+        raise AssertionError("built on the request path")
+    monkeypatch.setattr(SongSimilarityIndex, 'load_or_build', build)
+    song_store, index = recommender._get_similarity()
+    assert song_store is recommender._get_song_store()
+    assert index.fingerprint == SongSimilarityIndex.catalog_fingerprint(song_store)
+    # so is the track name lookup
+    monkeypatch.setattr(StringTable, '_hash_strings', build)
+    assert recommender.similar_songs("new", top_n=3)
+    assert len(list((tmp_path / "cache" / "similarity").glob("*.pkl"))) == 1
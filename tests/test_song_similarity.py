@@ -0,0 +1,65 @@
+# tests/test_song_similarity.py
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from src.models.song_store import SongStore, StringTable
+from src.models.song_similarity import SongSimilarityIndex
+
+def make_store(n=3000, seed=0):
+    rng = np.random.default_rng(seed)
+    features = rng.random((n, len(SongStore.FEATURE_COLUMNS))).astype(np.float32)
+    features[:, SongStore.FEATURE_COLUMNS.index('tempo')] = rng.normal(115, 25, n)
+    features[::13, 2] = np.nan
+    # song 1 is a second copy of song 0
+    features[1] = features[0]
+    track_names = [f"track {i}" for i in range(n)]
+    track_names[1] = "track 0"
+    artist_names = [f"artist {i % 50}" for i in range(n)]
+    artist_names[1] = "artist 0"
+    return SongStore(features, StringTable.from_strings(track_names), StringTable.from_strings(artist_names))
+
+def brute_force_distances(index, store, row, k):
+    points = index.normalize(store.features)
+    return np.sort(np.sqrt(((points - points[row]) ** 2).sum(axis=1)))[:k]
+
+def test_query_matches_brute_force():
+    store = make_store()
+    index = SongSimilarityIndex.build(store)
+    for row in (5, 13, 2999):
+        rows, distances = index.query(store.features[row], 10)
+        assert np.allclose(distances[0], brute_force_distances(index, store, row, 10))
+        assert rows[0][0] == row
+
+def test_similar_skips_the_song_and_its_copies():
+    store = make_store()
+    index = SongSimilarityIndex.build(store)
+    rows, distances = index.similar(store, 0, 5)
+    assert len(rows) == 5
+    assert 0 not in rows and 1 not in rows
+    assert (np.diff(distances) >= 0).all()
+    # the whole catalog when asking for more than there is
+    assert len(index.similar(store, 0, 10000)[0]) == len(store) - 2
+
+def test_persisted_index(tmp_path):
+    store = make_store()
+    index = SongSimilarityIndex.load_or_build(store, str(tmp_path))
+    path = SongSimilarityIndex.default_path(index.fingerprint, str(tmp_path))
+    assert path.exists()
+
+    loaded = SongSimilarityIndex.load_or_build(store, str(tmp_path))
+    assert loaded.fingerprint == index.fingerprint
+    assert np.array_equal(loaded.query(store.features[7], 5)[0], index.query(store.features[7], 5)[0])
+
+    # editing a song changes the fingerprint, so the index is rebuilt
+    features = np.array(store.features)
+    features[7, 0] += 0.5
+    edited = SongStore(features, store.track_names, store.artist_names)
+    assert SongSimilarityIndex.catalog_fingerprint(edited) != index.fingerprint
+    rebuilt = SongSimilarityIndex.load_or_build(edited, str(tmp_path))
+    assert rebuilt.fingerprint != index.fingerprint
+    # the index of the old catalog is removed
+    assert list((tmp_path / "similarity").glob("*.pkl")) == [
+        SongSimilarityIndex.default_path(rebuilt.fingerprint, str(tmp_path))]
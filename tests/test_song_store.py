@@ -0,0 +1,366 @@
+# tests/test_song_store.py
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+import pytest
+from src.models.song_store import SongStore, StringTable
+from src.models.ranking import top_k
+from src.models.range_index import RangeIndex, bitset_from_rows
+
+def make_song_data(n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    data = {
+        'track_name': [f"track {i}" for i in range(n)],
+        'artist_name': [f"artist {i % 97}" for i in range(n)]
+    }
+    for feature in SongStore.FEATURE_COLUMNS:
+        if feature == 'tempo':
+            data[feature] = np.round(rng.normal(115, 25, n), 1)
+        else:
+            # few decimals so plenty of songs sit exactly on the range bounds
+            data[feature] = np.round(rng.random(n), 1)
+    return pd.DataFrame(data)
+
+FEATURE_RANGES = {
+    'energy': (0.4, 0.7),
+    'valence': (0.5, 0.7),
+    'tempo': (90.0, 120.0),
+    'acousticness': (0.6, 0.9),
+    'loudness': (-10.0, 0.0)
+}
+
+def pandas_scores(song_data, feature_ranges):
+    # the scoring SongRecommender used before the columnar store
+    scores = pd.Series(0, index=song_data.index)
+    for feature, (min_val, max_val) in feature_ranges.items():
+        if feature in song_data.columns:
+            scores += ((song_data[feature] >= min_val) &
+                       (song_data[feature] <= max_val)).astype(int)
+    return scores
+
+def test_string_table():
+    table = StringTable.from_strings(["Björk", "", None, "Sigur Rós"])
+    assert len(table) == 4
+    assert table.tolist() == ["Björk", "", "", "Sigur Rós"]
+    assert table.find("Sigur Rós").tolist() == [3]
+    assert table.find("").tolist() == [1, 2]
+    assert table.find("Björ").tolist() == []
+    assert table.find("Björk").tolist() == [0]
+    assert StringTable.from_strings(["a", "ab", ""]).find("ab").tolist() == [1]
+
+def test_scores_match_pandas():
+    song_data = make_song_data()
+    store = SongStore.from_dataframe(song_data)
+
+    expected = pandas_scores(song_data, FEATURE_RANGES).to_numpy()
+    np.testing.assert_array_equal(store.score_ranges(FEATURE_RANGES), expected)
+
+    assert store.features.flags['F_CONTIGUOUS']
+    assert store.columns['energy'].flags['C_CONTIGUOUS']
+
+def test_song_dict():
+    song_data = make_song_data(10)
+    song = SongStore.from_dataframe(song_data).song(3)
+    assert song['track_name'] == "track 3"
+    assert song['energy'] == song_data['energy'][3]
+    assert 'speechiness' not in song
+
+def test_top_k_matches_nlargest():
+    song_data = make_song_data()
+    store = SongStore.from_dataframe(song_data)
+    scores = store.score_ranges(FEATURE_RANGES)
+
+    expected = pandas_scores(song_data, FEATURE_RANGES).nlargest(50).index.tolist()
+    # small chunks so ties have to be resolved across chunk boundaries
+    assert top_k(scores, 50, chunk_size=64).tolist() == expected
+
+    rows = np.flatnonzero(song_data['energy'].to_numpy() > 0.5)
+    subset = pandas_scores(song_data, FEATURE_RANGES)[rows]
+    assert top_k(scores, 20, rows=rows, chunk_size=100).tolist() == subset.nlargest(20).index.tolist()
+
+def test_top_k_edge_cases():
+    scores = np.array([1.0, np.nan, 3.0, 3.0], dtype=np.float32)
+    assert top_k(scores, 10).tolist() == [2, 3, 0]
+    assert top_k(scores, 0).tolist() == []
+    assert top_k(scores, 2, rows=np.array([], dtype=np.intp)).tolist() == []
+
+def test_range_index_matches_linear_scan():
+    song_data = make_song_data()
+    song_data.loc[::7, 'tempo'] = np.nan
+    store = SongStore.from_dataframe(song_data)
+    expected = store.score_ranges(FEATURE_RANGES).copy()
+    expected_top = top_k(expected, 40)
+    rows = np.flatnonzero(song_data['valence'].to_numpy() >= 0.5)
+    expected_rows_top = top_k(expected, 25, rows=rows)
+
+    store.build_range_index(n_buckets=16)
+    np.testing.assert_array_equal(store.score_ranges(FEATURE_RANGES), expected)
+    assert store.top_k(FEATURE_RANGES, 40).tolist() == expected_top.tolist()
+    assert store.top_k(FEATURE_RANGES, 25, rows=rows).tolist() == expected_rows_top.tolist()
+
+    # single point, empty and all-covering ranges
+    for min_val, max_val in [(0.5, 0.5), (0.55, 0.58), (-1.0, 2.0), (2.0, 3.0)]:
+        column = store.columns['energy']
+        expected_match = (column >= min_val) & (column <= max_val)
+        scores = store.score_ranges({'energy': (min_val, max_val)})
+        np.testing.assert_array_equal(scores, expected_match)
+
+GENRE_PROFILES = {
+    'electronic': {'danceability': (0.6, 1.0), 'energy': (0.7, 1.0)},
+    'classical': {'instrumentalness': (0.7, 1.0), 'speechiness': (0.0, 0.1)}
+}
+
+def test_partitions():
+    song_data = make_song_data()
+    for use_range_index in (False, True):
+        store = SongStore.from_dataframe(song_data)
+        if use_range_index:
+            store.build_range_index(n_buckets=16)
+        store.build_partitions(GENRE_PROFILES)
+
+        scores = pandas_scores(song_data, FEATURE_RANGES)
+        for genre, ranges in GENRE_PROFILES.items():
+            expected_rows = np.flatnonzero(store.range_mask(ranges))
+            np.testing.assert_array_equal(store.partitions[genre], expected_rows)
+
+            expected = scores[expected_rows].nlargest(15).index.tolist()
+            assert store.top_k(FEATURE_RANGES, 15, partition=genre).tolist() == expected
+
+def test_snapshot_round_trip(tmp_path):
+    store = SongStore.from_dataframe(make_song_data(500))
+    store.save(str(tmp_path / "snapshot"), metadata={'source': 'test'})
+    # saving again replaces the snapshot in place, keeping only the previous version
+    store.save(str(tmp_path / "snapshot"))
+    store.save(str(tmp_path / "snapshot"))
+    assert len(list((tmp_path / "snapshot").glob("snapshot-*"))) == 2
+
+    loaded = SongStore.load(str(tmp_path / "snapshot"))
+    assert isinstance(loaded.features.base, np.memmap) or isinstance(loaded.features, np.memmap)
+    np.testing.assert_array_equal(loaded.features, store.features)
+    assert loaded.track_names.tolist() == store.track_names.tolist()
+    assert loaded.song(42) == store.song(42)
+    assert loaded.range_index is None and loaded.partitions == {}
+    assert SongStore.snapshot_metadata(str(tmp_path / "snapshot"))['n_rows'] == 500
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["snapshot"]
+
+def test_snapshot_keeps_index_and_partitions(tmp_path):
+    store = SongStore.from_dataframe(make_song_data(500))
+    store.build_range_index(16)
+    store.build_partitions(GENRE_PROFILES)
+    store.save(str(tmp_path / "snapshot"))
+
+    loaded = SongStore.load(str(tmp_path / "snapshot"))
+    assert loaded.range_index is not None and loaded.range_index.n_buckets == 16
+    assert isinstance(loaded.range_index.buckets['energy']['prefix'], np.memmap)
+    assert loaded.partition_profiles == store.partition_profiles
+    for genre in GENRE_PROFILES:
+        np.testing.assert_array_equal(loaded.partitions[genre], store.partitions[genre])
+        np.testing.assert_array_equal(loaded.partition_bitsets[genre], store.partition_bitsets[genre])
+        assert loaded.top_k(FEATURE_RANGES, 15, partition=genre).tolist() == \
+            store.top_k(FEATURE_RANGES, 15, partition=genre).tolist()
+    assert loaded.top_k(FEATURE_RANGES, 15).tolist() == store.top_k(FEATURE_RANGES, 15).tolist()
+
+def test_apply_changes():
+    song_data = make_song_data(1200)
+    song_data['rowid'] = np.arange(1, 1201)
+    for use_range_index in (False, True):
+        store = SongStore.from_dataframe(song_data[:1000])
+        if use_range_index:
+            store.build_range_index(n_buckets=16)
+        store.build_partitions(GENRE_PROFILES)
+
+        # append only: index and partitions are extended in place of a rebuild
+        updated = store.apply_changes(SongStore.from_dataframe(song_data[1000:]))
+        expected = SongStore.from_dataframe(song_data)
+        if use_range_index:
+            expected.build_range_index(n_buckets=16)
+        expected.build_partitions(GENRE_PROFILES)
+
+        assert len(store) == 1000 and len(updated) == 1200
+        assert updated.max_row_id == 1200
+        np.testing.assert_array_equal(updated.score_ranges(FEATURE_RANGES), expected.score_ranges(FEATURE_RANGES))
+        for genre in GENRE_PROFILES:
+            np.testing.assert_array_equal(updated.partitions[genre], expected.partitions[genre])
+            assert (updated.top_k(FEATURE_RANGES, 20, partition=genre).tolist() ==
+                    expected.top_k(FEATURE_RANGES, 20, partition=genre).tolist())
+
+        # an existing row id is patched in place
+        patch = song_data[5:6].copy()
+        patch['track_name'] = "patched"
+        patch['energy'] = 0.55
+        patched = updated.apply_changes(SongStore.from_dataframe(patch))
+        assert len(patched) == 1200
+        assert patched.song(5)['track_name'] == "patched"
+        assert patched.song(5)['energy'] == 0.55
+        assert updated.song(5)['track_name'] == "track 5"
+
+        # rows missing from the middle are inserted in row id order, removed ones dropped
+        gappy = SongStore.from_dataframe(song_data[song_data['rowid'] % 10 != 0])
+        if use_range_index:
+            gappy.build_range_index(n_buckets=16)
+        gappy.build_partitions(GENRE_PROFILES)
+        merged = gappy.apply_changes(SongStore.from_dataframe(song_data[song_data['rowid'] % 10 == 0]),
+                                     removed=np.array([3, 4, 5000]))
+        expected = SongStore.from_dataframe(song_data[~song_data['rowid'].isin([3, 4])])
+        if use_range_index:
+            expected.build_range_index(n_buckets=16)
+        expected.build_partitions(GENRE_PROFILES)
+        np.testing.assert_array_equal(merged.row_ids, expected.row_ids)
+        np.testing.assert_array_equal(merged.features, expected.features)
+        assert merged.track_names.tolist() == expected.track_names.tolist()
+        for genre in GENRE_PROFILES:
+            np.testing.assert_array_equal(merged.partitions[genre], expected.partitions[genre])
+            assert (merged.top_k(FEATURE_RANGES, 20, partition=genre).tolist() ==
+                    expected.top_k(FEATURE_RANGES, 20, partition=genre).tolist())
+
+def test_apply_changes_updates_the_index(monkeypatch):
+    song_data = make_song_data(3000, seed=3)
+    song_data['rowid'] = np.arange(1, 3001)
+    song_data.loc[::17, 'valence'] = np.nan
+    store = SongStore.from_dataframe(song_data[song_data['rowid'] % 7 != 0])
+    store.build_range_index(n_buckets=16)
+    store.build_partitions(GENRE_PROFILES)
+
+    # patches (one into a NaN, one out of it), rows filled in the middle, appended rows and deletes
+    changes = song_data[song_data['rowid'].isin([18, 35, 100, 2000, 1401, 2800])].copy()
+    changes.loc[changes['rowid'] == 18, 'valence'] = 0.3
+    changes.loc[changes['rowid'] == 100, 'valence'] = np.nan
+    changes.loc[changes['rowid'] == 2000, ['energy', 'track_name']] = (0.95, "patched")
+    new_rows = make_song_data(5, seed=4)
+    new_rows['rowid'] = np.arange(3001, 3006)
+    changes = pd.concat([changes, new_rows])
+    removed = np.array([1, 2, 500, 2999])
+
+    # nothing is rebuilt
+    def rebuild(*args):
+        raise AssertionError("rebuilt")
+    monkeypatch.setattr(SongStore, 'build_range_index', rebuild)
+    monkeypatch.setattr(SongStore, 'build_partitions', rebuild)
+    monkeypatch.setattr(RangeIndex, '_build_buckets', rebuild)
+    updated = store.apply_changes(SongStore.from_dataframe(changes), removed)
+    monkeypatch.undo()
+
+    expected_data = pd.concat([song_data[(song_data['rowid'] % 7 != 0) & ~song_data['rowid'].isin(changes['rowid'])],
+                               changes])
+    expected_data = expected_data[~expected_data['rowid'].isin(removed)].sort_values('rowid')
+    expected = SongStore.from_dataframe(expected_data)
+    expected.build_range_index(n_buckets=16)
+    expected.build_partitions(GENRE_PROFILES)
+
+    np.testing.assert_array_equal(updated.row_ids, expected.row_ids)
+    np.testing.assert_array_equal(updated.features, expected.features)
+    assert updated.track_names.tolist() == expected.track_names.tolist()
+    assert updated.artist_names.tolist() == expected.artist_names.tolist()
+    for feature in store.feature_names:
+        buckets = updated.range_index.buckets[feature]
+        # the same sorted order a build gives, and prefix bitsets that match it
+        np.testing.assert_array_equal(buckets['order'], expected.range_index.buckets[feature]['order'])
+        for b in range(1, len(buckets['starts'])):
+            np.testing.assert_array_equal(buckets['prefix'][b],
+                                          bitset_from_rows(buckets['order'][:buckets['starts'][b]], len(updated)))
+    for genre in GENRE_PROFILES:
+        np.testing.assert_array_equal(updated.partitions[genre], expected.partitions[genre])
+        np.testing.assert_array_equal(updated.partition_bitsets[genre], expected.partition_bitsets[genre])
+    assert updated.top_k(FEATURE_RANGES, 50).tolist() == expected.top_k(FEATURE_RANGES, 50).tolist()
+
+def test_string_table_merge():
+    table = StringTable.from_strings(["a", "", "bc", "déf", "g"])
+    other = StringTable.from_strings(["x", "yz"])
+    merged = table.merge(np.array([~1, 0, 1, 2, ~0, 4]), other)
+    assert merged.tolist() == ["yz", "a", "", "bc", "x", "g"]
+    assert table.merge(np.array([], dtype=np.int64), other).tolist() == []
+
+def test_top_k_batch_matches_top_k():
+    song_data = make_song_data()
+    song_data.loc[::11, 'energy'] = np.nan
+    ranges_list = [FEATURE_RANGES, {}, {'energy': (0.2, 0.5)}, {'valence': (0.0, 1.0), 'tempo': (100.0, 110.0)},
+                   {'danceability': (0.5, 0.5), 'unknown': (0.0, 1.0)}]
+    for use_range_index in (False, True):
+        store = SongStore.from_dataframe(song_data)
+        if use_range_index:
+            store.build_range_index(n_buckets=16)
+        store.build_partitions(GENRE_PROFILES)
+
+        for partition in (None, 'classical'):
+            # tiny blocks so the running top k is merged across many chunks
+            top = store.top_k_batch(ranges_list, 25, partition=partition, max_block=4096)
+            assert top.shape == (len(ranges_list), 25)
+            for feature_ranges, rows in zip(ranges_list, top):
+                assert rows.tolist() == store.top_k(feature_ranges, 25, partition=partition).tolist()
+
+        # the same ranges as a [n, n_features, 2] array, NaN where there's no range
+        names = ['energy', 'valence', 'tempo', 'acousticness', 'loudness', 'danceability']
+        array = np.full((len(ranges_list), len(names), 2), np.nan)
+        for i, feature_ranges in enumerate(ranges_list):
+            for feature, bounds in feature_ranges.items():
+                if feature in names:
+                    array[i, names.index(feature)] = bounds
+        assert (store.top_k_batch(array, 25, feature_names=names).tolist() ==
+                store.top_k_batch(ranges_list, 25).tolist())
+
+        if use_range_index:
+            # several blocks of queries through the index
+            lower, upper = store._range_bounds(ranges_list * 3)
+            top = store.range_index.top_k_batch(lower, upper, 25, max_block=2 * store.range_index.n_words)
+            assert top.tolist() == store.top_k_batch(ranges_list, 25).tolist() * 3
+
+        assert store.top_k_batch(ranges_list, 5000).shape == (len(ranges_list), 2000)
+        assert store.top_k_batch([], 5).shape == (0, 5)
+
+def reference_graded_scores(song_data, feature_ranges, weights=None):
+    # per song and feature, straight from the definition in SongStore.graded_scores
+    scores = np.zeros(len(song_data))
+    for feature, (min_val, max_val) in feature_ranges.items():
+        if feature not in song_data.columns:
+            continue
+        values = song_data[feature].to_numpy(dtype=np.float64)
+        center, half = (min_val + max_val) / 2, max((max_val - min_val) / 2, 1e-6)
+        distance = np.abs(values - center)
+        inside = 1 - SongStore.GRADED_EDGE_PENALTY * np.minimum(distance / half, 1)
+        outside = np.maximum(distance - half, 0) / song_data[feature].std(ddof=0)
+        weight = 1.0 if weights is None else weights.get(feature, 0.0)
+        scores += np.nan_to_num(inside / (1 + outside)) * weight
+    return scores
+
+def test_graded_scores():
+    song_data = make_song_data()
+    song_data.loc[::7, 'valence'] = np.nan
+    store = SongStore.from_dataframe(song_data)
+    store.build_partitions(GENRE_PROFILES)
+    weights = {'energy': 1.0, 'valence': 0.5, 'tempo': 0.75}
+
+    for w in (None, weights):
+        expected = reference_graded_scores(song_data, FEATURE_RANGES, w)
+        assert np.allclose(store.graded_scores(FEATURE_RANGES, w, chunk_size=333), expected, atol=1e-4)
+        rows = store.partitions['classical']
+        assert np.allclose(store.graded_scores(FEATURE_RANGES, w, rows), expected[rows], atol=1e-4)
+
+    # the songs inside every range no longer all tie
+    counts = store.score_ranges(FEATURE_RANGES).copy()
+    graded = store.graded_scores(FEATURE_RANGES).copy()
+    full = counts == counts.max()
+    assert len(np.unique(graded[full])) > 1
+
+    top = store.top_k_graded(FEATURE_RANGES, 20)
+    assert top.tolist() == top_k(graded, 20).tolist()
+    # the closer to the center of the energy range the better, all else equal
+    assert store.top_k_graded({'energy': (0.4, 0.6)}, 1).tolist() == [int(np.argmax(song_data['energy'] == 0.5))]
+    for row in store.top_k_graded(FEATURE_RANGES, 10, partition='classical'):
+        assert row in store.partitions['classical']
+    assert not store.graded_scores({}).any()
+
+def test_graded_scores_numexpr(monkeypatch):
+    pytest.importorskip("numexpr")
+    import src.models.song_store as song_store_module
+
+    song_data = make_song_data()
+    song_data.loc[::7, 'valence'] = np.nan
+    store = SongStore.from_dataframe(song_data)
+    weights = {'energy': 1.0, 'valence': 0.5, 'tempo': 0.75}
+    expected = store.graded_scores(FEATURE_RANGES, weights).copy()
+    monkeypatch.setattr(song_store_module, 'USE_NUMEXPR', True)
+    assert np.allclose(store.graded_scores(FEATURE_RANGES, weights, chunk_size=333), expected, atol=1e-5)
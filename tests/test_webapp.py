@@ -0,0 +1,152 @@
+# tests/test_webapp.py
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import subprocess
+import threading
+import time
+import pytest
+from types import SimpleNamespace
+from src.webapp.app import create_app
+from src.webapp.app import routes
+from src.webapp.pipeline import RequestPipeline
+from src.webapp.warmup import RecommenderWarmup
+from src.models.lru_cache import LRUCache
+
+class FakeRecommender:
+    backend = 'memory'
+    scenario_cache = LRUCache()
+    scenario_processor = SimpleNamespace(batcher=None)
+
+    def cached_scenario(self, user_input):
+        return None
+
+    def resolve_scenario(self, user_input, cache_checked=False):
+        return {'energy': (0.0, 1.0)}
+
+    def rank_songs(self, feature_ranges, genre=None, top_n=10):
+        return [{'track_name': f"song {i}"} for i in range(top_n)]
+
+    def similar_songs(self, track, artist=None, top_n=10):
+        if track != 'known':
+            raise KeyError(track)
+        return [{'track_name': f"like {track} {i}", 'distance': 0.1 * i} for i in range(top_n)]
+
+class FakeWarmup(RecommenderWarmup):
+    """Same progress reporting, but the steps only wait for the test"""
+    def __init__(self):
+        super().__init__({})
+        self.release = threading.Event()
+
+    def _steps(self):
+        return [('scenario_model', lambda: self.release.wait(5)), ('pipeline', self._fake_pipeline)]
+
+    def _fake_pipeline(self):
+        self.recommender = FakeRecommender()
+        self.pipeline = RequestPipeline(self.recommender, embed_workers=1, score_workers=1, torch_threads=1)
+
+@pytest.fixture
+def warmup(monkeypatch):
+    """A FakeWarmup the routes use, started by the first request"""
+    monkeypatch.setenv('WARMUP_ON_START', '0')
+    warmup = FakeWarmup()
+    monkeypatch.setattr(routes, 'warmup', warmup)
+    yield warmup
+    if warmup.pipeline is not None:
+        warmup.pipeline.shutdown()
+
+def test_import_does_not_load_models():
+    # torch/transformers/sklearn are only imported by the warmup
+    code = ("import sys; import src.webapp.app.routes; "
+            "print(sorted(m for m in ('torch', 'transformers', 'sklearn') if m in sys.modules))")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == "[]"
+
+def test_health_and_readiness_during_warmup(warmup):
+    client = create_app().test_client()
+
+    assert client.get('/healthz').status_code == 200
+    response = client.get('/readyz')
+    assert response.status_code == 503 and response.json['state'] == 'idle'
+
+    # the first request starts the warmup and is turned away until it's done
+    response = client.post('/recommend', json={'input': 'night drive'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert client.get('/readyz').json['state'] == 'warming'
+
+    warmup.release.set()
+    assert warmup.wait(5)
+    response = client.get('/readyz')
+    assert response.status_code == 200
+    assert response.json['steps_done'] == response.json['steps_total'] == 2
+
+    response = client.post('/recommend', json={'input': 'night drive', 'top_n': 3})
+    assert response.status_code == 200 and len(response.json) == 3
+    assert client.get('/metrics').json['completed'] == 1
+    assert client.get('/').status_code == 200
+
+def test_similar_songs(warmup):
+    client = create_app().test_client()
+    assert client.get('/similar?track=known').status_code == 503
+
+    warmup.release.set()
+    assert warmup.wait(5)
+    response = client.get('/similar?track=known&top_n=4')
+    assert response.status_code == 200 and len(response.json) == 4
+    assert client.get('/similar?track=unknown').status_code == 404
+    assert client.get('/similar').status_code == 400
+    assert client.get('/similar?track=known&top_n=many').status_code == 400
+    # lookups go through the pipeline
+    assert client.get('/metrics').json['submitted'] == 2
+
+    warmup.recommender.backend = 'sql'
+    assert client.get('/similar?track=known').status_code == 501
+
+def test_top_n_is_clamped(warmup, monkeypatch):
+    monkeypatch.setattr(routes, 'MAX_TOP_N', 20)
+    client = create_app().test_client()
+    warmup.start()
+    warmup.release.set()
+    assert warmup.wait(5)
+
+    assert len(client.post('/recommend', json={'input': 'night drive', 'top_n': 1000}).json) == 20
+    assert len(client.post('/recommend', json={'input': 'night drive', 'top_n': -5}).json) == 1
+    assert len(client.get('/similar?track=known&top_n=1000').json) == 20
+
+def test_similar_songs_backpressure(warmup):
+    client = create_app().test_client()
+    warmup.start()
+    warmup.release.set()
+    assert warmup.wait(5)
+
+    pipeline = warmup.pipeline
+    # every slot taken
+    for _ in range(pipeline.max_pending):
+        pipeline._slots.acquire()
+    response = client.get('/similar?track=known')
+    assert response.status_code == 503 and response.headers['Retry-After'] == '1'
+    assert pipeline.stats()['rejected'] == 1
+
+def test_failed_warmup_can_retry(warmup):
+    warmup._steps = lambda: [('catalog', lambda: 1 / 0)]
+
+    def wait_while_warming():
+        deadline = time.time() + 5
+        while warmup.state == 'warming' and time.time() < deadline:
+            time.sleep(0.01)
+
+    with pytest.warns(UserWarning):
+        assert warmup.start()
+        wait_while_warming()
+    progress = warmup.progress()
+    assert progress['state'] == 'failed' and 'ZeroDivisionError' in progress['error']
+
+    # a failed warmup can be started again
+    with pytest.warns(UserWarning):
+        assert warmup.start()
+        wait_while_warming()
+    assert not warmup.ready